@@ -17,7 +17,4 @@ GOOGLE_AD_CREATIVES_DB_FILENAME = "google_ad_creatives.sqlite"
 
 GOOGLE_WINDOW_WIDTH = 1280
 GOOGLE_WINDOW_HEIGHT = 1080
-GOOLGE_TEXT_AD_SCREENSHOTS = "screenshots/text-ads"
-GOOLGE_IMAGE_AD_SCREENSHOTS = "screenshots/image-ads"
-GOOLGE_VIDEO_AD_SCREENSHOTS = "screenshots/video-ads"
-GOOLGE_ERROR_SCREENSHOTS = "screenshots/errors"
+GOOGLE_SCREENSHOTS_FOLDER = "screenshots"
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+ROOT_LOGGER_NAME = "ad_library"
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+DEFAULT_LOG_LEVEL = "INFO"
+LOG_FORMAT = "%(asctime)s %(levelname)-7s [%(name)s] %(message)s%(fields_text)s"
+
+_listener = None
+
+# Appends structured fields (passed as extra = {"fields": {...}}) to the message as key=value pairs
+class StructuredFormatter(logging.Formatter):
+	def format(self, record):
+		fields = record.__dict__["fields"] if "fields" in record.__dict__ else None
+		record.fields_text = "" if not fields else " " + " ".join("{}={}".format(k, fields[k]) for k in sorted(fields.keys()))
+		return super().format(record)
+
+# Per-item messages (passed with extra = {"sample_every": n}) are logged once every n occurrences.
+# Occurrences are counted per logger and message template; warnings and errors are never sampled.
+class SamplingFilter(logging.Filter):
+	def __init__(self):
+		super().__init__()
+		self._lock = threading.Lock()
+		self._counts = {}
+
+	def filter(self, record):
+		sample_every = record.__dict__["sample_every"] if "sample_every" in record.__dict__ else 1
+		if sample_every <= 1 or record.levelno >= logging.WARNING:
+			return True
+		key = (record.name, record.msg)
+		with self._lock:
+			count = self._counts[key] if key in self._counts else 0
+			self._counts[key] = count + 1
+		if count % sample_every == 0:
+			if count > 0:
+				record.msg = "{} (1 of every {})".format(record.msg, sample_every)
+			return True
+		return False
+
+def get_logger(name):
+	return logging.getLogger("{}.{}".format(ROOT_LOGGER_NAME, name))
+
+# Set up logging once, from a command line script. Records are formatted and written by a
+# background thread, so that slow terminals or pipes do not hold up the caller.
+def configure(level = DEFAULT_LOG_LEVEL, filename = None):
+	global _listener
+	assert level in LOG_LEVELS
+	if _listener is not None:
+		_listener.stop()
+
+	formatter = StructuredFormatter(LOG_FORMAT)
+	handlers = [logging.StreamHandler(sys.stdout)]
+	if filename is not None:
+		handlers.append(logging.FileHandler(filename))
+	for handler in handlers:
+		handler.setFormatter(formatter)
+
+	log_queue = queue.Queue(-1)
+	queue_handler = logging.handlers.QueueHandler(log_queue)
+	queue_handler.addFilter(SamplingFilter())
+	root_logger = logging.getLogger(ROOT_LOGGER_NAME)
+	root_logger.handlers = [queue_handler]
+	root_logger.setLevel(level)
+	root_logger.propagate = False
+
+	_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level = True)
+	_listener.start()
+
+def shutdown():
+	global _listener
+	if _listener is not None:
+		_listener.stop()
+		_listener = None
+
+atexit.register(shutdown)
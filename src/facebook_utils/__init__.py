@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 
+from .metrics import MetricsRegistry, METRICS
 from .api_helper import APIHelper
+from .scheduler import PriorityScheduler, FairScheduler, SCHEDULERS
 from .queue_db import QueueDB
 from .queue import QueueManager
 from .rate_limit_db import RateLimitDB
 from .rate_limit import RateLimitManager
+from .page_size import PageSizeController
+from .retry_policy import RetryPolicy
 from .tasks import TaskManager
 from .tokens import TokenManager
+from .token_pool import TokenPool
 from .downloads_db import DownloadsDB
 from .exports_db_1 import ExportsDBv1
+from .pipeline import DownloadPipeline
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
+from common import Log
+
 from datetime import datetime
 import json
 import requests
 import urllib.parse
 
-DASH = "--------------------------------------------------------------------------------"
 URL_BASE = "https://graph.facebook.com/v4.0/ads_archive"
 
+logger = Log.get_logger("APIHelper")
+
 class APIHelper:
 	def __init__(self, verbose = False):
 		self.verbose = verbose
@@ -76,6 +79,7 @@ class APIHelper:
 				"duration": None,
 				"response_header": None,
 				"response_body": None,
+				"response_body_length": None,
 				"response_html": None,
 				"response_error": str(e),
 			}
@@ -91,6 +95,7 @@ class APIHelper:
 				"duration": duration,
 				"response_header": response_header,
 				"response_body": response_body,
+				"response_body_length": len(r.content),
 				"response_html": None,
 				"response_error": None,
 			}
@@ -102,6 +107,7 @@ class APIHelper:
 				"duration": duration,
 				"response_header": response_header,
 				"response_body": None,
+				"response_body_length": None,
 				"response_html": response_html,
 				"response_error": None,
 			}
@@ -118,12 +124,9 @@ class APIHelper:
 				"response": response_error,
 			}
 			finish_log["access_token"] = access_token
+			finish_log["duration"] = response["duration"]
 			finish_log["continuation"] = this_task["continuation"].copy()
-			print()
-			print(DASH)
-			print("[APIHelper] EXCEPTION: Requests connection error")
-			print(DASH)
-			print()
+			logger.warning("Requests connection error", extra = {"fields": {"task_key": this_task["task_key"], "error": response_error}})
 			return (finish_code, finish_log)
 		
 		# Received an HTML document instead of a JSON object
@@ -136,17 +139,16 @@ class APIHelper:
 				"response": response_html,
 			}
 			finish_log["access_token"] = access_token
+			finish_log["duration"] = response["duration"]
 			finish_log["continuation"] = this_task["continuation"].copy()
-			print()
-			print(DASH)
-			print("[APIHelper] EXCEPTION: Received an HTML document instead of a JSON object")
-			print(DASH)
-			print()
+			logger.warning("Received an HTML document instead of a JSON object", extra = {"fields": {"task_key": this_task["task_key"]}})
 			return (finish_code, finish_log)
 
 		response_body = response["response_body"]
 		finish_log = self._parse_response_body(response_body)
 		finish_log["access_token"] = access_token
+		finish_log["duration"] = response["duration"]
+		finish_log["response_body_length"] = response["response_body_length"] if "response_body_length" in response else None
 
 		# Response JSON object contains data
 		if finish_log["has_data"]:
@@ -158,11 +160,7 @@ class APIHelper:
 				finish_log["continuation"]["after_token"] = finish_log["paging_cursor"]
 				finish_log["continuation"]["total_ad_count"] = finish_log["ad_count"] + (finish_log["continuation"]["total_ad_count"] if "total_ad_count" in finish_log["continuation"] else 0)
 
-				print()
-				print(DASH)
-				print("[APIHelper] DATA: Received a page of {:,} ads ({:,} total ads)".format(finish_log["ad_count"], finish_log["continuation"]["total_ad_count"]))
-				print(DASH)
-				print()
+				logger.info("Received a page of {:,} ads ({:,} total ads)".format(finish_log["ad_count"], finish_log["continuation"]["total_ad_count"]), extra = {"fields": {"task_key": this_task["task_key"], "duration": response["duration"]}})
 			
 			# Terminal page
 			else:
@@ -170,11 +168,7 @@ class APIHelper:
 				finish_log["continuation"] = this_task["continuation"].copy()
 				finish_log["continuation"]["total_ad_count"] = finish_log["ad_count"] + (finish_log["continuation"]["total_ad_count"] if "total_ad_count" in finish_log["continuation"] else 0)
 
-				print()
-				print(DASH)
-				print("[APIHelper] DATA: Received final page of {:,} ads ({:,} total ads)".format(finish_log["ad_count"], finish_log["continuation"]["total_ad_count"]))
-				print(DASH)
-				print()
+				logger.info("Received final page of {:,} ads ({:,} total ads)".format(finish_log["ad_count"], finish_log["continuation"]["total_ad_count"]), extra = {"fields": {"task_key": this_task["task_key"], "duration": response["duration"]}})
 		
 		# Response JSON object does not contain data
 		else:
@@ -184,21 +178,14 @@ class APIHelper:
 				finish_code = finish_log["error_code"]
 				finish_log["continuation"] = this_task["continuation"].copy()
 			
-				print()
-				print(DASH)
-				print("[APIHelper] ERROR {}: {}".format(finish_log["error_code"], finish_log["error_message"]))
-				print(DASH)
-				print()
+				logger.warning("Error {}: {}".format(finish_log["error_code"], finish_log["error_message"]), extra = {"fields": {"task_key": this_task["task_key"], "error_subcode": finish_log["error_subcode"]}})
 			
 			# Response JSON object contains neither data nor erorr codes
 			else:
 				finish_code = -10003
+				finish_log["continuation"] = this_task["continuation"].copy()
 				
-				print()
-				print(DASH)
-				print("[APIHelper] UNKNOWN ERROR")
-				print(DASH)
-				print()
+				logger.warning("Unknown error", extra = {"fields": {"task_key": this_task["task_key"]}})
 
 		return (finish_code, finish_log)
 	
@@ -211,6 +198,7 @@ class APIHelper:
 		ad_count = 0
 		paging_cursor = None
 		error_code = None
+		error_subcode = None
 		error_message = None
 		if "data" in response_body:
 			has_data = True
@@ -226,6 +214,7 @@ class APIHelper:
 			has_error = True
 			if "code" in response_body["error"]:
 				error_code = response_body["error"]["code"]
+				error_subcode = response_body["error"]["error_subcode"] if "error_subcode" in response_body["error"] else None
 				error_message = response_body["error"]["message"]
 		return {
 			"has_data": has_data,
@@ -236,5 +225,6 @@ class APIHelper:
 			"ad_count": ad_count,
 			"paging_cursor": paging_cursor,
 			"error_code": error_code,
+			"error_subcode": error_subcode,
 			"error_message": error_message,
 		}
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
-from common import Constants
+from common import Constants, Log
+from facebook_utils.metrics import METRICS, SIZE_BUCKETS
 
 from datetime import datetime
+import hashlib
 import json
 import os
 import sqlite3
 
 # Constants for the ads database
+
+logger = Log.get_logger("DownloadsDB")
 DB_FOLDER = Constants.DOWNLOADS_PATH
 DB_FILENAME = Constants.FACEBOOK_DOWNLOADS_DB_FILENAME
 TABLE_NAME = "all_tasks_table"
@@ -45,7 +49,8 @@ CREATE_TABLE_SQL = """CREATE TABLE "{table}" (
 	"response_body_length" INTEGER,
 	"response_html_filename" TEXT,
 	"response_html_length" INTEGER,
-	"response_error" TEXT
+	"response_error" TEXT,
+	"split_items_key" TEXT
 );""".format(table = TABLE_NAME)
 
 INSERT_TASK_SQL = """INSERT INTO "{table}" (
@@ -58,7 +63,8 @@ INSERT_TASK_SQL = """INSERT INTO "{table}" (
 	"access_token", "ad_count", "paging_cursor", "error_code",
 	"request_url",
 	"request_timestamp", "response_timestamp", "duration",
-	"response_header", "response_body_filename", "response_body_length", "response_html_filename", "response_html_length", "response_error"
+	"response_header", "response_body_filename", "response_body_length", "response_html_filename", "response_html_length", "response_error",
+	"split_items_key"
 ) VALUES (
 	?, ?,
 	?, ?, ?,
@@ -69,9 +75,53 @@ INSERT_TASK_SQL = """INSERT INTO "{table}" (
 	?, ?, ?, ?,
 	?,
 	?, ?, ?,
-	?, ?, ?, ?, ?, ?
+	?, ?, ?, ?, ?, ?,
+	?
+);""".format(table = TABLE_NAME)
+
+# Pages for the same countries or advertisers (and ad active status) share a split_items_key,
+# so that recent pages can be looked up by index without parsing the JSON specs of every page
+CREATE_SPLIT_ITEMS_INDEX_SQL = """CREATE INDEX IF NOT EXISTS "split_items_index" ON "{table}" (
+	"experiment_key" ASC,
+	"split_items_key" ASC,
+	"key" DESC
 );""".format(table = TABLE_NAME)
 
+SELECT_PAGE_STATS_SQL = """SELECT
+	COALESCE(JSON_EXTRACT("attempt_spec", '$.ads_per_page'), JSON_EXTRACT("experiment_spec", '$.ads_per_page')) AS "ads_per_page",
+	"ad_count",
+	"duration",
+	"response_body_length",
+	"finish_code"
+FROM "{table}"
+WHERE "experiment_key" = ? AND "split_items_key" = ?
+ORDER BY "key" DESC
+LIMIT ?;""".format(table = TABLE_NAME)
+
+# Databases created before split_items_key was added get the column, filled in for existing pages.
+# The index on split indexes is replaced by the index on split_items_key.
+SELECT_COLUMN_NAMES_SQL = """PRAGMA table_info("{table}");""".format(table = TABLE_NAME)
+ADD_SPLIT_ITEMS_KEY_SQL = """ALTER TABLE "{table}" ADD COLUMN "split_items_key" TEXT;""".format(table = TABLE_NAME)
+SELECT_SPECS_SQL = """SELECT "key", "experiment_spec", "split_spec" FROM "{table}";""".format(table = TABLE_NAME)
+UPDATE_SPLIT_ITEMS_KEY_SQL = """UPDATE "{table}" SET "split_items_key" = ? WHERE "key" = ?;""".format(table = TABLE_NAME)
+DROP_SPLIT_INDEX_SQL = """DROP INDEX IF EXISTS "split_index_index";"""
+
+DEFAULT_PAGE_STATS_COUNT = 20
+
+# Number of ads per country or advertiser in past runs of an experiment.
+# The ads downloaded by a split are shared evenly among its countries or advertisers.
+# For each item, the largest total across past runs is returned.
+SELECT_AD_COUNTS_SQL = """SELECT "item", MAX("item_ad_count") AS "ad_count" FROM (
+	SELECT
+		JSON_EXTRACT("experiment_spec", '$.experiment_folder') AS "experiment_folder",
+		"items"."value" AS "item",
+		SUM(1.0 * "ad_count" / JSON_ARRAY_LENGTH("split_spec", '$.{{field}}')) AS "item_ad_count"
+	FROM "{table}", JSON_EACH("{table}"."split_spec", '$.{{field}}') AS "items"
+	WHERE "experiment_key" = ? AND "finish_code" IN (0, -1)
+	GROUP BY "experiment_folder", "item"
+)
+GROUP BY "item";""".format(table = TABLE_NAME)
+
 TABLE_EXISTS_SQL = """SELECT COUNT(*) = 1 FROM "sqlite_master" WHERE "type" = "table" AND "name" = "{table}";""".format(table = TABLE_NAME)
 
 class DownloadsDB:
@@ -89,23 +139,24 @@ class DownloadsDB:
 
 	def open(self):
 		if self.verbose:
-			print()
-			print("[DownloadsDB] Connecting to database...")
+			logger.debug("Connecting to database...")
 		self.connection = sqlite3.connect(self.db_path, detect_types = sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
 		self.connection.row_factory = sqlite3.Row
 		self.cursor = self.connection.cursor()
 
 		if not self._has_tables():
 			self._create_tables()
+		elif not self._has_split_items_key():
+			self._add_split_items_key()
+		self.cursor.execute(CREATE_SPLIT_ITEMS_INDEX_SQL)
 
 	def close(self):
 		if self.verbose:
-			print("[DownloadsDB] Committing changes to database...")
+			logger.debug("Committing changes to database...")
 		self.connection.commit()
 
 		if self.verbose:
-			print("[DownloadsDB] Disconnect from database...")
-			print()
+			logger.debug("Disconnect from database...")
 		self.connection.close()
 
 	def _has_tables(self):
@@ -115,11 +166,34 @@ class DownloadsDB:
 		return table_exists
 
 	def _create_tables(self):
-		if self.verbose or verbose:
-			print("[DownloadsDB] Creating table '{}'...".format(TABLE_NAME))
-		print(CREATE_TABLE_SQL)
+		if self.verbose:
+			logger.debug("Creating table '{}'...".format(TABLE_NAME))
+		logger.debug(CREATE_TABLE_SQL)
 		self.cursor.execute(CREATE_TABLE_SQL)
 
+	def _has_split_items_key(self):
+		self.cursor.execute(SELECT_COLUMN_NAMES_SQL)
+		column_names = [row["name"] for row in self.cursor.fetchall()]
+		return "split_items_key" in column_names
+
+	def _add_split_items_key(self):
+		if self.verbose:
+			logger.debug("Adding column 'split_items_key' to table '{}'...".format(TABLE_NAME))
+		self.cursor.execute(ADD_SPLIT_ITEMS_KEY_SQL)
+		self.cursor.execute(SELECT_SPECS_SQL)
+		split_items_keys = [(self._get_split_items_key_from_specs(row["experiment_spec"], row["split_spec"]), row["key"]) for row in self.cursor.fetchall()]
+		self.cursor.executemany(UPDATE_SPLIT_ITEMS_KEY_SQL, split_items_keys)
+		self.cursor.execute(DROP_SPLIT_INDEX_SQL)
+
+	# The countries or advertisers of a split (in order) and its ad active status, hashed
+	def _get_split_items_key(self, items_field, items, ad_active_status):
+		return hashlib.sha1(json.dumps([items_field, items, ad_active_status]).encode("utf-8")).hexdigest()
+
+	def _get_split_items_key_from_specs(self, experiment_spec, split_spec):
+		all_specs = {**self._deserialize_json(experiment_spec), **self._deserialize_json(split_spec)}
+		items_field = "advertisers" if all_specs["search_by_advertisers"] else "countries"
+		return self._get_split_items_key(items_field, all_specs[items_field], all_specs["ad_active_status"])
+
 	def _serialize_json(self, text):
 		return json.dumps(text, indent = 2, sort_keys = True)
 
@@ -169,7 +243,9 @@ class DownloadsDB:
 		if response_body is not None:
 			response_body_filename = "{:s}/task-{:06d}.json".format(data_path, task_key)
 			response_body_str = json.dumps(response_body, indent = 2, sort_keys = True)
-			response_body_length = len(response_body_str)
+			# Size of the body as sent by the API (used to size later pages), rather than as saved to disk
+			response_body_length = response["response_body_length"] if "response_body_length" in response and response["response_body_length"] is not None else len(response_body_str)
+			METRICS.observe("response_body_bytes", response_body_length, buckets = SIZE_BUCKETS)
 			with open(response_body_filename, "w") as f:
 				f.write(response_body_str)
 		else:
@@ -185,6 +261,7 @@ class DownloadsDB:
 			response_html_filename = None
 			response_html_length = None
 		response_error = response["response_error"]
+		split_items_key = self._get_split_items_key_from_specs(experiment_spec, split_spec)
 		
 		self.cursor.execute(INSERT_TASK_SQL, (
 			task_key, task_priority,
@@ -197,4 +274,28 @@ class DownloadsDB:
 			request_url,
 			request_timestamp, response_timestamp, duration,
 			response_header_str, response_body_filename, response_body_length, response_html_filename, response_html_length, response_error,
+			split_items_key,
 		))
+
+	# Recent pages for the same countries or advertisers, in this or earlier runs of an experiment.
+	# Split indexes are not used, as splits are planned anew (from historical ad counts) in each run.
+	def get_page_stats(self, experiment_key, items_field, items, ad_active_status, count = DEFAULT_PAGE_STATS_COUNT):
+		assert isinstance(experiment_key, str)
+		assert items_field in ["countries", "advertisers"]
+		assert isinstance(items, list)
+		assert isinstance(ad_active_status, str)
+		split_items_key = self._get_split_items_key(items_field, items, ad_active_status)
+		self.cursor.execute(SELECT_PAGE_STATS_SQL, (experiment_key, split_items_key, count, ))
+		page_stats = [dict(zip(row.keys(), row)) for row in self.cursor.fetchall()]
+		if self.verbose:
+			logger.debug("Retrieved {} recent pages for {} {} of '{}'".format(len(page_stats), len(items), items_field, experiment_key))
+		return page_stats
+
+	def get_ad_counts(self, experiment_key, items_field):
+		assert isinstance(experiment_key, str)
+		assert items_field in ["countries", "advertisers"]
+		self.cursor.execute(SELECT_AD_COUNTS_SQL.format(field = items_field), (experiment_key, ))
+		ad_counts = {row["item"]: row["ad_count"] for row in self.cursor.fetchall()}
+		if self.verbose:
+			logger.debug("Retrieved historical ad counts for {} {} of '{}'".format(len(ad_counts), items_field, experiment_key))
+		return ad_counts
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from common import Constants
+from common import Constants, Log
 
 from datetime import datetime
 import dateutil.parser
@@ -12,11 +12,16 @@ import sqlite3
 
 AD_ARCHIVE_ID_REGEX = re.compile(r"^.+?id=(\d+)\&.+$")
 
+logger = Log.get_logger("ExportsDBv1")
+
 # Constants for the ads database
 DB_FOLDER = Constants.EXPORTS_PATH
 DB_FILENAME = Constants.FACEBOOK_EXPORTS_DB_V1_FILENAME
 TABLE_NAME = "all_ads"
 
+# Log one of every N "skipping/exporting file" messages
+FILE_LOG_SAMPLE_EVERY = 1000
+
 # SQL statements
 CREATE_ALL_ADS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS "{table}" (
 	"key" INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,
@@ -297,6 +302,8 @@ INSERT_LOG_FILE_SQL = """INSERT OR IGNORE INTO all_log_files (
 
 TABLE_EXISTS_SQL = """SELECT COUNT(*) = 1 FROM "sqlite_master" WHERE "type" = "table" AND "name" = "{table}";""".format(table = TABLE_NAME)
 
+SELECT_AD_COUNTS_BY_ADVERTISER_SQL = """SELECT page_id, COUNT(*) AS ad_count FROM {table} GROUP BY page_id;""".format(table = TABLE_NAME)
+
 POST_PROCESSING_SQL = [
 """DROP TABLE IF EXISTS advertiser_funding_entity_table;
 """,
@@ -346,15 +353,15 @@ class ExportsDBv1:
 		self.db_path = os.path.join(self.db_folder, DB_FILENAME)
 		self.connection = None
 		self.cursor = None
-		self._init_db_folder()
 
+	# Created on open rather than in the constructor, so that checking whether an export exists has no side effects
 	def _init_db_folder(self):
 		os.makedirs(self.db_folder, exist_ok = True)
 
 	def open(self):
 		if self.verbose:
-			print()
-			print("[ExportsDB v1.0] Connecting to database...")
+			logger.debug("Connecting to database...")
+		self._init_db_folder()
 		self.connection = sqlite3.connect(self.db_path, detect_types = sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
 		self.connection.row_factory = sqlite3.Row
 		self.cursor = self.connection.cursor()
@@ -364,16 +371,19 @@ class ExportsDBv1:
 			self._create_indexes()
 			self._create_views()
 
-	def close(self):
-		self._post_process()
+	def exists(self):
+		return os.path.exists(self.db_path)
+
+	def close(self, post_process = True):
+		if post_process:
+			self._post_process()
 
 		if self.verbose:
-			print("[ExportsDB v1.0] Committing changes to database...")
+			logger.debug("Committing changes to database...")
 		self.connection.commit()
 
 		if self.verbose:
-			print("[ExportsDB v1.0] Disconnect from database...")
-			print()
+			logger.debug("Disconnect from database...")
 		self.connection.close()
 
 	def _has_tables(self):
@@ -384,58 +394,58 @@ class ExportsDBv1:
 
 	def _create_tables(self):
 		if self.verbose:
-			print("[ExportsDB v1.0] Creating table '{}'...".format(TABLE_NAME))
-		print(CREATE_ALL_ADS_TABLE_SQL)
+			logger.debug("Creating table '{}'...".format(TABLE_NAME))
+		logger.debug(CREATE_ALL_ADS_TABLE_SQL)
 		self.cursor.execute(CREATE_ALL_ADS_TABLE_SQL)
-		print(CREATE_ALL_CURRENCIES_TABLE_SQL)
+		logger.debug(CREATE_ALL_CURRENCIES_TABLE_SQL)
 		self.cursor.execute(CREATE_ALL_CURRENCIES_TABLE_SQL)
-		print(CREATE_ALL_DATES_TABLE_SQL)
+		logger.debug(CREATE_ALL_DATES_TABLE_SQL)
 		self.cursor.execute(CREATE_ALL_DATES_TABLE_SQL)
-		print(CREATE_ALL_LOG_FILES_TABLE_SQL)
+		logger.debug(CREATE_ALL_LOG_FILES_TABLE_SQL)
 		self.cursor.execute(CREATE_ALL_LOG_FILES_TABLE_SQL)
 
 	def _create_indexes(self):
 		if self.verbose:
-			print("[ExportsDB v1.0] Creating indexes...")
-		print(CREATE_AD_ARCHIVE_ID_INDEX_SQL)
+			logger.debug("Creating indexes...")
+		logger.debug(CREATE_AD_ARCHIVE_ID_INDEX_SQL)
 		self.cursor.execute(CREATE_AD_ARCHIVE_ID_INDEX_SQL)
-		print(CREATE_PAGE_ID_INDEX_SQL)
+		logger.debug(CREATE_PAGE_ID_INDEX_SQL)
 		self.cursor.execute(CREATE_PAGE_ID_INDEX_SQL)
-		print(CREATE_FROM_CURRENCY_INDEX_SQL)
+		logger.debug(CREATE_FROM_CURRENCY_INDEX_SQL)
 		self.cursor.execute(CREATE_FROM_CURRENCY_INDEX_SQL)
 
 	def _create_views(self):
 		if self.verbose:
-			print("[ExportsDB v1.0] Creating views...")
-		print(CREATE_CLEAN_IMPRESSIONS_VIEW_SQL)
+			logger.debug("Creating views...")
+		logger.debug(CREATE_CLEAN_IMPRESSIONS_VIEW_SQL)
 		self.cursor.execute(CREATE_CLEAN_IMPRESSIONS_VIEW_SQL)
-		print(CREATE_CLEAN_SPEND_VIEW_SQL)
+		logger.debug(CREATE_CLEAN_SPEND_VIEW_SQL)
 		self.cursor.execute(CREATE_CLEAN_SPEND_VIEW_SQL)
-		print(CREATE_CLEAN_SPEND_IN_USD_VIEW_SQL)
+		logger.debug(CREATE_CLEAN_SPEND_IN_USD_VIEW_SQL)
 		self.cursor.execute(CREATE_CLEAN_SPEND_IN_USD_VIEW_SQL)
-		print(CREATE_CLEAN_SPEND_IN_EUR_VIEW_SQL)
+		logger.debug(CREATE_CLEAN_SPEND_IN_EUR_VIEW_SQL)
 		self.cursor.execute(CREATE_CLEAN_SPEND_IN_EUR_VIEW_SQL)
-		print(CREATE_CLEAN_SPEND_IN_GBP_VIEW_SQL)
+		logger.debug(CREATE_CLEAN_SPEND_IN_GBP_VIEW_SQL)
 		self.cursor.execute(CREATE_CLEAN_SPEND_IN_GBP_VIEW_SQL)
-		print(CREATE_CLEAN_AD_DELIVERY_VIEW_SQL)
+		logger.debug(CREATE_CLEAN_AD_DELIVERY_VIEW_SQL)
 		self.cursor.execute(CREATE_CLEAN_AD_DELIVERY_VIEW_SQL)
-		print(CREATE_CLEAN_AD_DELIVERY_DURATION_VIEW_SQL)
+		logger.debug(CREATE_CLEAN_AD_DELIVERY_DURATION_VIEW_SQL)
 		self.cursor.execute(CREATE_CLEAN_AD_DELIVERY_DURATION_VIEW_SQL)
-		print(CREATE_CLEAN_DATES_VIEW_SQL)
+		logger.debug(CREATE_CLEAN_DATES_VIEW_SQL)
 		self.cursor.execute(CREATE_CLEAN_DATES_VIEW_SQL)
-		print(CLEAN_CLEAN_OVERLAPS_VIEW_SQL)
+		logger.debug(CLEAN_CLEAN_OVERLAPS_VIEW_SQL)
 		self.cursor.execute(CLEAN_CLEAN_OVERLAPS_VIEW_SQL)
 
-		print(CREATE_ADVERTISER_REPORT_SQL)
+		logger.debug(CREATE_ADVERTISER_REPORT_SQL)
 		self.cursor.execute(CREATE_ADVERTISER_REPORT_SQL)
-		print(CREATE_ADVERTISER_REPORT_BY_DATES_SQL)
+		logger.debug(CREATE_ADVERTISER_REPORT_BY_DATES_SQL)
 		self.cursor.execute(CREATE_ADVERTISER_REPORT_BY_DATES_SQL)
 
 	def _post_process(self):
 		if self.verbose:
-			print("[ExportsDB v1.0] Post processing...")
+			logger.debug("Post processing...")
 		for sql in POST_PROCESSING_SQL:
-			print(sql)
+			logger.debug(sql)
 			self.cursor.execute(sql)
 
 	def _serialize_json(self, text):
@@ -511,6 +521,13 @@ class ExportsDBv1:
 			region_distribution_str,
 		))
 
+	def get_ad_counts_by_advertiser(self):
+		self.cursor.execute(SELECT_AD_COUNTS_BY_ADVERTISER_SQL)
+		ad_counts = {row["page_id"]: row["ad_count"] for row in self.cursor.fetchall()}
+		if self.verbose:
+			logger.debug("Retrieved ad counts for {} advertisers".format(len(ad_counts)))
+		return ad_counts
+
 	def insert_currencies(self):
 		with open(os.path.join("..", "external_files", "currencies.json")) as f:
 			all_data = json.load(f)
@@ -544,9 +561,9 @@ class ExportsDBv1:
 		filenames.sort()
 		for filename in filenames:
 			if filename in existing_filenames:
-				print("skipping file: ", filename)
+				logger.info("Skipping file %s", filename, extra = {"sample_every": FILE_LOG_SAMPLE_EVERY})
 			else:
-				print("exporting file: ", filename)
+				logger.info("Exporting file %s", filename, extra = {"sample_every": FILE_LOG_SAMPLE_EVERY})
 				task_key = int(task_key_regex.search(filename).group(1))
 				with open(filename) as f:
 					response = json.load(f)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import socket
+import threading
+import time
+
+# Histogram buckets (upper bounds)
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0]
+SIZE_BUCKETS = [1024, 16 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024]
+COUNT_BUCKETS = [0, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+# Minimum number of seconds between two writes of the Prometheus text file
+DEFAULT_FLUSH_INTERVAL_SECS = 15.0
+
+# Counters, histograms, timers, and trace spans for the download pipeline.
+# Nothing is recorded until configure() is called with at least one exporter:
+#   - a Prometheus text file (for the node_exporter textfile collector), written on flush()
+#   - a StatsD server, sent one UDP datagram per observation
+#   - a trace file, appended one JSON line per span
+class MetricsRegistry:
+	def __init__(self):
+		self.enabled = False
+		self.prometheus_filename = None
+		self.trace_filename = None
+		self.statsd_address = None
+		self.flush_interval = DEFAULT_FLUSH_INTERVAL_SECS
+		self._socket = None
+		self._lock = threading.Lock()
+		self._counters = {}
+		self._histograms = {}
+		self._buckets = {}
+		self._flush_timestamp = 0.0
+
+	def configure(self, prometheus_filename = None, statsd_address = None, trace_filename = None, flush_interval = DEFAULT_FLUSH_INTERVAL_SECS):
+		assert statsd_address is None or isinstance(statsd_address, tuple)
+		self.prometheus_filename = prometheus_filename
+		self.statsd_address = statsd_address
+		self.trace_filename = trace_filename
+		self.flush_interval = flush_interval
+		if self.statsd_address is not None and self._socket is None:
+			self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.enabled = prometheus_filename is not None or statsd_address is not None or trace_filename is not None
+
+	def _get_key(self, name, labels):
+		return (name, tuple(sorted(labels.items())))
+
+	def _send_statsd(self, name, labels, value, metric_type):
+		if self._socket is None:
+			return
+		stat = ".".join([name] + ["{}_{}".format(k, v) for (k, v) in sorted(labels.items())])
+		try:
+			self._socket.sendto("{}:{}|{}".format(stat, value, metric_type).encode("utf-8"), self.statsd_address)
+		except OSError:
+			pass
+
+	def increment(self, name, value = 1, **labels):
+		if not self.enabled:
+			return
+		key = self._get_key(name, labels)
+		with self._lock:
+			self._counters[key] = self._counters[key] + value if key in self._counters else value
+		self._send_statsd(name, labels, value, "c")
+
+	def observe(self, name, value, buckets = DURATION_BUCKETS, **labels):
+		if not self.enabled or value is None:
+			return
+		key = self._get_key(name, labels)
+		with self._lock:
+			if key not in self._histograms:
+				self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+				self._buckets[name] = buckets
+			histogram = self._histograms[key]
+			for (i, upper_bound) in enumerate(self._buckets[name]):
+				if value <= upper_bound:
+					histogram[0][i] += 1
+			histogram[1] += value
+			histogram[2] += 1
+		if buckets is DURATION_BUCKETS:
+			self._send_statsd(name, labels, round(value * 1000.0, 3), "ms")
+		else:
+			self._send_statsd(name, labels, value, "h")
+
+	@contextmanager
+	def timer(self, name, **labels):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - start, **labels)
+
+	# A timed stage of a task; recorded as a histogram, and as a line in the trace file
+	@contextmanager
+	def span(self, stage, task_key = None, **fields):
+		start_timestamp = datetime.now()
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			duration = time.perf_counter() - start
+			self.observe("stage_duration_seconds", duration, stage = stage)
+			if self.enabled and self.trace_filename is not None:
+				trace = {
+					"stage": stage,
+					"task_key": task_key,
+					"thread": threading.current_thread().name,
+					"start_timestamp": start_timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"),
+					"duration": duration,
+					**fields,
+				}
+				with self._lock:
+					with open(self.trace_filename, "a") as f:
+						f.write(json.dumps(trace, sort_keys = True))
+						f.write("\n")
+
+	def _format_labels(self, labels, extra_labels = ()):
+		labels = list(labels) + list(extra_labels)
+		if len(labels) == 0:
+			return ""
+		return "{" + ",".join("{}=\"{}\"".format(k, str(v).replace("\\", "\\\\").replace("\"", "\\\"")) for (k, v) in labels) + "}"
+
+	def _format_prometheus(self):
+		lines = []
+		with self._lock:
+			names = sorted(set(name for (name, labels) in self._counters.keys()))
+			for name in names:
+				lines.append("# TYPE {} counter".format(name))
+				for (key, value) in sorted(self._counters.items()):
+					if key[0] == name:
+						lines.append("{}{} {}".format(name, self._format_labels(key[1]), value))
+			names = sorted(set(name for (name, labels) in self._histograms.keys()))
+			for name in names:
+				lines.append("# TYPE {} histogram".format(name))
+				for (key, (bucket_counts, total, count)) in sorted(self._histograms.items()):
+					if key[0] == name:
+						for (upper_bound, bucket_count) in zip(self._buckets[name], bucket_counts):
+							lines.append("{}_bucket{} {}".format(name, self._format_labels(key[1], [("le", upper_bound)]), bucket_count))
+						lines.append("{}_bucket{} {}".format(name, self._format_labels(key[1], [("le", "+Inf")]), count))
+						lines.append("{}_sum{} {}".format(name, self._format_labels(key[1]), total))
+						lines.append("{}_count{} {}".format(name, self._format_labels(key[1]), count))
+		return "\n".join(lines) + "\n"
+
+	# Write the Prometheus text file, at most once per flush interval unless forced
+	def flush(self, force = False):
+		if not self.enabled or self.prometheus_filename is None:
+			return
+		now = time.monotonic()
+		if not force and now - self._flush_timestamp < self.flush_interval:
+			return
+		self._flush_timestamp = now
+		text = self._format_prometheus()
+		temp_filename = "{}.tmp".format(self.prometheus_filename)
+		with open(temp_filename, "w") as f:
+			f.write(text)
+		os.replace(temp_filename, self.prometheus_filename)
+
+METRICS = MetricsRegistry()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import math
+
+# Constants for the page size limits
+MAX_ADS_PER_PAGE = 5000
+MIN_ADS_PER_PAGE = 25
+
+# Additive increase after a successful page, up to the limit predicted by the models below
+ADS_PER_PAGE_INCREMENT = 100
+# Multiplicative decrease after a failure
+ADS_PER_PAGE_DECREASE_FACTOR = 0.5
+# Stay below the smallest page size that recently failed
+FAILED_ADS_PER_PAGE_MARGIN = 0.9
+
+# Targets for a single page
+TARGET_PAGE_DURATION_SECS = 30.0
+TARGET_RESPONSE_BODY_LENGTH = 24 * 1024 * 1024
+
+# Minimum number of successful pages needed to fit the latency model
+MIN_MODEL_SAMPLES = 3
+
+# Additive-increase/multiplicative-decrease (AIMD) controller for ads_per_page.
+# Page size is bounded by a latency model (duration = a + b * ad_count, fitted to recent
+# successful pages), by the observed response body size per ad, and by the smallest
+# page size that recently failed.
+class PageSizeController:
+	def __init__(self, target_duration = TARGET_PAGE_DURATION_SECS, target_body_length = TARGET_RESPONSE_BODY_LENGTH):
+		self.target_duration = target_duration
+		self.target_body_length = target_body_length
+
+	def _is_success(self, page_stat):
+		return page_stat["finish_code"] in (0, -1) and page_stat["ad_count"] is not None and page_stat["ad_count"] > 0
+
+	def _get_duration_limit(self, page_stats):
+		samples = [(s["ad_count"], s["duration"]) for s in page_stats if self._is_success(s) and s["duration"] is not None]
+		if len(samples) == 0:
+			return None
+
+		# Least-squares fit of duration = a + b * ad_count
+		n = len(samples)
+		mean_x = sum(x for (x, y) in samples) / n
+		mean_y = sum(y for (x, y) in samples) / n
+		var_x = sum((x - mean_x) ** 2 for (x, y) in samples)
+		if n >= MIN_MODEL_SAMPLES and var_x > 0:
+			b = sum((x - mean_x) * (y - mean_y) for (x, y) in samples) / var_x
+			a = mean_y - b * mean_x
+		else:
+			b = max(y / x for (x, y) in samples)
+			a = 0.0
+		if b <= 0:
+			return None
+		return max(0.0, self.target_duration - max(0.0, a)) / b
+
+	def _get_body_length_limit(self, page_stats):
+		bytes_per_ad = [s["response_body_length"] / s["ad_count"] for s in page_stats if self._is_success(s) and s["response_body_length"] is not None]
+		if len(bytes_per_ad) == 0:
+			return None
+		return self.target_body_length / max(bytes_per_ad)
+
+	def _get_failure_limit(self, page_stats):
+		failed_sizes = [s["ads_per_page"] for s in page_stats if s["finish_code"] is not None and s["finish_code"] > 0 and s["ads_per_page"] is not None]
+		if len(failed_sizes) == 0:
+			return None
+		return min(failed_sizes) * FAILED_ADS_PER_PAGE_MARGIN
+
+	def _get_limit(self, page_stats, include_failures = True):
+		limits = [self._get_duration_limit(page_stats), self._get_body_length_limit(page_stats)]
+		if include_failures:
+			limits.append(self._get_failure_limit(page_stats))
+		limits = [limit for limit in limits if limit is not None]
+		return min(limits) if len(limits) > 0 else None
+
+	def _clamp(self, ads_per_page):
+		return min(MAX_ADS_PER_PAGE, max(MIN_ADS_PER_PAGE, int(ads_per_page)))
+
+	# Page size after a successful page
+	def increase(self, ads_per_page, page_stats = None):
+		ads_per_page = ads_per_page + ADS_PER_PAGE_INCREMENT
+		limit = self._get_limit([] if page_stats is None else page_stats)
+		if limit is not None:
+			ads_per_page = min(ads_per_page, limit)
+		return self._clamp(math.ceil(ads_per_page))
+
+	# Page size after a failed page that should be retried with less data
+	def decrease(self, ads_per_page, page_stats = None):
+		ads_per_page = ads_per_page * ADS_PER_PAGE_DECREASE_FACTOR
+		limit = self._get_limit([] if page_stats is None else page_stats, include_failures = False)
+		if limit is not None:
+			ads_per_page = min(ads_per_page, limit)
+		return self._clamp(math.floor(ads_per_page))
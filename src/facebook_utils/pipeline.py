@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+from common import Log
+from facebook_utils import APIHelper, TaskManager, QueueManager, DownloadsDB, METRICS
+from facebook_utils.metrics import COUNT_BUCKETS
+
+from datetime import datetime, timedelta
+import queue
+import threading
+
+MAX_ITERS = 99999
+TOKEN_CHECK_INTERVAL = timedelta(hours = 1)
+
+# Number of pages that can wait between two stages before the upstream stage blocks
+DEFAULT_QUEUE_SIZE = 4
+
+# Marks the end of the stream of pages in a queue
+STOP = None
+
+logger = Log.get_logger("DownloadPipeline")
+
+# Download loop for the Facebook Ad Library, split into three stages:
+#   fetch    - pick a task and a token, wait for the rate limit, send the request, and parse the response
+#   schedule - plan the task for the next page
+#   persist  - in one queue transaction: record the result, write the response body and headers to the
+#              downloads database, and checkpoint the split by creating the task for the next page
+# A split only advances once its page is on disk. If the runner dies before the transaction commits,
+# the task is still started, resume_splits re-queues it, and the page is downloaded again.
+# The schedule and persist stages run in their own threads, connected by bounded queues, so that
+# database and disk I/O overlap with the next rate-limited wait. Each thread opens its own database
+# connections. In serial mode, the same stages run one after another in the calling thread.
+# In prefetch mode, the schedule stage runs in the calling thread right after the fetch stage, and the
+# next page of a split is requested as soon as its paging cursor is known (within the rate limit of the
+# tokens), while the current page is persisted in the background. The task for the next page only exists
+# in memory until the persist stage checkpoints the current page, which creates it as already started.
+class DownloadPipeline:
+	def __init__(self, token_pool, scheduler = None, verbose = True, serial = False, prefetch = False, queue_size = DEFAULT_QUEUE_SIZE, refresh_tokens = False, stale_task_duration = None):
+		assert isinstance(verbose, bool)
+		assert isinstance(serial, bool)
+		assert isinstance(prefetch, bool)
+		assert not (serial and prefetch)
+		self.verbose = verbose
+		self.serial = serial
+		self.prefetch = prefetch
+		self.stale_task_duration = stale_task_duration
+		self.queue_size = queue_size
+		self.refresh_tokens = refresh_tokens
+		self.scheduler = scheduler
+		self.token_pool = token_pool
+		self.api_helper = APIHelper(verbose = verbose)
+		self.task_manager = TaskManager(verbose = verbose)
+		self.queue_manager = QueueManager(verbose = verbose, scheduler = scheduler)
+
+		self._lock = threading.Lock()
+		self._back_offs = []
+		self._errors = []
+		self.is_out_of_tokens = False
+
+	def _create_stage_managers(self):
+		queue_manager = QueueManager(verbose = self.verbose, scheduler = self.scheduler)
+		downloads_db = DownloadsDB(verbose = self.verbose)
+		return (queue_manager, downloads_db)
+
+	# Stage 1: fetch (always runs in the calling thread)
+	def _fetch(self, task):
+		task_key = task["task_key"]
+
+		# Back off the tokens of previous requests, if required by the retry policy for their error codes.
+		# Other tokens remain available in the meantime.
+		with self._lock:
+			back_offs = self._back_offs
+			self._back_offs = []
+		for (token_label, delay) in back_offs:
+			self.token_pool.back_off(token_label, delay)
+
+		# Pick the user access token with the most remaining bandwidth (and that is not backing off).
+		# The run stops if no healthy token is left, and the task stays in the queue.
+		(token_label, delay) = self.token_pool.get_next_token()
+		if token_label is None:
+			self.is_out_of_tokens = True
+			return None
+		access_token = self.token_pool.get_access_token(token_label)
+
+		# Construct the URL for the Graph API end point.
+		url = self.api_helper.get_url(task, access_token)
+
+		# Query the Graph API end point, obeying the rate limit of the token.
+		# A prefetched task has no task_key yet; it is started when the persist stage creates it.
+		self.token_pool.before_search(token_label, delay = delay)
+		with METRICS.span("fetch", task_key = task_key, token_label = token_label):
+			if task_key is not None:
+				self.queue_manager.start_task(task_key)
+			response = self.api_helper.search(url)
+			self.token_pool.after_search(token_label)
+			(finish_code, finish_log) = self.api_helper.parse_response(task, access_token, response)
+			self.token_pool.report_result(token_label, finish_code)
+		METRICS.observe("request_duration_seconds", response["duration"])
+		METRICS.increment("pages_total", finish_code = finish_code)
+		if "ad_count" in finish_log:
+			METRICS.observe("ads_per_page", finish_log["ad_count"], buckets = COUNT_BUCKETS)
+
+		return {
+			"task": task,
+			"token_label": token_label,
+			"url": url,
+			"response": response,
+			"finish_code": finish_code,
+			"finish_log": finish_log,
+		}
+
+	# Stage 2: schedule
+	def _schedule(self, page, queue_manager, downloads_db):
+		task = page["task"]
+
+		# Plan a new task (if the download task is not completed); it is created by the persist stage.
+		# The page size of the new task is based on recent pages of the same countries or advertisers.
+		with METRICS.span("schedule", task_key = task["task_key"]):
+			with METRICS.timer("db_operation_seconds", db = "downloads", operation = "get_page_stats"):
+				downloads_db.open()
+				all_specs = {**task["experiment_spec"], **task["split_spec"]}
+				items_field = "advertisers" if all_specs["search_by_advertisers"] else "countries"
+				page_stats = downloads_db.get_page_stats(all_specs["experiment_key"], items_field, all_specs[items_field], all_specs["ad_active_status"])
+				downloads_db.close()
+			next_task = self.task_manager.continue_task(task, page["finish_code"], page["finish_log"], page_stats = page_stats)
+			page["next_task"] = next_task
+			page["next_task_retry_delay"] = next_task["retry_delay"] if next_task is not None else 0.0
+
+		if page["next_task_retry_delay"] > 0:
+			with self._lock:
+				self._back_offs.append((page["token_label"], page["next_task_retry_delay"]))
+		return page
+
+	# Stage 3: persist
+	def _persist(self, page, queue_manager, downloads_db):
+		task = page["task"]
+		task_key = task["task_key"]
+		def insert(task_as_dict):
+			with METRICS.timer("db_operation_seconds", db = "downloads", operation = "insert"):
+				downloads_db.open()
+				downloads_db.insert(task_as_dict, page["url"], page["response"])
+				downloads_db.close()
+
+		# The split is checkpointed in the same transaction as the result, once the page is written.
+		# The task of a prefetched page gets its task_key here, before that page reaches this stage.
+		with METRICS.span("persist", task_key = task_key):
+			is_next_task_prefetched = "is_next_task_prefetched" in page and page["is_next_task_prefetched"]
+			page["next_task_key"] = queue_manager.complete_task(task, page["finish_code"], page["finish_log"], page["next_task"], persist = insert, start_next_task = is_next_task_prefetched)
+			if is_next_task_prefetched:
+				page["next_task"]["task_key"] = page["next_task_key"]
+		return page
+
+	# Pages already fetched are processed even after another page failed, so that the queue drains
+	# instead of discarding them. A failed page is not passed on; the fetch loop stops at the next check.
+	def _run_stage(self, stage, in_queue, out_queue):
+		(queue_manager, downloads_db) = self._create_stage_managers()
+		while True:
+			page = in_queue.get()
+			try:
+				if page is STOP:
+					break
+				page = stage(page, queue_manager, downloads_db)
+				if out_queue is not None:
+					out_queue.put(page)
+			except Exception as e:
+				self._errors.append(e)
+				logger.error("%s stage failed: %s", stage.__name__.strip("_"), e, exc_info = True)
+			finally:
+				in_queue.task_done()
+		if out_queue is not None:
+			out_queue.put(STOP)
+
+	def _check_errors(self):
+		if len(self._errors) > 0:
+			raise self._errors[0]
+
+	def _check_tokens(self, token_check_timestamp):
+		if token_check_timestamp is None or datetime.now() - token_check_timestamp >= TOKEN_CHECK_INTERVAL:
+			self.token_pool.check_expiration(auto_refresh = self.refresh_tokens)
+			return datetime.now()
+		return token_check_timestamp
+
+	def _run_serial(self, max_iters):
+		(queue_manager, downloads_db) = self._create_stage_managers()
+		token_check_timestamp = None
+		for iter in range(0, max_iters):
+			token_check_timestamp = self._check_tokens(token_check_timestamp)
+			METRICS.flush()
+			task = self.queue_manager.get_next_active_task()
+			if task is None:
+				break
+			page = self._fetch(task)
+			if page is None:
+				break
+			self._schedule(page, queue_manager, downloads_db)
+			self._persist(page, queue_manager, downloads_db)
+
+	# Follow a split for as long as its next page can be requested right away: after a page with a paging
+	# cursor, and not after an error (a retry may need a delay, or another token). Other splits are picked
+	# by the scheduler as usual.
+	def _run_prefetch(self, max_iters):
+		(queue_manager, downloads_db) = self._create_stage_managers()
+		persist_queue = queue.Queue(maxsize = self.queue_size)
+		thread = threading.Thread(target = self._run_stage, args = (self._persist, persist_queue, None), name = "persist")
+		thread.start()
+
+		prefetched_task = None
+		try:
+			token_check_timestamp = None
+			for iter in range(0, max_iters):
+				self._check_errors()
+				token_check_timestamp = self._check_tokens(token_check_timestamp)
+				METRICS.flush()
+				if prefetched_task is not None:
+					task = prefetched_task
+				else:
+					task = self.queue_manager.get_next_active_task()
+					if task is None:
+						persist_queue.join()
+						self._check_errors()
+						task = self.queue_manager.get_next_active_task()
+						if task is None:
+							break
+				page = self._fetch(task)
+				if page is None:
+					break
+				self._schedule(page, queue_manager, downloads_db)
+				next_task = page["next_task"]
+				page["is_next_task_prefetched"] = page["finish_code"] == 0 and next_task is not None and page["next_task_retry_delay"] == 0
+				if page["is_next_task_prefetched"]:
+					next_task["task_key"] = None
+				persist_queue.put(page)
+				prefetched_task = next_task if page["is_next_task_prefetched"] else None
+		finally:
+			persist_queue.put(STOP)
+			thread.join()
+			# A task that was created as started but never requested goes back to the queue
+			if prefetched_task is not None and prefetched_task["task_key"] is not None:
+				self.queue_manager.restart_task(prefetched_task["task_key"])
+		self._check_errors()
+
+	def _run_threaded(self, max_iters):
+		schedule_queue = queue.Queue(maxsize = self.queue_size)
+		persist_queue = queue.Queue(maxsize = self.queue_size)
+		threads = [
+			threading.Thread(target = self._run_stage, args = (self._schedule, schedule_queue, persist_queue), name = "schedule"),
+			threading.Thread(target = self._run_stage, args = (self._persist, persist_queue, None), name = "persist"),
+		]
+		for thread in threads:
+			thread.start()
+
+		try:
+			token_check_timestamp = None
+			for iter in range(0, max_iters):
+				self._check_errors()
+				token_check_timestamp = self._check_tokens(token_check_timestamp)
+				METRICS.flush()
+				task = self.queue_manager.get_next_active_task()
+				if task is None:
+					# The next page of a split is only queued once the persist stage has processed
+					# the current page, so wait for both stages to drain before concluding that we are done.
+					schedule_queue.join()
+					persist_queue.join()
+					self._check_errors()
+					task = self.queue_manager.get_next_active_task()
+					if task is None:
+						break
+				page = self._fetch(task)
+				if page is None:
+					break
+				schedule_queue.put(page)
+		finally:
+			schedule_queue.put(STOP)
+			for thread in threads:
+				thread.join()
+		self._check_errors()
+
+	def run(self, max_iters = MAX_ITERS):
+		logger.info("Running in %s mode", "serial" if self.serial else "prefetch" if self.prefetch else "threaded")
+
+		# Resume splits that were interrupted by a previous run.
+		# Unless other runners share the queue (stale_task_duration is set), all started tasks are re-queued.
+		self.queue_manager.resume_splits(stale_task_duration = self.stale_task_duration)
+
+		try:
+			if self.serial:
+				self._run_serial(max_iters)
+			elif self.prefetch:
+				self._run_prefetch(max_iters)
+			else:
+				self._run_threaded(max_iters)
+		finally:
+			METRICS.flush(force = True)
@@ -1,34 +1,40 @@
 #!/usr/bin/env python3
 
-from facebook_utils import QueueDB
+from common import Log
+from facebook_utils import QueueDB, METRICS
+
+from datetime import datetime, timedelta
+
+# When several runners share a queue, started tasks older than this are considered interrupted
+STALE_TASK_DURATION = timedelta(minutes = 30)
+
+logger = Log.get_logger("QueueManager")
 
 class QueueManager:
-	def __init__(self, db_folder = None, verbose = True):
+	def __init__(self, db_folder = None, verbose = True, scheduler = None):
 		assert isinstance(verbose, bool)
 		self.verbose = verbose
-		self._db = QueueDB(db_folder = db_folder, verbose = False)
+		self._db = QueueDB(db_folder = db_folder, verbose = False, scheduler = scheduler)
 
 	def get_task(self, task_key):
-		self._db.open()
-		task = self._db.get_task(task_key)
-		self._db.close()
+		with METRICS.timer("db_operation_seconds", db = "queue", operation = "get_task"):
+			self._db.open()
+			task = self._db.get_task(task_key)
+			self._db.close()
 		if self.verbose:
-			print("[QueueManager] Retrieved task #{}".format(task_key))
+			logger.debug("Retrieved task #{}".format(task_key))
 		return task
 		
 	def get_next_active_task(self):
-		self._db.open()
-		task_count = self._db.get_active_task_count()
-		if task_count > 0:
+		with METRICS.timer("db_operation_seconds", db = "queue", operation = "get_next_active_task"):
+			self._db.open()
 			task = self._db.get_next_active_task()
-		else:
-			task = None
-		self._db.close()
+			self._db.close()
 		if self.verbose:
 			if task is None:
-				print("[QueueManager] No active tasks.")
+				logger.debug("No active tasks.")
 			else:
-				print("[QueueManager] Retrieved task #{} (next active task)".format(task["task_key"]))
+				logger.debug("Retrieved task #{} (next active task)".format(task["task_key"]))
 		return task
 
 	def amend_task(self, task_key, finish_code, finish_log):
@@ -36,55 +42,111 @@ class QueueManager:
 		self._db.amend_task(task_key, finish_code, finish_log)
 		self._db.close()
 		if self.verbose:
-			print("[QueueManager] Amended task #{}".format(task_key))
+			logger.debug("Amended task #{}".format(task_key))
 
 	def start_task(self, task_key):
-		self._db.open()
-		self._db.start_task(task_key)
-		self._db.close()
+		with METRICS.timer("db_operation_seconds", db = "queue", operation = "start_task"):
+			self._db.open()
+			self._db.start_task(task_key)
+			self._db.close()
 		if self.verbose:
-			print("[QueueManager] Started task #{}".format(task_key))
+			logger.debug("Started task #{}".format(task_key))
 
 	def finish_task(self, task_key):
 		self._db.open()
 		self._db.finish_task(task_key)
 		self._db.close()
 		if self.verbose:
-			print("[QueueManager] Finished task #{}".format(task_key))
+			logger.debug("Finished task #{}".format(task_key))
 
 	def cancel_task(self, task_key):
 		self._db.open()
 		self._db.cancel_task(task_key)
 		self._db.close()
 		if self.verbose:
-			print("[QueueManager] Cancelled task #{}".format(task_key))
+			logger.debug("Cancelled task #{}".format(task_key))
 
 	def restart_task(self, task_key):
 		self._db.open()
 		self._db.restart_task(task_key)
 		self._db.close()
 		if self.verbose:
-			print("[QueueManager] Restarted task #{}".format(task_key))
+			logger.debug("Restarted task #{}".format(task_key))
 
 	def get_task_as_dict(self, task_key):
-		self._db.open()
-		task = self._db.get_task_as_dict(task_key)
-		self._db.close()
+		with METRICS.timer("db_operation_seconds", db = "queue", operation = "get_task_as_dict"):
+			self._db.open()
+			task = self._db.get_task_as_dict(task_key)
+			self._db.close()
 		if self.verbose:
-			print("[QueueManager] Retrieved task #{} as a dict".format(task_key))
+			logger.debug("Retrieved task #{} as a dict".format(task_key))
 		return task
 
 	def create_task(self, experiment_spec, split_spec, page_spec, attempt_spec, continuation):
 		self._db.open()
-		self._db.create_task(experiment_spec, split_spec, page_spec, attempt_spec, continuation)
+		task_key = self._db.create_task(experiment_spec, split_spec, page_spec, attempt_spec, continuation)
+		self._db.close()
+		if self.verbose:
+			logger.debug("Create a new task.")
+		return task_key
+
+	# Record the result of a task and advance its split, in a single transaction: finish the task, record its result,
+	# and create the task for the next page (or mark the split as finished). If persist is given, it is called with
+	# the task (as a dict, with its result) before the split is advanced, so that the page is stored before the split
+	# moves past it. If anything fails, nothing is committed and the task stays started; resume_splits re-queues it.
+	# With start_next_task, the next task is created as started, for a runner that has already requested its page.
+	def complete_task(self, this_task, finish_code, finish_log, next_task, persist = None, start_next_task = False):
+		task_key = this_task["task_key"]
+		with METRICS.timer("db_operation_seconds", db = "queue", operation = "complete_task"):
+			self._db.open()
+			try:
+				self._db.finish_task(task_key)
+				self._db.amend_task(task_key, finish_code, finish_log)
+				if persist is not None:
+					persist(self._db.get_task_as_dict(task_key))
+				if next_task is None:
+					experiment_folder = this_task["experiment_spec"]["experiment_folder"]
+					split_index = this_task["split_spec"]["split_index"]
+					self._db.finish_split(experiment_folder, split_index)
+					next_task_key = None
+				else:
+					experiment_spec = next_task["experiment_spec"]
+					split_spec = next_task["split_spec"]
+					page_spec = next_task["page_spec"]
+					attempt_spec = next_task["attempt_spec"]
+					continuation = next_task["continuation"]
+					next_task_key = self._db.create_task(experiment_spec, split_spec, page_spec, attempt_spec, continuation)
+					if start_next_task:
+						self._db.start_task(next_task_key)
+			except:
+				self._db.rollback()
+				raise
+			self._db.close()
+		if self.verbose:
+			if next_task_key is None:
+				logger.debug("Completed task #{} (final task of the split)".format(task_key))
+			else:
+				logger.debug("Completed task #{} (next task #{})".format(task_key, next_task_key))
+		return next_task_key
+
+	# Without a stale_task_duration, every started but unfinished task is re-queued, which is only safe
+	# at startup when a single runner uses the queue. Runners that share a queue should pass a duration
+	# (e.g., STALE_TASK_DURATION) longer than any request, so that tasks in flight elsewhere are left alone.
+	def resume_splits(self, stale_task_duration = None):
+		assert stale_task_duration is None or isinstance(stale_task_duration, timedelta)
+		stale_timestamp = None if stale_task_duration is None else (datetime.now() - stale_task_duration).strftime("%Y-%m-%d %H:%M:%S")
+		self._db.open()
+		resumed_count = self._db.resume_splits(stale_timestamp)
 		self._db.close()
 		if self.verbose:
-			print("[QueueManager] Create a new task.")
+			logger.debug("Resumed {} interrupted tasks".format(resumed_count))
+		return resumed_count
 
 	def create_tasks(self, experiment_spec, split_specs, page_spec, attempt_spec, continuation):
+		# split_specs can be any iterable (e.g., TaskManager.iter_splits); all tasks are created in one transaction
 		self._db.open()
-		for split_spec in split_specs:
-			self._db.create_task(experiment_spec, split_spec, page_spec, attempt_spec, continuation)
+		task_keys = self._db.create_tasks_bulk(experiment_spec, split_specs, page_spec, attempt_spec, continuation)
 		self._db.close()
 		if self.verbose:
-			print("[QueueManager] Create {} new tasks.".format(len(split_specs)))
+			logger.debug("Create {} new tasks.".format(len(task_keys)))
+		return task_keys
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
-from common import Constants
+from common import Constants, Log
+from facebook_utils import PriorityScheduler
+from facebook_utils.scheduler import CREATE_SPLITS_TABLE_SQL, CREATE_EXPERIMENTS_TABLE_SQL, UPSERT_SPLIT_SERVICE_SQL, UPSERT_EXPERIMENT_SERVICE_SQL
 
 import configparser
 import json
@@ -8,6 +10,8 @@ import os
 import sqlite3
 
 # Constants for the queue database
+
+logger = Log.get_logger("QueueDB")
 DB_FOLDER = Constants.DB_PATH
 DB_FILENAME = Constants.FACEBOOK_QUEUE_DB_FILENAME
 
@@ -22,6 +26,7 @@ CANCELLED_TASKS = "cancelled_tasks"
 ACTIVE_TASK_COUNT = "active_task_count"
 NEXT_ACTIVE_TASK = "next_active_task"
 ANY_TASK = "any_task"
+CHECKPOINTS_TABLE_NAME = "split_checkpoints_table"
 
 # CANCELLED - (*, *, *, 1)
 #   Any normal task can be manually cancelled by setting cancelled = 1.
@@ -87,16 +92,18 @@ INSERT_CREATE_NORMAL_TASK_SQL = """INSERT INTO {table} (
 	?
 );""".format(table = TABLE_NAME)
 
+# Failed tasks are kept as a record of the failure, but cancelled so that they are never scheduled
+# (or resumed by resume_splits). Call restart_task to retry a failed task.
 INSERT_CREATE_FAILED_TASK_SQL = """INSERT INTO {table} (
 	creation_timestamp,
-	task_priority, is_task_failed,
+	task_priority, is_task_failed, is_task_cancelled,
 	experiment_key, split_index, page_index, page_attempt, attempt_index,
 	experiment_spec, split_spec, page_spec, attempt_spec,
 	continuation,
 	experiment_folder
 ) VALUES (
 	DATETIME('NOW', 'LOCALTIME'),
-	?, 1,
+	?, 1, 1,
 	?, ?, ?, ?, ?,
 	?, ?, ?, ?,
 	?,
@@ -250,12 +257,75 @@ CREATE_EXPERIMENT_REPORTS_VIEW_SQL = """CREATE VIEW experiment_reports AS
 	ORDER BY creation_timestamp DESC
 ;""".format(table = TABLE_NAME)
 
+# Each split has one checkpoint, pointing to the most recently created task of the split.
+# The checkpoint is updated in the same transaction that creates the task, so the task
+# (and its continuation, which holds the paging cursor) can always be recovered on restart.
+CREATE_CHECKPOINTS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS "{table}" (
+	"experiment_folder" TEXT NOT NULL,
+	"split_index" INTEGER NOT NULL,
+	"task_key" INTEGER NOT NULL,
+	"page_index" INTEGER NOT NULL,
+	"after_token" TEXT DEFAULT NULL,
+	"total_ad_count" INTEGER DEFAULT NULL,
+	"is_split_finished" BOOLEAN NOT NULL DEFAULT 0,
+	"checkpoint_timestamp" DATETIME NOT NULL DEFAULT (DATETIME('NOW', 'LOCALTIME')),
+	PRIMARY KEY ("experiment_folder", "split_index")
+);""".format(table = CHECKPOINTS_TABLE_NAME)
+
+REPLACE_CHECKPOINT_SQL = """REPLACE INTO {table} (
+	experiment_folder, split_index,
+	task_key, page_index, after_token, total_ad_count,
+	is_split_finished, checkpoint_timestamp
+) VALUES (
+	?, ?,
+	?, ?, ?, ?,
+	0, DATETIME('NOW', 'LOCALTIME')
+);""".format(table = CHECKPOINTS_TABLE_NAME)
+
+# Checkpoints for all tasks created after a given task_key (see QueueDB.create_tasks_bulk)
+REPLACE_BULK_CHECKPOINTS_SQL = """REPLACE INTO {checkpoints} (
+	experiment_folder, split_index,
+	task_key, page_index, after_token, total_ad_count,
+	is_split_finished, checkpoint_timestamp
+) SELECT
+	experiment_folder, split_index,
+	task_key, page_index, JSON_EXTRACT(continuation, '$.after_token'), JSON_EXTRACT(continuation, '$.total_ad_count'),
+	0, DATETIME('NOW', 'LOCALTIME')
+	FROM {table}
+	WHERE task_key > ?
+	ORDER BY task_key ASC
+;""".format(table = TABLE_NAME, checkpoints = CHECKPOINTS_TABLE_NAME)
+
+SELECT_MAX_TASK_KEY_SQL = """SELECT COALESCE(MAX(task_key), 0) AS task_key FROM {table};""".format(table = TABLE_NAME)
+SELECT_TASK_KEYS_AFTER_SQL = """SELECT task_key FROM {table} WHERE task_key > ? ORDER BY task_key ASC;""".format(table = TABLE_NAME)
+
+UPDATE_FINISH_SPLIT_SQL = """UPDATE {table} SET
+	is_split_finished = 1,
+	checkpoint_timestamp = (DATETIME('NOW', 'LOCALTIME'))
+WHERE experiment_folder = ? AND split_index = ?
+;""".format(table = CHECKPOINTS_TABLE_NAME)
+
+# Tasks that were started but never finished (the runner died during the request).
+# With a NULL timestamp, all such tasks are selected; otherwise, only those started before the timestamp.
+SELECT_STALE_STARTED_TASKS_SQL = """SELECT task_key FROM {table}
+	WHERE is_task_cancelled = 0 AND is_task_started = 1 AND is_task_finished = 0 AND (? IS NULL OR start_timestamp < ?)
+	ORDER BY task_key ASC
+;""".format(table = TABLE_NAME)
+
+# Splits whose latest task finished without a follow-up task or a terminal page
+SELECT_BROKEN_SPLITS_SQL = """SELECT checkpoints.task_key AS task_key FROM {checkpoints} AS checkpoints
+	INNER JOIN {table} AS tasks ON checkpoints.task_key = tasks.task_key
+	WHERE checkpoints.is_split_finished = 0 AND tasks.is_task_cancelled = 0 AND tasks.is_task_finished = 1
+	ORDER BY checkpoints.task_key ASC
+;""".format(table = TABLE_NAME, checkpoints = CHECKPOINTS_TABLE_NAME)
+
 TABLE_EXISTS_SQL = """SELECT COUNT(*) = 1 FROM sqlite_master WHERE type = "table" AND name = "{table}";""".format(table = TABLE_NAME)
 
 class QueueDB:
-	def __init__(self, db_folder = None, verbose = True):
+	def __init__(self, db_folder = None, verbose = True, scheduler = None):
 		assert isinstance(verbose, bool)
 		self.verbose = verbose
+		self.scheduler = PriorityScheduler() if scheduler is None else scheduler
 		self.db_folder = DB_FOLDER if db_folder is None else db_folder
 		self.db_path = os.path.join(self.db_folder, DB_FILENAME)
 		self.connection = None
@@ -273,46 +343,46 @@ class QueueDB:
 
 	def _create_tables(self):
 		if self.verbose:
-			print("[QueueDB] Creating table '{}'...".format(TABLE_NAME))
-		print(CREATE_TABLE_SQL)
+			logger.debug("Creating table '{}'...".format(TABLE_NAME))
+		logger.debug(CREATE_TABLE_SQL)
 		self.cursor.execute(CREATE_TABLE_SQL)
 
 	def _create_indexes(self):
 		if self.verbose:
-			print("[QueueDB] Creating indexes...")
-		print(CREATE_ACTIVE_TASKS_INDEX_SQL)
+			logger.debug("Creating indexes...")
+		logger.debug(CREATE_ACTIVE_TASKS_INDEX_SQL)
 		self.cursor.execute(CREATE_ACTIVE_TASKS_INDEX_SQL)
-		print(CREATE_FAILED_TASKS_INDEX_SQL)
+		logger.debug(CREATE_FAILED_TASKS_INDEX_SQL)
 		self.cursor.execute(CREATE_FAILED_TASKS_INDEX_SQL)
-		print(CREATE_CANCELLED_TASKS_INDEX_SQL)
+		logger.debug(CREATE_CANCELLED_TASKS_INDEX_SQL)
 		self.cursor.execute(CREATE_CANCELLED_TASKS_INDEX_SQL)
-		print(CREATE_QUEUED_TASKS_INDEX_SQL)
+		logger.debug(CREATE_QUEUED_TASKS_INDEX_SQL)
 		self.cursor.execute(CREATE_QUEUED_TASKS_INDEX_SQL)
-		print(CREATE_STARTED_TASKS_INDEX_SQL)
+		logger.debug(CREATE_STARTED_TASKS_INDEX_SQL)
 		self.cursor.execute(CREATE_STARTED_TASKS_INDEX_SQL)
-		print(CREATE_FINISHED_TASKS_INDEX_SQL)
+		logger.debug(CREATE_FINISHED_TASKS_INDEX_SQL)
 		self.cursor.execute(CREATE_FINISHED_TASKS_INDEX_SQL)
 
 	def _create_views(self):
 		if self.verbose:
-			print("[QueueDB] Creating views...")
-		print(CREATE_ACTIVE_TASKS_VIEW_SQL)
+			logger.debug("Creating views...")
+		logger.debug(CREATE_ACTIVE_TASKS_VIEW_SQL)
 		self.cursor.execute(CREATE_ACTIVE_TASKS_VIEW_SQL)
-		print(CREATE_QUEUED_TASKS_VIEW_SQL)
+		logger.debug(CREATE_QUEUED_TASKS_VIEW_SQL)
 		self.cursor.execute(CREATE_QUEUED_TASKS_VIEW_SQL)
-		print(CREATE_FAILED_TASKS_VIEW_SQL)
+		logger.debug(CREATE_FAILED_TASKS_VIEW_SQL)
 		self.cursor.execute(CREATE_FAILED_TASKS_VIEW_SQL)
-		print(CREATE_CANCELLED_TASKS_VIEW_SQL)
+		logger.debug(CREATE_CANCELLED_TASKS_VIEW_SQL)
 		self.cursor.execute(CREATE_CANCELLED_TASKS_VIEW_SQL)
-		print(CREATE_STARTED_TASKS_VIEW_SQL)
+		logger.debug(CREATE_STARTED_TASKS_VIEW_SQL)
 		self.cursor.execute(CREATE_STARTED_TASKS_VIEW_SQL)
-		print(CREATE_FINISHED_TASKS_VIEW_SQL)
+		logger.debug(CREATE_FINISHED_TASKS_VIEW_SQL)
 		self.cursor.execute(CREATE_FINISHED_TASKS_VIEW_SQL)
-		print(CREATE_NEXT_ACTIVE_TASK_VIEW_SQL)
+		logger.debug(CREATE_NEXT_ACTIVE_TASK_VIEW_SQL)
 		self.cursor.execute(CREATE_NEXT_ACTIVE_TASK_VIEW_SQL)
-		print(CREATE_ACTIVE_TASK_COUNT_VIEW_SQL)
+		logger.debug(CREATE_ACTIVE_TASK_COUNT_VIEW_SQL)
 		self.cursor.execute(CREATE_ACTIVE_TASK_COUNT_VIEW_SQL)
-		print(CREATE_EXPERIMENT_REPORTS_VIEW_SQL)
+		logger.debug(CREATE_EXPERIMENT_REPORTS_VIEW_SQL)
 		self.cursor.execute(CREATE_EXPERIMENT_REPORTS_VIEW_SQL)
 
 	def _serialize_json(self, text):
@@ -323,8 +393,7 @@ class QueueDB:
 
 	def open(self):
 		if self.verbose:
-			print()
-			print("[QueueDB] Connecting to database...")
+			logger.debug("Connecting to database...")
 		self.connection = sqlite3.connect(self.db_path, detect_types = sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
 		self.connection.row_factory = sqlite3.Row
 		self.cursor = self.connection.cursor()
@@ -333,20 +402,31 @@ class QueueDB:
 			self._create_tables()
 			self._create_indexes()
 			self._create_views()
+		self.cursor.execute(CREATE_SPLITS_TABLE_SQL)
+		self.cursor.execute(CREATE_EXPERIMENTS_TABLE_SQL)
+		self.cursor.execute(CREATE_CHECKPOINTS_TABLE_SQL)
 
 	def close(self):
 		if self.verbose:
-			print("[QueueDB] Committing changes to database...")
+			logger.debug("Committing changes to database...")
 		self.connection.commit()
 
 		if self.verbose:
-			print("[QueueDB] Disconnecting from database...")
-			print()
+			logger.debug("Disconnecting from database...")
+		self.connection.close()
+
+	def rollback(self):
+		if self.verbose:
+			logger.debug("Rolling back changes to database...")
+		self.connection.rollback()
+
+		if self.verbose:
+			logger.debug("Disconnecting from database...")
 		self.connection.close()
 
 	def create_task(self, experiment_spec, split_spec, page_spec, attempt_spec, continuation):
 		if self.verbose:
-			print("[QueueDB] Creating a new task...")
+			logger.debug("Creating a new task...")
 
 		all_specs = {**experiment_spec, **split_spec, **page_spec, **attempt_spec, **continuation}
 		task_priority = all_specs["task_priority"]
@@ -378,34 +458,125 @@ class QueueDB:
 			continuation_str,
 			experiment_folder,
 		))
+		task_key = self.cursor.lastrowid
+
+		after_token = continuation["after_token"] if "after_token" in continuation else None
+		total_ad_count = continuation["total_ad_count"] if "total_ad_count" in continuation else None
+		self.cursor.execute(REPLACE_CHECKPOINT_SQL, (experiment_folder, split_index, task_key, page_index, after_token, total_ad_count, ))
+		return task_key
+
+	# Create one task per split in a single transaction.
+	# The experiment, page, attempt, and continuation specs are shared by all tasks and serialized once.
+	def create_tasks_bulk(self, experiment_spec, split_specs, page_spec, attempt_spec, continuation):
+		if self.verbose:
+			logger.debug("Creating new tasks in bulk...")
+
+		all_specs = {**experiment_spec, **page_spec, **attempt_spec, **continuation}
+		task_priority = all_specs["task_priority"]
+		experiment_key = all_specs["experiment_key"]
+		page_index = all_specs["page_index"]
+		page_attempt = all_specs["page_attempt"]
+		attempt_index = all_specs["attempt_index"]
+		experiment_folder = all_specs["experiment_folder"]
+		assert isinstance(task_priority, int)
+		assert isinstance(experiment_key, str)
+		assert isinstance(page_index, int)
+		assert isinstance(page_attempt, int)
+		assert isinstance(attempt_index, int)
+		assert isinstance(experiment_folder, str)
+
+		experiment_spec_str = self._serialize_json(experiment_spec)
+		page_spec_str = self._serialize_json(page_spec)
+		attempt_spec_str = self._serialize_json(attempt_spec)
+		continuation_str = self._serialize_json(continuation)
+		is_task_failed = continuation["is_task_failed"] if "is_task_failed" in continuation else False
+
+		def get_rows():
+			for split_spec in split_specs:
+				split_index = split_spec["split_index"]
+				assert isinstance(split_index, int)
+				yield (task_priority,
+					experiment_key, split_index, page_index, page_attempt, attempt_index,
+					experiment_spec_str, self._serialize_json(split_spec), page_spec_str, attempt_spec_str,
+					continuation_str,
+					experiment_folder,
+				)
+
+		# Take the write lock before reading the largest task_key, so that no other writer can interleave
+		if not self.connection.in_transaction:
+			self.cursor.execute("BEGIN IMMEDIATE")
+		self.cursor.execute(SELECT_MAX_TASK_KEY_SQL)
+		max_task_key = self.cursor.fetchone()["task_key"]
+
+		sql = INSERT_CREATE_FAILED_TASK_SQL if is_task_failed else INSERT_CREATE_NORMAL_TASK_SQL
+		self.cursor.executemany(sql, get_rows())
+		self.cursor.execute(REPLACE_BULK_CHECKPOINTS_SQL, (max_task_key, ))
+
+		self.cursor.execute(SELECT_TASK_KEYS_AFTER_SQL, (max_task_key, ))
+		task_keys = [row["task_key"] for row in self.cursor.fetchall()]
+		if self.verbose:
+			logger.debug("Created {} tasks (#{} to #{})".format(len(task_keys), task_keys[0], task_keys[-1]) if len(task_keys) > 0 else "Created 0 tasks")
+		return task_keys
+
+	def finish_split(self, experiment_folder, split_index):
+		if self.verbose:
+			logger.debug("Finishing split #{} of {}...".format(split_index, experiment_folder))
+		assert isinstance(experiment_folder, str)
+		assert isinstance(split_index, int)
+		self.cursor.execute(UPDATE_FINISH_SPLIT_SQL, (experiment_folder, split_index, ))
+
+	def resume_splits(self, stale_timestamp = None):
+		if self.verbose:
+			logger.debug("Resuming interrupted splits...")
+		assert stale_timestamp is None or isinstance(stale_timestamp, str)
+
+		# Re-queue tasks that were interrupted during the request
+		self.cursor.execute(SELECT_STALE_STARTED_TASKS_SQL, (stale_timestamp, stale_timestamp, ))
+		stale_task_keys = [row["task_key"] for row in self.cursor.fetchall()]
+		for task_key in stale_task_keys:
+			self.restart_task(task_key)
+
+		# Re-create the last checkpointed task of splits whose chain was broken
+		self.cursor.execute(SELECT_BROKEN_SPLITS_SQL)
+		broken_task_keys = [row["task_key"] for row in self.cursor.fetchall()]
+		for task_key in broken_task_keys:
+			task = self.get_task(task_key)
+			self.create_task(task["experiment_spec"], task["split_spec"], task["page_spec"], task["attempt_spec"], task["continuation"])
+
+		if self.verbose:
+			logger.debug("Restarted {} stale tasks and resumed {} broken splits".format(len(stale_task_keys), len(broken_task_keys)))
+		return len(stale_task_keys) + len(broken_task_keys)
 
 	def start_task(self, task_key):
 		if self.verbose:
-			print("[QueueDB] Starting task #{}...".format(task_key))
+			logger.debug("Starting task #{}...".format(task_key))
 		assert isinstance(task_key, int)
 		self.cursor.execute(UPDATE_START_TASK_SQL, (task_key, ))
+		if self.cursor.rowcount > 0:
+			self.cursor.execute(UPSERT_SPLIT_SERVICE_SQL, (task_key, ))
+			self.cursor.execute(UPSERT_EXPERIMENT_SERVICE_SQL, (task_key, ))
 
 	def finish_task(self, task_key):
 		if self.verbose:
-			print("[QueueDB] Finishing task #{}...".format(task_key))
+			logger.debug("Finishing task #{}...".format(task_key))
 		assert isinstance(task_key, int)
 		self.cursor.execute(UPDATE_FINISH_TASK_SQL, (task_key, ))
 	
 	def cancel_task(self, task_key):
 		if self.verbose:
-			print("[QueueDB] Cancelling task #{}...".format(task_key))
+			logger.debug("Cancelling task #{}...".format(task_key))
 		assert isinstance(task_key, int)
 		self.cursor.execute(UPDATE_CANCEL_TASK_SQL, (task_key, ))
 
 	def restart_task(self, task_key):
 		if self.verbose:
-			print("[QueueDB] Restarting task #{}...".format(task_key))
+			logger.debug("Restarting task #{}...".format(task_key))
 		assert isinstance(task_key, int)
 		self.cursor.execute(UPDATE_RESTART_TASK_SQL, (task_key, ))
 	
 	def amend_task(self, task_key, finish_code, finish_log):
 		if self.verbose:
-			print("[QueueDB] Amending task #{} with logging information...".format(task_key))
+			logger.debug("Amending task #{} with logging information...".format(task_key))
 		assert isinstance(task_key, int)
 		assert isinstance(finish_code, int)
 
@@ -427,28 +598,30 @@ class QueueDB:
 
 	def get_active_task_count(self):
 		if self.verbose:
-			print("[QueueDB] Counting active tasks...")
+			logger.debug("Counting active tasks...")
 		self.cursor.execute("SELECT * FROM {};".format(ACTIVE_TASK_COUNT))
 		one_row = self.cursor.fetchone()
 		task_count = one_row["task_count"]
 		if self.verbose:
-			print("    Counted {} active tasks".format(task_count))
+			logger.debug("Counted {} active tasks".format(task_count))
 		return task_count
 
 	def get_next_active_task(self):
 		if self.verbose:
-			print("[QueueDB] Getting the next active task...")
-		self.cursor.execute("SELECT task_key FROM {};".format(NEXT_ACTIVE_TASK))
-		one_row = self.cursor.fetchone()
-		task_key = one_row["task_key"]
+			logger.debug("Getting the next active task ({} scheduler)...".format(self.scheduler.name))
+		task_key = self.scheduler.get_next_task_key(self.cursor)
+		if task_key is None:
+			if self.verbose:
+				logger.debug("No active tasks")
+			return None
 		if self.verbose:
-			print("    Next active task is task #{}".format(task_key))
+			logger.debug("Next active task is task #{}".format(task_key))
 		task = self.get_task(task_key)
 		return task
 
 	def get_task(self, task_key):
 		if self.verbose:
-			print("[QueueDB] Getting task #{}...".format(task_key))
+			logger.debug("Getting task #{}...".format(task_key))
 		assert isinstance(task_key, int)
 		
 		self.cursor.execute("SELECT * FROM {} WHERE task_key = ?".format(TABLE_NAME), (task_key, ))
@@ -465,7 +638,7 @@ class QueueDB:
 		
 	def get_task_as_dict(self, task_key):
 		if self.verbose:
-			print("[QueueDB] Getting task #{} as a dict...".format(task_key))
+			logger.debug("Getting task #{} as a dict...".format(task_key))
 		assert isinstance(task_key, int)
 
 		self.cursor.execute("SELECT * FROM {} WHERE task_key = ?".format(TABLE_NAME), (task_key, ))
@@ -474,7 +647,7 @@ class QueueDB:
 		return task
 
 	def _print_task(self, task):
-		print("    #{} :: {} :: {} :: exp={} / split={} / attempt={} / page={} ({})".format(
+		logger.debug("#{} :: {} :: {} :: exp={} / split={} / attempt={} / page={} ({})".format(
 			task["task_key"],
 			task["creation_timestamp"],
 			task["task_priority"],
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
-from facebook_utils import RateLimitDB
+from common import Log
+from facebook_utils import RateLimitDB, METRICS
 
 from datetime import datetime, timedelta
 import math
@@ -24,42 +25,65 @@ DELAY_SECONDS_25  = 15.0 # 12 * 15 = 180 seconds or  6/15 for  75% bandwidth
 DELAY_SECONDS_10  = 20.0 #  9 * 20 = 180 seconds or  9/15 for  90% bandwidth
                          #                          15/15 for 100% bandwidth
 
+logger = Log.get_logger("RateLimitManager")
+
 class RateLimitManager:
-	def __init__(self, db_folder = None, verbose = True):
+	def __init__(self, db_folder = None, verbose = True, token_label = None):
 		assert isinstance(verbose, bool)
 		self.verbose = verbose
-		self._db = RateLimitDB(db_folder = db_folder, verbose = False)
+		self._db = RateLimitDB(db_folder = db_folder, verbose = False, token_label = token_label)
+		self._back_off_timestamp = None
 
-	def before_search(self):
+	# Delay before the next request: the rate-limit delay, or the remaining back-off if longer
+	def get_delay(self):
 		delay = self._calculate_delay()
+		if self._back_off_timestamp is not None:
+			back_off_delay = (self._back_off_timestamp - datetime.now()).total_seconds()
+			if back_off_delay > 0:
+				delay = max(delay, back_off_delay)
+			else:
+				self._back_off_timestamp = None
+		return delay
+
+	def before_search(self, delay = None):
+		if delay is None:
+			delay = self.get_delay()
 		self._sleep(delay)
 
 	def after_search(self):
 		self._update_rate_limit()
 
+	# Hold off on this token without blocking: the back-off is added to the delay returned by get_delay,
+	# so a token pool can keep using its other tokens in the meantime
+	def back_off(self, delay):
+		if self.verbose:
+			logger.debug("Backing off for {:0.1f} seconds before retrying a failed request...".format(delay))
+		back_off_timestamp = datetime.now() + timedelta(seconds = delay)
+		if self._back_off_timestamp is None or back_off_timestamp > self._back_off_timestamp:
+			self._back_off_timestamp = back_off_timestamp
+
 	def _calculate_delay(self):
 		self._db.open()
 		usage_data = self._db.check_usage(duration = DURATION)
 		self._db.close()
 
 		if self.verbose:
-			print()
-			print("[RateLimitManager] Checking available bandwidth...")
+			logger.debug("Checking available bandwidth...")
 			if usage_data.count == 0:
 				prior_requests = "no prior requests"
 			elif usage_data.count == 1:
 				prior_requests = "1 prior request"
 			else:
 				prior_requests = "{:d} prior request".format(usage_data.count)
-			print("    Found {:s} within the past {:0.1f} seconds".format(prior_requests, usage_data.duration))
+			logger.debug("Found {:s} within the past {:0.1f} seconds".format(prior_requests, usage_data.duration))
 
 		remaining_request_count = REQUESTS_PER_DURATION - usage_data.count
 		remaining_request_duration = SECONDS_PER_DURATION - usage_data.duration
 
 		if self.verbose:
-			print("    Remaining time = {:0.1f} seconds".format(remaining_request_duration))
-			print("    Remaining requests = {:d}".format(remaining_request_count))
-			print("    Remaining bandwidth = {:0.1f}%".format(100.0 * remaining_request_count / REQUESTS_PER_DURATION))
+			logger.debug("Remaining time = {:0.1f} seconds".format(remaining_request_duration))
+			logger.debug("Remaining requests = {:d}".format(remaining_request_count))
+			logger.debug("Remaining bandwidth = {:0.1f}%".format(100.0 * remaining_request_count / REQUESTS_PER_DURATION))
 
 		if remaining_request_count <= 0:
 			delay = DELAY_MAX
@@ -76,34 +100,31 @@ class RateLimitManager:
 			delay = max(DELAY_MIN, delay)
 
 		if self.verbose:
-			print("    Delay = {:0.1f} second{:s}".format(delay, "" if delay == 1 else "s"))
+			logger.debug("Delay = {:0.1f} second{:s}".format(delay, "" if delay == 1 else "s"))
 
 		return delay
 
 	def _sleep(self, delay):
+		METRICS.increment("rate_limit_sleep_seconds_total", delay)
+		METRICS.observe("rate_limit_sleep_seconds", delay)
 		if self.verbose:
 			timestamp = datetime.now().strftime("%-I:%M:%S %p @ %A, %B %-d, %Y")
-			print("[RateLimitManager] Sleeping for {:0.1f} second{:s} ({:s})...".format(delay, "" if delay == 1 else "s", timestamp))
+			logger.debug("Sleeping for {:0.1f} second{:s} ({:s})...".format(delay, "" if delay == 1 else "s", timestamp))
 
 		remaining_seconds = delay
 		while remaining_seconds >= 60:
 			remaining_minutes = math.floor(remaining_seconds / 60)
 			if self.verbose:
 				timestamp = datetime.now().strftime("%-I:%M:%S %p @ %A, %B %-d, %Y")
-				print("    Sleep for {:d} more minute{:s} ({:s})...".format(remaining_minutes, "" if remaining_minutes == 1 else "s", timestamp))
+				logger.debug("Sleep for {:d} more minute{:s} ({:s})...".format(remaining_minutes, "" if remaining_minutes == 1 else "s", timestamp))
 
 			time.sleep(60)
 			remaining_seconds -= 60
 		time.sleep(remaining_seconds)
 
-		if self.verbose:
-			print()
-
 	def _update_rate_limit(self):
 		if self.verbose:
-			print()
-			print("[RateLimitManager] Updating usage log...")
-			print()
+			logger.debug("Updating usage log...")
 		self._db.open()
 		self._db.add_timestamp()
 		self._db.close()
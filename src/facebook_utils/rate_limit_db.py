@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
-from common import Constants
+from common import Constants, Log
 
 from datetime import datetime, timedelta
+import hashlib
 import os
+import re
 import sqlite3
 from typing import NamedTuple
 
 # Constants for the rate limit database
+
+logger = Log.get_logger("RateLimitDB")
 DB_FOLDER = Constants.DB_PATH
 DB_FILENAME = Constants.FACEBOOK_RATE_LIMIT_DB_FILENAME
 
@@ -27,28 +31,48 @@ CREATE_VIEW_SQL = """CREATE VIEW """
 
 TABLE_EXISTS_SQL = """SELECT COUNT(*) = 1 FROM "sqlite_master" WHERE "type" = "table" AND "name" = "{table}";""".format(table = TABLE_NAME)
 
-SELECT_TIMESTAMPS_SQL = """SELECT "timestamp" AS "[timestamp]" FROM "{table}" WHERE "timestamp" > ? ORDER BY "timestamp" ASC;""".format(table = TABLE_NAME)
+SELECT_USAGE_SQL = """SELECT COUNT(*) AS "count", MIN("timestamp") AS "first_timestamp [timestamp]" FROM "{table}" WHERE "timestamp" > ?;""".format(table = TABLE_NAME)
+
+DELETE_TIMESTAMPS_SQL = """DELETE FROM "{table}" WHERE "timestamp" < ?;""".format(table = TABLE_NAME)
 
 INSERT_TIMESTAMP_SQL = """INSERT INTO "{table}" VALUES (?);""".format(table = TABLE_NAME)
 
 DEFAULT_DURATION_MINUTES = 15
 DEFAULT_DURATION_SECONDS = 0
 
+# Timestamps older than this are deleted; must be longer than any window passed to check_usage
+RETENTION_DURATION = timedelta(hours = 1)
+
 # Custom data types
 class UsageData(NamedTuple):
 	count: int
 	duration: float
 
 class RateLimitDB:
-	def __init__(self, db_folder = None, verbose = True):
+	def __init__(self, db_folder = None, verbose = True, retention_duration = RETENTION_DURATION, token_label = None):
 		assert isinstance(verbose, bool)
+		assert isinstance(retention_duration, timedelta)
+		assert token_label is None or isinstance(token_label, str)
 		self.verbose = verbose
+		self.retention_duration = retention_duration
 		self.db_folder = DB_FOLDER if db_folder is None else db_folder
-		self.db_path = os.path.join(self.db_folder, DB_FILENAME)
+		self.db_path = os.path.join(self.db_folder, self._get_db_filename(token_label))
 		self.connection = None
 		self.cursor = None
 		self._init_db_folder()
 
+	# Each token in a token pool has its own usage log (e.g., "facebook_rate_limit.alice.sqlite").
+	# Token labels come from the token config file, so characters that are unsafe in a filename are
+	# replaced, and a hash of the original label keeps sanitized labels from colliding.
+	def _get_db_filename(self, token_label):
+		if token_label is None:
+			return DB_FILENAME
+		safe_label = re.sub(r"[^A-Za-z0-9_.-]", "_", token_label)
+		if safe_label != token_label:
+			safe_label = "{:s}-{:s}".format(safe_label, hashlib.sha1(token_label.encode("utf-8")).hexdigest()[:8])
+		(root, ext) = os.path.splitext(DB_FILENAME)
+		return "{:s}.{:s}{:s}".format(root, safe_label, ext)
+
 	def _init_db_folder(self):
 		os.makedirs(self.db_folder, exist_ok = True)
 
@@ -60,20 +84,19 @@ class RateLimitDB:
 
 	def _create_tables(self):
 		if self.verbose:
-			print("[RateLimitDB] Creating table '{}'...".format(TABLE_NAME))
-			print(CREATE_TABLE_SQL)
+			logger.debug("Creating table '{}'...".format(TABLE_NAME))
+			logger.debug(CREATE_TABLE_SQL)
 		self.cursor.execute(CREATE_TABLE_SQL)
 
 	def _create_indexes(self):
 		if self.verbose:
-			print("[RateLimitDB] Creating indexes...")
-			print(CREATE_INDEX_SQL)
+			logger.debug("Creating indexes...")
+			logger.debug(CREATE_INDEX_SQL)
 		self.cursor.execute(CREATE_INDEX_SQL)
 
 	def open(self):
 		if self.verbose:
-			print()
-			print("[RateLimitDB] Connecting to database...")
+			logger.debug("Connecting to database...")
 		self.connection = sqlite3.connect(self.db_path, detect_types = sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
 		self.connection.row_factory = sqlite3.Row
 		self.cursor = self.connection.cursor()
@@ -83,36 +106,37 @@ class RateLimitDB:
 
 	def close(self):
 		if self.verbose:
-			print("[RateLimitDB] Committing changes to database...")
+			logger.debug("Committing changes to database...")
 		self.connection.commit()
 		if self.verbose:
-			print("[RateLimitDB] Disconnecting from database...")
-			print()
+			logger.debug("Disconnecting from database...")
 		self.connection.close()
 
 	def add_timestamp(self):
 		timestamp = datetime.now()
 		if self.verbose:
-			print("[RateLimitDB] Adding a timestamp...")
-			print("    Timestamp = {:s}".format(timestamp.strftime("%Y-%m-%d %H:%M:%S")))
+			logger.debug("Adding a timestamp...")
+			logger.debug("Timestamp = {:s}".format(timestamp.strftime("%Y-%m-%d %H:%M:%S")))
 		self.cursor.execute(INSERT_TIMESTAMP_SQL, (timestamp, ))
+		self.cursor.execute(DELETE_TIMESTAMPS_SQL, (timestamp - self.retention_duration, ))
+		if self.verbose and self.cursor.rowcount > 0:
+			logger.debug("Deleted {:d} expired timestamps".format(self.cursor.rowcount))
 
 	def check_usage(self, duration = timedelta(minutes = DEFAULT_DURATION_MINUTES, seconds = DEFAULT_DURATION_SECONDS)):
 		assert isinstance(duration, timedelta)
 		end_timestamp = datetime.now()
 		start_timestamp = end_timestamp - duration
 		if self.verbose:
-			print("[RateLimitDB] Checking rate limit...")
-		self.cursor.execute(SELECT_TIMESTAMPS_SQL, (start_timestamp, ))
-		all_rows = self.cursor.fetchall()
-		all_timestamps = [row[0] for row in all_rows]
-		if len(all_timestamps) == 0:
+			logger.debug("Checking rate limit...")
+		self.cursor.execute(SELECT_USAGE_SQL, (start_timestamp, ))
+		one_row = self.cursor.fetchone()
+		if one_row["count"] == 0:
 			prior_request_count = 0
 			prior_request_duration = 0.0
 		else:
-			prior_request_count = len(all_timestamps)
-			prior_request_duration = (end_timestamp - all_timestamps[0]).total_seconds()
+			prior_request_count = one_row["count"]
+			prior_request_duration = (end_timestamp - one_row["first_timestamp"]).total_seconds()
 		usage_data = UsageData(prior_request_count, prior_request_duration)
 		if self.verbose:
-			print("    Found {:d} timestamps in the past {:.3f} seconds".format(usage_data.count, usage_data.duration))
+			logger.debug("Found {:d} timestamps in the past {:.3f} seconds".format(usage_data.count, usage_data.duration))
 		return usage_data
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import random
+from typing import NamedTuple
+
+# Retry actions
+SHRINK = "shrink"   # Retry immediately with fewer ads per page
+BACKOFF = "backoff" # Retry with the same parameters, after an exponential backoff with jitter
+FAIL = "fail"       # Do not retry
+
+# Custom data types
+class RetryRule(NamedTuple):
+	action: str
+	max_attempts: int
+	base_delay: float
+	max_delay: float
+
+THROTTLED = RetryRule(BACKOFF, 20, 60.0, 60.0 * 15)
+TRANSIENT = RetryRule(BACKOFF, 10, 5.0, 60.0 * 5)
+REDUCE_DATA = RetryRule(SHRINK, 10, 0.0, 0.0)
+PERMANENT = RetryRule(FAIL, 1, 0.0, 0.0)
+# Retry immediately, so that the request is dispatched to another token in the token pool
+INVALID_TOKEN = RetryRule(BACKOFF, 3, 0.0, 0.0)
+
+# Graph API error codes: https://developers.facebook.com/docs/graph-api/using-graph-api/error-handling
+# Keys are (error_code, error_subcode). A subcode of None matches any subcode.
+RETRY_POLICY = {
+	# API unknown; most often "Please reduce the amount of data you're asking for"
+	(1, None): REDUCE_DATA,
+	# API service temporarily unavailable
+	(2, None): TRANSIENT,
+	# Application, user, page, and custom rate limits
+	(4, None): THROTTLED,
+	(17, None): THROTTLED,
+	(32, None): THROTTLED,
+	(613, None): THROTTLED,
+	# Permission denied, invalid parameter, and missing permissions
+	(10, None): PERMANENT,
+	(100, None): PERMANENT,
+	(200, None): PERMANENT,
+	# Expired or invalid access token
+	(190, None): INVALID_TOKEN,
+	# Connection errors, non-JSON responses, and responses without data or error codes (see APIHelper)
+	(-10001, None): TRANSIENT,
+	(-10002, None): TRANSIENT,
+	(-10003, None): TRANSIENT,
+}
+DEFAULT_ERROR_RULE = REDUCE_DATA
+DEFAULT_NETWORK_ERROR_RULE = TRANSIENT
+
+class RetryPolicy:
+	def __init__(self, policy = None):
+		self.policy = RETRY_POLICY if policy is None else policy
+
+	def get_rule(self, error_code, error_subcode = None):
+		assert isinstance(error_code, int)
+		if (error_code, error_subcode) in self.policy:
+			return self.policy[(error_code, error_subcode)]
+		if (error_code, None) in self.policy:
+			return self.policy[(error_code, None)]
+		return DEFAULT_ERROR_RULE if error_code > 0 else DEFAULT_NETWORK_ERROR_RULE
+
+	def get_delay(self, rule, page_attempt):
+		assert isinstance(rule, RetryRule)
+		if rule.action != BACKOFF:
+			return 0.0
+		delay = min(rule.max_delay, rule.base_delay * 2.0 ** max(0, page_attempt - 1))
+		return delay * random.uniform(0.5, 1.0)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta
+
+# SQL database constants
+TABLE_NAME = "all_tasks_table"
+SPLITS_TABLE_NAME = "scheduled_splits_table"
+EXPERIMENTS_TABLE_NAME = "scheduled_experiments_table"
+
+# Experiments with a deadline within this window are scheduled ahead of all others
+DEADLINE_HORIZON = timedelta(hours = 24)
+DEFAULT_TASK_WEIGHT = 1.0
+
+# SQL statements
+CREATE_SPLITS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS "{table}" (
+	"experiment_folder" TEXT NOT NULL,
+	"split_index" INTEGER NOT NULL,
+	"service_count" INTEGER NOT NULL DEFAULT 0,
+	"last_start_timestamp" DATETIME DEFAULT NULL,
+	PRIMARY KEY ("experiment_folder", "split_index")
+);""".format(table = SPLITS_TABLE_NAME)
+
+CREATE_EXPERIMENTS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS "{table}" (
+	"experiment_folder" TEXT NOT NULL PRIMARY KEY,
+	"virtual_start" REAL NOT NULL DEFAULT 0,
+	"virtual_finish" REAL NOT NULL DEFAULT 0
+);""".format(table = EXPERIMENTS_TABLE_NAME)
+
+UPSERT_SPLIT_SERVICE_SQL = """INSERT INTO {splits} (
+	experiment_folder, split_index, service_count, last_start_timestamp
+) SELECT
+	experiment_folder, split_index, 1, DATETIME('NOW', 'LOCALTIME')
+	FROM {table}
+	WHERE task_key = ?
+ON CONFLICT (experiment_folder, split_index) DO UPDATE SET
+	service_count = service_count + 1,
+	last_start_timestamp = excluded.last_start_timestamp
+;""".format(table = TABLE_NAME, splits = SPLITS_TABLE_NAME)
+
+# Weighted fair queuing (start-time fair queuing) across experiments.
+# The global virtual time is the virtual start of the most recently served task.
+# A started task begins at max(global virtual time, experiment's last virtual finish)
+# and advances the experiment's virtual finish by 1 / task_weight.
+# Experiments that were idle or are new resume at the global virtual time,
+# so they neither bank credit nor inherit a debt from lifetime service.
+UPSERT_EXPERIMENT_SERVICE_SQL = """INSERT INTO {experiments} (
+	experiment_folder, virtual_start, virtual_finish
+) SELECT
+	active.experiment_folder,
+	clock.virtual_time,
+	clock.virtual_time + 1.0 / MAX(COALESCE(JSON_EXTRACT(active.experiment_spec, '$.task_weight'), {weight}), 1e-6)
+	FROM {table} AS active, (SELECT COALESCE(MAX(virtual_start), 0.0) AS virtual_time FROM {experiments}) AS clock
+	WHERE active.task_key = ?
+ON CONFLICT (experiment_folder) DO UPDATE SET
+	virtual_start = MAX(excluded.virtual_start, virtual_finish),
+	virtual_finish = MAX(excluded.virtual_start, virtual_finish) + (excluded.virtual_finish - excluded.virtual_start)
+;""".format(table = TABLE_NAME, experiments = EXPERIMENTS_TABLE_NAME, weight = DEFAULT_TASK_WEIGHT)
+
+SELECT_NEXT_PRIORITY_TASK_SQL = """SELECT task_key FROM {table}
+	WHERE is_task_cancelled = 0 AND is_task_started = 0 AND is_task_finished = 0
+	ORDER BY task_priority DESC, creation_timestamp ASC
+	LIMIT 1
+;""".format(table = TABLE_NAME)
+
+SELECT_ACTIVE_EXPERIMENTS_SQL = """SELECT
+		active.experiment_folder AS experiment_folder,
+		MAX(active.task_priority) AS task_priority,
+		MIN(JSON_EXTRACT(active.experiment_spec, '$.deadline')) AS deadline,
+		MAX(COALESCE(JSON_EXTRACT(active.experiment_spec, '$.task_weight'), {weight})) AS task_weight,
+		MAX(COALESCE(served.virtual_finish, 0.0), clock.virtual_time) AS virtual_start
+	FROM {table} AS active
+	LEFT JOIN {experiments} AS served ON active.experiment_folder = served.experiment_folder
+	CROSS JOIN (SELECT COALESCE(MAX(virtual_start), 0.0) AS virtual_time FROM {experiments}) AS clock
+	WHERE active.is_task_cancelled = 0 AND active.is_task_started = 0 AND active.is_task_finished = 0
+	GROUP BY active.experiment_folder
+;""".format(table = TABLE_NAME, experiments = EXPERIMENTS_TABLE_NAME, weight = DEFAULT_TASK_WEIGHT)
+
+SELECT_NEXT_SPLIT_TASK_SQL = """SELECT active.task_key AS task_key FROM {table} AS active
+	LEFT JOIN {splits} AS served
+		ON active.experiment_folder = served.experiment_folder AND active.split_index = served.split_index
+	WHERE active.is_task_cancelled = 0 AND active.is_task_started = 0 AND active.is_task_finished = 0
+		AND active.experiment_folder = ?
+	ORDER BY
+		COALESCE(served.service_count, 0) ASC,
+		served.last_start_timestamp ASC,
+		active.task_key ASC
+	LIMIT 1
+;""".format(table = TABLE_NAME, splits = SPLITS_TABLE_NAME)
+
+# Highest task_priority first, then the oldest task
+class PriorityScheduler:
+	name = "priority"
+
+	def get_next_task_key(self, cursor):
+		cursor.execute(SELECT_NEXT_PRIORITY_TASK_SQL)
+		one_row = cursor.fetchone()
+		return None if one_row is None else one_row["task_key"]
+
+# Experiments with an upcoming deadline first (earliest deadline first).
+# Otherwise, weighted fair queuing across experiments within each task_priority:
+# the experiment with the smallest virtual start time is served next.
+# Within an experiment, round-robin across splits (least-served split first).
+class FairScheduler:
+	name = "fair"
+
+	def __init__(self, deadline_horizon = DEADLINE_HORIZON):
+		assert isinstance(deadline_horizon, timedelta)
+		self.deadline_horizon = deadline_horizon
+
+	def _get_sort_key(self, experiment, urgent_timestamp):
+		deadline = experiment["deadline"]
+		is_urgent = deadline is not None and deadline <= urgent_timestamp
+		return (
+			0 if is_urgent else 1,
+			deadline if is_urgent else "",
+			-experiment["task_priority"],
+			experiment["virtual_start"],
+			experiment["experiment_folder"],
+		)
+
+	def get_next_task_key(self, cursor):
+		cursor.execute(SELECT_ACTIVE_EXPERIMENTS_SQL)
+		experiments = cursor.fetchall()
+		if len(experiments) == 0:
+			return None
+
+		urgent_timestamp = (datetime.now() + self.deadline_horizon).strftime("%Y-%m-%d %H:%M:%S")
+		experiment = min(experiments, key = lambda e: self._get_sort_key(e, urgent_timestamp))
+
+		cursor.execute(SELECT_NEXT_SPLIT_TASK_SQL, (experiment["experiment_folder"], ))
+		one_row = cursor.fetchone()
+		return None if one_row is None else one_row["task_key"]
+
+SCHEDULERS = {
+	PriorityScheduler.name: PriorityScheduler,
+	FairScheduler.name: FairScheduler,
+}
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
-from common import Constants
+from common import Constants, Log
+from facebook_utils import PageSizeController, RetryPolicy
+from facebook_utils.page_size import MAX_ADS_PER_PAGE, MIN_ADS_PER_PAGE
+from facebook_utils.retry_policy import SHRINK, BACKOFF, FAIL
 
 import configparser
 import csv
-from datetime import datetime
+import heapq
+import itertools
+from datetime import datetime, timedelta
 import math
 import os
 import random
@@ -13,23 +18,20 @@ import random
 TASK_CONFIG_FILENAME = os.path.join(Constants.PREF_PATH, "facebook_tasks.ini")
 DEFAULT_TASK_CONFIG_FILENAME = os.path.join("facebook_utils", "defaults", "tasks.ini")
 
-# Constants for dynamically checking the current rate limit
-MAX_ADS_PER_PAGE = 5000
-MIN_ADS_PER_PAGE = 25
-ADS_PER_PAGE_INCREASE_FACTOR = 1.189207115   # 2.0 ^ (1/4)
-ADS_PER_PAGE_DECREASE_FACTOR = 0.70710678118 # 0.5 ^ (1/2)
+# Constants for randomizing the number of ads per page
 RAND_ADD_ADS = 25
 RAND_SUBTRACT_ADS = 25
 RAND_MULTIPLY_ADS = 1.025
 RAND_DIVIDE_ADS = 1.025
 
-# Fail condition
-TASK_FAILS_AFTER_N_ATTEMPTS = 10
+logger = Log.get_logger("TaskManager")
 
 class TaskManager:
 	def __init__(self, verbose = False):
 		assert isinstance(verbose, bool)
 		self.verbose = verbose
+		self._page_size_controller = PageSizeController()
+		self._retry_policy = RetryPolicy()
 		self._init_config()
 
 	def _init_config(self):
@@ -40,11 +42,10 @@ class TaskManager:
 			with open(filename, "w") as f:
 				config.write(f)
 			if self.verbose:
-				print("[TaskManager] Created file: {}".format(filename))
+				logger.debug("Created file: {}".format(filename))
 
-	def _read_advertisers_from_report_csv(self, filename):
+	def _iter_advertisers_from_report_csv(self, filename):
 		header = None
-		advertisers = []
 		with open(filename) as f:
 			reader = csv.reader(f, delimiter=",", quotechar="\"", quoting=csv.QUOTE_MINIMAL)
 			for row in reader:
@@ -54,10 +55,24 @@ class TaskManager:
 					header = header.lstrip("\uFEFF")
 					assert (header == "Page ID")
 				else:
-					advertisers.append(row[0])
-		return advertisers
+					yield row[0]
 
-	def create_experiment(self, experiment_type, opt_last_n_days = None, experiment_priority = None):
+	# Countries or advertisers of an experiment, in order, without duplicates
+	def _iter_split_items(self, experiment_spec):
+		if experiment_spec["search_by_advertisers"]:
+			items = itertools.chain(experiment_spec["advertisers"])
+			advertisers_from_report = experiment_spec["advertisers_from_report"]
+			if len(advertisers_from_report) > 0:
+				items = itertools.chain(items, self._iter_advertisers_from_report_csv(advertisers_from_report))
+		else:
+			items = experiment_spec["countries"]
+		seen_items = set()
+		for item in items:
+			if item not in seen_items:
+				seen_items.add(item)
+				yield item
+
+	def create_experiment(self, experiment_type, opt_last_n_days = None, experiment_priority = None, opt_deadline_hours = None):
 		assert isinstance(experiment_type, str)
 		config = configparser.ConfigParser()
 		config.read(TASK_CONFIG_FILENAME)
@@ -81,6 +96,8 @@ class TaskManager:
 		if last_n_days is not None:
 			last_n_days = opt_last_n_days
 
+		task_weight = config.getfloat(experiment_section, "task_weight") if config.has_option(experiment_section, "task_weight") else 1.0
+		deadline_hours = config.getfloat(experiment_section, "deadline_hours") if config.has_option(experiment_section, "deadline_hours") else 0.0
 		root_folder = config.get(experiment_section, "root_folder") if config.has_option(experiment_section, "root_folder") else Constants.DOWNLOADS_PATH
 		now = datetime.now()
 		timestamp = now.strftime("%Y-%m-%d-%H-%M-%S")
@@ -95,11 +112,16 @@ class TaskManager:
 
 		if experiment_priority is not None:
 			task_priority = experiment_priority
+		if opt_deadline_hours is not None:
+			deadline_hours = opt_deadline_hours
+		deadline = (now + timedelta(hours = deadline_hours)).strftime("%Y-%m-%d %H:%M:%S") if deadline_hours > 0 else None
 
 		experiment_spec = {
 			"experiment_key": experiment_key,
 			"experiment_folder": experiment_folder,
 			"task_priority": task_priority,
+			"task_weight": task_weight,
+			"deadline": deadline,
 			"ad_type": ad_type,
 			"ad_active_status": ad_active_status,
 			"ad_fields": ad_fields,
@@ -116,44 +138,90 @@ class TaskManager:
 		}
 		return experiment_spec
 
-	def create_splits(self, experiment_spec):
-		split_specs = []
+	def _plan_splits(self, experiment_spec, items, items_per_split, ad_counts):
+		# Expected number of ads for each item, based on past downloads.
+		# Items without any history are assumed to be of median size.
+		ads_per_page = experiment_spec["ads_per_page"]
+		known_ad_counts = sorted(ad_counts[item] for item in items if item in ad_counts)
+		default_ad_count = known_ad_counts[len(known_ad_counts) // 2] if len(known_ad_counts) > 0 else 0
+		expected_ad_counts = {item: ad_counts[item] if item in ad_counts else default_ad_count for item in items}
+		expected_page_counts = {item: max(1, math.ceil(1.0 * expected_ad_counts[item] / ads_per_page)) for item in items}
+
+		target_page_count = 1.0 * sum(expected_page_counts.values()) / max(1, math.ceil(1.0 * len(items) / items_per_split))
+
+		# Items larger than an average split are downloaded as two splits (active ads and inactive ads).
+		# The Ad Library does not report the ratio between the two, so assume an even split.
+		plans = []
+		small_items = []
+		for item in items:
+			if experiment_spec["ad_active_status"] == "ALL" and expected_page_counts[item] > max(1.0, target_page_count):
+				for ad_active_status in ["ACTIVE", "INACTIVE"]:
+					plans.append(([item], ad_active_status, expected_ad_counts[item] / 2.0))
+			else:
+				small_items.append(item)
+
+		# Longest processing time first: assign each item to the least-loaded split with room left.
+		# The heap only holds splits with room left, as (ad count, index), so ties go to the first split.
+		small_items.sort(key = lambda item: expected_ad_counts[item], reverse = True)
+		bin_count = math.ceil(1.0 * len(small_items) / items_per_split)
+		bin_items = [[] for bin_index in range(0, bin_count)]
+		bin_ad_counts = [0.0] * bin_count
+		open_bins = [(0.0, bin_index) for bin_index in range(0, bin_count)]
+		for item in small_items:
+			(bin_ad_count, bin_index) = heapq.heappop(open_bins)
+			bin_items[bin_index].append(item)
+			bin_ad_counts[bin_index] = bin_ad_count + expected_ad_counts[item]
+			if len(bin_items[bin_index]) < items_per_split:
+				heapq.heappush(open_bins, (bin_ad_counts[bin_index], bin_index))
+		plans += [(bin_items[bin_index], None, bin_ad_counts[bin_index]) for bin_index in range(0, bin_count)]
+
+		# Start the longest splits first
+		plans.sort(key = lambda plan: plan[2], reverse = True)
+		return plans
+
+	def _iter_chunks(self, items, items_per_split):
+		items = iter(items)
+		chunk = list(itertools.islice(items, items_per_split))
+		while len(chunk) > 0:
+			yield (chunk, None, None)
+			chunk = list(itertools.islice(items, items_per_split))
+
+	def iter_splits(self, experiment_spec, ad_counts = None):
 		search_by_advertisers = experiment_spec["search_by_advertisers"]
 		if search_by_advertisers:
-			advertisers = experiment_spec["advertisers"].copy()
-			advertisers_from_report = experiment_spec["advertisers_from_report"]
-			if len(advertisers_from_report) > 0:
-				advertisers += self._read_advertisers_from_report_csv(advertisers_from_report)
-
-			advertisers_per_split = experiment_spec["advertisers_per_split"]
-			advertiser_count = len(advertisers)
-			split_count = math.ceil(1.0 * advertiser_count / advertisers_per_split)
-			for split_index in range(0, split_count):
-				start_index = split_index * advertisers_per_split
-				end_index = (split_index+1) * advertisers_per_split
-				split_advertisers = advertisers[start_index:end_index]
-				split_spec = {
-					"split_index": split_index,
-					"split_count": split_count,
-					"advertisers": split_advertisers,
-				}
-				split_specs.append(split_spec)
+			items_field = "advertisers"
+			items_per_split = experiment_spec["advertisers_per_split"]
 		else:
-			countries = experiment_spec["countries"]
-			countries_per_split = experiment_spec["countries_per_split"]
-			country_count = len(countries)
-			split_count = math.ceil(1.0 * country_count / countries_per_split)
-			for split_index in range(0, split_count):
-				start_index = split_index * countries_per_split
-				end_index = (split_index+1) * countries_per_split
-				split_countries = countries[start_index:end_index]
-				split_spec = {
-					"split_index": split_index,
-					"split_count": split_count,
-					"countries": split_countries,
-				}
-				split_specs.append(split_spec)
-		return split_specs
+			items_field = "countries"
+			items_per_split = experiment_spec["countries_per_split"]
+
+		# Balance splits by expected number of pages, if historical ad counts are available.
+		# Otherwise, stream the list of countries or advertisers in fixed-size chunks.
+		# The advertiser report is read twice (to count splits, then to fill them) rather than held in memory.
+		if ad_counts is not None and len(ad_counts) > 0:
+			plans = self._plan_splits(experiment_spec, list(self._iter_split_items(experiment_spec)), items_per_split, ad_counts)
+			split_count = len(plans)
+			if self.verbose:
+				logger.debug("Planned {} splits using historical ad counts for {} {}".format(split_count, len(ad_counts), items_field))
+		else:
+			item_count = sum(1 for item in self._iter_split_items(experiment_spec))
+			plans = self._iter_chunks(self._iter_split_items(experiment_spec), items_per_split)
+			split_count = math.ceil(1.0 * item_count / items_per_split)
+
+		for split_index, (split_items, ad_active_status, expected_ad_count) in enumerate(plans):
+			split_spec = {
+				"split_index": split_index,
+				"split_count": split_count,
+				items_field: split_items,
+			}
+			if ad_active_status is not None:
+				split_spec["ad_active_status"] = ad_active_status
+			if expected_ad_count is not None:
+				split_spec["expected_ad_count"] = round(expected_ad_count)
+			yield split_spec
+
+	def create_splits(self, experiment_spec, ad_counts = None):
+		return list(self.iter_splits(experiment_spec, ad_counts = ad_counts))
 
 	def init_page(self):
 		page_spec = {
@@ -172,7 +240,28 @@ class TaskManager:
 		continuation = {}
 		return continuation
 
-	def continue_task(self, this_task, finish_code, finish_log):
+	def _jitter_ads_per_page(self, ads_per_page):
+		x1 = ads_per_page * random.uniform(1.0, RAND_MULTIPLY_ADS) - ads_per_page
+		x2 = ads_per_page / random.uniform(1.0, RAND_DIVIDE_ADS) - ads_per_page
+		x3 = random.randint(0, RAND_ADD_ADS)
+		x4 = -random.randint(0, RAND_SUBTRACT_ADS)
+		ads_per_page = round(ads_per_page + x1 + x2 + x3 + x4)
+		return min(MAX_ADS_PER_PAGE, max(MIN_ADS_PER_PAGE, ads_per_page))
+
+	def _get_page_stats(self, ads_per_page, finish_code, finish_log, page_stats):
+		# Most recent page first, followed by earlier pages of the same countries or advertisers (from DownloadsDB).
+		# Only failures that call for less data per page are relevant to the page size.
+		this_page_stat = {
+			"ads_per_page": ads_per_page,
+			"ad_count": finish_log["ad_count"] if "ad_count" in finish_log else None,
+			"duration": finish_log["duration"] if "duration" in finish_log else None,
+			"response_body_length": finish_log["response_body_length"] if "response_body_length" in finish_log else None,
+			"finish_code": finish_code,
+		}
+		page_stats = [this_page_stat] + ([] if page_stats is None else page_stats)
+		return [s for s in page_stats if s["finish_code"] is None or s["finish_code"] in (0, -1) or self._retry_policy.get_rule(s["finish_code"]).action == SHRINK]
+
+	def continue_task(self, this_task, finish_code, finish_log, page_stats = None):
 		experiment_spec = this_task["experiment_spec"].copy()
 		split_spec = this_task["split_spec"].copy()
 		page_spec = this_task["page_spec"].copy()
@@ -181,6 +270,7 @@ class TaskManager:
 
 		all_specs = {**experiment_spec, **split_spec, **page_spec, **attempt_spec, **continuation}
 		ads_per_page = all_specs["ads_per_page"]
+		page_stats = self._get_page_stats(ads_per_page, finish_code, finish_log, page_stats)
 
 		# Success
 		if finish_code == 0:
@@ -192,14 +282,8 @@ class TaskManager:
 			if "is_task_failed" in continuation:
 				del continuation["is_task_failed"]
 
-			ads_per_page = ads_per_page * ADS_PER_PAGE_INCREASE_FACTOR
-			x1 = ads_per_page * random.uniform(1.0, RAND_MULTIPLY_ADS) - ads_per_page
-			x2 = ads_per_page / random.uniform(1.0, RAND_DIVIDE_ADS) - ads_per_page
-			x3 = random.randint(0, RAND_ADD_ADS)
-			x4 = -random.randint(0, RAND_SUBTRACT_ADS)
-			ads_per_page = math.ceil(ads_per_page + x1 + x2 + x3 + x4)
-			ads_per_page = min(MAX_ADS_PER_PAGE, max(MIN_ADS_PER_PAGE, ads_per_page))
-			attempt_spec["ads_per_page"] = ads_per_page
+			ads_per_page = self._page_size_controller.increase(ads_per_page, page_stats)
+			attempt_spec["ads_per_page"] = self._jitter_ads_per_page(ads_per_page)
 
 			this_task = {
 				"experiment_spec": experiment_spec,
@@ -207,19 +291,38 @@ class TaskManager:
 				"page_spec": page_spec,
 				"attempt_spec": attempt_spec,
 				"continuation": continuation,
+				"retry_delay": 0.0,
 			}
 			return this_task
 
-		# Retry using the same set of parameters
+		# Terminal page
+		elif finish_code == -1:
+			return None
 
-		# 190 = expired access token
-		elif finish_code == 190:
+		# Failure, handled according to the retry policy for the error code
+		else:
+			error_subcode = finish_log["error_subcode"] if "error_subcode" in finish_log else None
+			retry_rule = self._retry_policy.get_rule(finish_code, error_subcode)
 			attempt_spec["attempt_index"] += 1
 			attempt_spec["page_attempt"] += 1
 			if "error_codes" not in continuation:
 				continuation["error_codes"] = []
 			continuation["error_codes"].append(finish_code)
-			continuation["is_task_failed"] = True
+			retry_delay = 0.0
+
+			# Permanent error, or failed more than N times.
+			# The failed task is recorded as cancelled (see QueueDB), which ends the split.
+			if retry_rule.action == FAIL or attempt_spec["page_attempt"] >= retry_rule.max_attempts:
+				continuation["is_task_failed"] = True
+
+			# Retry with fewer ads
+			elif retry_rule.action == SHRINK:
+				ads_per_page = self._page_size_controller.decrease(ads_per_page, page_stats)
+				attempt_spec["ads_per_page"] = self._jitter_ads_per_page(ads_per_page)
+
+			# Retry using the same set of parameters, after a delay
+			elif retry_rule.action == BACKOFF:
+				retry_delay = self._retry_policy.get_delay(retry_rule, attempt_spec["page_attempt"])
 
 			this_task = {
 				"experiment_spec": experiment_spec,
@@ -227,75 +330,6 @@ class TaskManager:
 				"page_spec": page_spec,
 				"attempt_spec": attempt_spec,
 				"continuation": continuation,
+				"retry_delay": retry_delay,
 			}
 			return this_task
-
-		# Failure and retry with fewer ads
-		elif finish_code > 0:
-			attempt_spec["attempt_index"] += 1
-			attempt_spec["page_attempt"] += 1
-			if "error_codes" not in continuation:
-				continuation["error_codes"] = []
-			continuation["error_codes"].append(finish_code)
-
-			# Failed more than N times
-			if attempt_spec["page_attempt"] >= TASK_FAILS_AFTER_N_ATTEMPTS:
-				continuation["is_task_failed"] = True
-				this_task = {
-					"experiment_spec": experiment_spec,
-					"split_spec": split_spec,
-					"page_spec": page_spec,
-					"attempt_spec": attempt_spec,
-					"continuation": continuation,
-				}
-				return this_task
-			else:
-				ads_per_page = ads_per_page * ADS_PER_PAGE_DECREASE_FACTOR
-				x1 = ads_per_page * random.uniform(1.0, RAND_MULTIPLY_ADS) - ads_per_page
-				x2 = ads_per_page / random.uniform(1.0, RAND_DIVIDE_ADS) - ads_per_page
-				x3 = random.randint(0, RAND_ADD_ADS)
-				x4 = -random.randint(0, RAND_SUBTRACT_ADS)
-				ads_per_page = math.floor(ads_per_page + x1 + x2 + x3 + x4)
-				ads_per_page = min(MAX_ADS_PER_PAGE, max(MIN_ADS_PER_PAGE, ads_per_page))
-				attempt_spec["ads_per_page"] = ads_per_page
-				this_task = {
-					"experiment_spec": experiment_spec,
-					"split_spec": split_spec,
-					"page_spec": page_spec,
-					"attempt_spec": attempt_spec,
-					"continuation": continuation,
-				}
-				return this_task
-
-		# Terminal page
-		elif finish_code == -1:
-			return None
-
-		# Other network errors
-		else:
-			attempt_spec["attempt_index"] += 1
-			attempt_spec["page_attempt"] += 1
-			if "error_codes" not in continuation:
-				continuation["error_codes"] = []
-			continuation["error_codes"].append(finish_code)
-
-			# Failed more than N times
-			if attempt_spec["page_attempt"] >= TASK_FAILS_AFTER_N_ATTEMPTS:
-				continuation["is_task_failed"] = True
-				this_task = {
-					"experiment_spec": experiment_spec,
-					"split_spec": split_spec,
-					"page_spec": page_spec,
-					"attempt_spec": attempt_spec,
-					"continuation": continuation,
-				}
-				return this_task
-			else:
-				this_task = {
-					"experiment_spec": experiment_spec,
-					"split_spec": split_spec,
-					"page_spec": page_spec,
-					"attempt_spec": attempt_spec,
-					"continuation": continuation,
-				}
-				return this_task
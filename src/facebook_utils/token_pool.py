@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+from common import Log
+from facebook_utils import RateLimitManager
+from facebook_utils.tokens import LATEST_SECTION
+import time
+
+# Graph API error code for an expired or invalid access token
+INVALID_TOKEN_ERROR_CODE = 190
+
+# How long to wait for an expired or invalid token to be replaced in the token config file, when no
+# healthy token is left, and how often to check the file in the meantime (in seconds)
+TOKEN_WAIT_DURATION = 15 * 60
+TOKEN_WAIT_INTERVAL = 30
+
+logger = Log.get_logger("TokenPool")
+
+# Facebook rate-limits each app/user pair separately, so each token has its own usage log.
+# Requests are dispatched to the healthy token that can be used the soonest. A token that is backing
+# off after a failed request is skipped while others are available; the pool only waits when every
+# healthy token is backing off or rate-limited.
+class TokenPool:
+	def __init__(self, token_manager, db_folder = None, verbose = True, wait_duration = TOKEN_WAIT_DURATION, wait_interval = TOKEN_WAIT_INTERVAL):
+		assert isinstance(verbose, bool)
+		self.verbose = verbose
+		self.token_manager = token_manager
+		self.db_folder = db_folder
+		self.wait_duration = wait_duration
+		self.wait_interval = wait_interval
+		self.access_tokens = {}
+		self.rate_limit_managers = {}
+		self.unhealthy_tokens = {}
+		self.reload()
+
+	# Pick up tokens that were added or replaced in the token config file
+	# (cheap when the file is unchanged, since TokenManager caches the parsed file)
+	def reload(self):
+		access_tokens = self.token_manager.get_user_access_tokens()
+		if access_tokens == self.access_tokens:
+			return
+		for token_label, access_token in access_tokens.items():
+			if token_label not in self.rate_limit_managers:
+				self.rate_limit_managers[token_label] = RateLimitManager(db_folder = self.db_folder, verbose = self.verbose, token_label = None if token_label == LATEST_SECTION else token_label)
+			if token_label in self.unhealthy_tokens and self.unhealthy_tokens[token_label] != access_token:
+				del self.unhealthy_tokens[token_label]
+		self.access_tokens = access_tokens
+		if self.verbose:
+			logger.debug("Found {:d} tokens ({:d} healthy)".format(len(self.access_tokens), len(self.get_healthy_token_labels())))
+
+	def get_healthy_token_labels(self):
+		return sorted(token_label for token_label in self.access_tokens.keys() if token_label not in self.unhealthy_tokens)
+
+	def get_access_token(self, token_label):
+		return self.access_tokens[token_label]
+
+	# Least-loaded dispatch: returns (token_label, delay) for the healthy token with the shortest delay.
+	# If no healthy token is left, waits up to wait_duration seconds for one to be added or replaced in the
+	# token config file, and returns (None, None) if none is.
+	def get_next_token(self):
+		self.reload()
+		token_labels = self.get_healthy_token_labels()
+		if len(token_labels) == 0:
+			logger.warning("No healthy access tokens are available; waiting up to %d seconds for a token to be added or replaced", self.wait_duration)
+			wait_timestamp = time.time() + self.wait_duration
+			while len(token_labels) == 0 and time.time() < wait_timestamp:
+				time.sleep(min(self.wait_interval, max(0.0, wait_timestamp - time.time())))
+				self.token_manager.invalidate()
+				self.reload()
+				token_labels = self.get_healthy_token_labels()
+			if len(token_labels) == 0:
+				logger.error("No healthy access tokens are available")
+				return (None, None)
+		delays = {token_label: self.rate_limit_managers[token_label].get_delay() for token_label in token_labels}
+		token_label = min(token_labels, key = lambda token_label: delays[token_label])
+		logger.debug("Dispatching to token '%s'", token_label, extra = {"fields": {"delay": round(delays[token_label], 1)}})
+		return (token_label, delays[token_label])
+
+	def before_search(self, token_label, delay = None):
+		self.rate_limit_managers[token_label].before_search(delay = delay)
+
+	def after_search(self, token_label):
+		self.rate_limit_managers[token_label].after_search()
+
+	# Does not sleep; the back-off is reflected in the delay of the token in get_next_token
+	def back_off(self, token_label, delay):
+		self.rate_limit_managers[token_label].back_off(delay)
+
+	# Take a token out of rotation until it is replaced in the token config file
+	def report_result(self, token_label, finish_code):
+		if finish_code == INVALID_TOKEN_ERROR_CODE:
+			self.unhealthy_tokens[token_label] = self.access_tokens[token_label]
+			self.token_manager.invalidate()
+			logger.warning("Token '%s' is expired or invalid, and will not be used until it is replaced", token_label)
+
+	# Refresh or warn about tokens that expire soon, and take expired tokens out of rotation
+	def check_expiration(self, auto_refresh = False):
+		expired_token_labels = self.token_manager.check_expiration(auto_refresh = auto_refresh)
+		self.reload()
+		for token_label in expired_token_labels:
+			if token_label in self.access_tokens:
+				self.unhealthy_tokens[token_label] = self.access_tokens[token_label]
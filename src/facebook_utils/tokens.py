@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 
-from common import Constants
+from common import Constants, Log
 
 import configparser
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import os
 import requests
@@ -14,6 +14,8 @@ import urllib.parse
 APP_CONFIG_FILENAME = os.path.join(Constants.PREF_PATH, "facebook_app.ini")
 TOKEN_CONFIG_FILENAME = os.path.join(Constants.PREF_PATH, "facebook_tokens.ini")
 
+logger = Log.get_logger("TokenManager")
+
 # App configurations
 APP_SECTION = "facebook_app"
 APP_ID_OPTION = "app_id"
@@ -22,18 +24,30 @@ APP_SECRET_OPTION = "app_secret"
 # Token configurations
 LATEST_SECTION = "latest"
 LOG_SECTION_PREFIX = "log"
+POOL_SECTION_PREFIX = "pool"
 TIMESTAMP_OPTION = "timestamp"
 SHORT_LIVED_USER_ACCESS_TOKEN_OPTION = "short_lived_user_access_token"
 LONG_LIVED_USER_ACCESS_TOKEN_OPTION = "long_lived_user_access_token"
+# Long-lived token that was exchanged for a new one by refresh_user_access_token
+REFRESHED_USER_ACCESS_TOKEN_OPTION = "refreshed_user_access_token"
+EXPIRATION_TIMESTAMP_OPTION = "expiration_timestamp"
 
 # Facebook OAuth specs
 URL_BASE = "https://graph.facebook.com/oauth/access_token"
+DEBUG_TOKEN_URL_BASE = "https://graph.facebook.com/debug_token"
 FB_EXCHANGE_TOKEN_GRANT_TYPE = "fb_exchange_token"
 
+# Long-lived user access tokens expire after about 60 days
+LONG_LIVED_TOKEN_DURATION = timedelta(days = 60)
+EXPIRATION_WARNING_DURATION = timedelta(days = 7)
+EXPIRATION_REFRESH_DURATION = timedelta(days = 3)
+
 class TokenManager:
 	def __init__(self, verbose = True):
 		assert isinstance(verbose, bool)
 		self.verbose = verbose
+		self._token_config = None
+		self._token_config_mtime = None
 		self._init_configs()
 
 	def _init_configs(self):
@@ -43,7 +57,7 @@ class TokenManager:
 				with open(filename, "w") as f:
 					config.write(f)
 				if self.verbose:
-					print("[TokenManager] Created file: {}".format(filename))
+					logger.debug("Created file: {}".format(filename))
 
 	def _write_app_id(self, app_id):
 		filename = APP_CONFIG_FILENAME
@@ -56,7 +70,7 @@ class TokenManager:
 			config.write(f)
 		os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR)
 		if self.verbose:
-			print("[TokenManager] Wrote app id to file: {}".format(filename))
+			logger.debug("Wrote app id to file: {}".format(filename))
 
 	def _write_app_secret(self, app_secret):
 		filename = APP_CONFIG_FILENAME
@@ -69,7 +83,7 @@ class TokenManager:
 			config.write(f)
 		os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR)
 		if self.verbose:
-			print("[TokenManager] Wrote app secret to file: {}".format(filename))
+			logger.debug("Wrote app secret to file: {}".format(filename))
 
 	def _read_app_id(self):
 		filename = APP_CONFIG_FILENAME
@@ -78,13 +92,10 @@ class TokenManager:
 			config.read(filename)
 			app_id = config.get(APP_SECTION, APP_ID_OPTION)
 		except (configparser.NoSectionError, configparser.NoOptionError) as e:
-			print()
-			print("[TokenManager] [ERROR] Cannot read app id from file:", filename)
-			print()
+			logger.error("Cannot read app id from file: %s", filename)
 			raise
-		os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR)
 		if self.verbose:
-			print("[TokenManager] Read app id from file: {}".format(filename))
+			logger.debug("Read app id from file: {}".format(filename))
 		return app_id
 
 	def _read_app_secret(self):
@@ -94,16 +105,32 @@ class TokenManager:
 			config.read(filename)
 			app_secret = config.get(APP_SECTION, APP_SECRET_OPTION)
 		except (configparser.NoSectionError, configparser.NoOptionError) as e:
-			print()
-			print("[TokenManager] [ERROR] Cannot read app secret from file:", filename)
-			print()
+			logger.error("Cannot read app secret from file: %s", filename)
 			raise
-		os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR)
 		if self.verbose:
-			print("[TokenManager] Read app secret from file: {}".format(filename))
+			logger.debug("Read app secret from file: {}".format(filename))
 		return app_secret
 
-	def _write_user_tokens(self, short_lived_user_access_token, long_lived_user_access_token):
+	# Parsed token config file, cached until the file is modified or the cache is invalidated
+	def _read_token_config(self):
+		filename = TOKEN_CONFIG_FILENAME
+		mtime = os.stat(filename).st_mtime_ns
+		if self._token_config is None or self._token_config_mtime != mtime:
+			config = configparser.ConfigParser()
+			config.read(filename)
+			self._token_config = config
+			self._token_config_mtime = mtime
+			if self.verbose:
+				logger.debug("Read user access tokens from file: {}".format(filename))
+		return self._token_config
+
+	def _get_token_section(self, token_label):
+		if token_label is None or token_label == LATEST_SECTION:
+			return LATEST_SECTION
+		return "{:s}_{:s}".format(POOL_SECTION_PREFIX, token_label)
+
+	# A short_lived_user_access_token of None keeps the short-lived token already stored for the token label
+	def _write_user_tokens(self, short_lived_user_access_token, long_lived_user_access_token, token_label = None, expiration_timestamp = None, refreshed_user_access_token = None):
 		filename = TOKEN_CONFIG_FILENAME
 		config = configparser.ConfigParser()
 		config.read(filename)
@@ -112,42 +139,65 @@ class TokenManager:
 		now = datetime.now()
 		timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
 		log_section = "{:s}_{:s}".format(LOG_SECTION_PREFIX, now.strftime("%Y_%m_%d_%H_%M_%S"))
+		# Several tokens can be written within the same second (e.g., when refreshing a token pool)
+		log_index = 1
+		while config.has_section(log_section):
+			log_index += 1
+			log_section = "{:s}_{:s}_{:d}".format(LOG_SECTION_PREFIX, now.strftime("%Y_%m_%d_%H_%M_%S"), log_index)
 
 		# Write user tokens to a newly-created log section of the config file
 		config.add_section(log_section)
 		config.set(log_section, TIMESTAMP_OPTION, timestamp)
-		config.set(log_section, SHORT_LIVED_USER_ACCESS_TOKEN_OPTION, short_lived_user_access_token)
+		if short_lived_user_access_token is not None:
+			config.set(log_section, SHORT_LIVED_USER_ACCESS_TOKEN_OPTION, short_lived_user_access_token)
+		if refreshed_user_access_token is not None:
+			config.set(log_section, REFRESHED_USER_ACCESS_TOKEN_OPTION, refreshed_user_access_token)
 		config.set(log_section, LONG_LIVED_USER_ACCESS_TOKEN_OPTION, long_lived_user_access_token)
+		if expiration_timestamp is not None:
+			config.set(log_section, EXPIRATION_TIMESTAMP_OPTION, expiration_timestamp)
 
-		# Write user tokens to the latest section of the config file
-		if not config.has_section(LATEST_SECTION):
-			config.add_section(LATEST_SECTION)
-		config.set(LATEST_SECTION, TIMESTAMP_OPTION, timestamp)
-		config.set(LATEST_SECTION, SHORT_LIVED_USER_ACCESS_TOKEN_OPTION, short_lived_user_access_token)
-		config.set(LATEST_SECTION, LONG_LIVED_USER_ACCESS_TOKEN_OPTION, long_lived_user_access_token)
+		# Write user tokens to the latest section (or to a token pool section) of the config file
+		token_section = self._get_token_section(token_label)
+		if not config.has_section(token_section):
+			config.add_section(token_section)
+		config.set(token_section, TIMESTAMP_OPTION, timestamp)
+		if short_lived_user_access_token is not None:
+			config.set(token_section, SHORT_LIVED_USER_ACCESS_TOKEN_OPTION, short_lived_user_access_token)
+		config.set(token_section, LONG_LIVED_USER_ACCESS_TOKEN_OPTION, long_lived_user_access_token)
+		if expiration_timestamp is not None:
+			config.set(token_section, EXPIRATION_TIMESTAMP_OPTION, expiration_timestamp)
+		elif config.has_option(token_section, EXPIRATION_TIMESTAMP_OPTION):
+			config.remove_option(token_section, EXPIRATION_TIMESTAMP_OPTION)
 
 		# Write to config file
 		with open(filename, "w") as f:
 			config.write(f)
 		os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR)
+		self.invalidate()
 		if self.verbose:
-			print("[TokenManager] Wrote user access tokens to file: {}".format(filename))
+			logger.debug("Wrote user access tokens to file: {}".format(filename))
 
 	def _read_latest_user_token(self):
 		filename = TOKEN_CONFIG_FILENAME
 		try:
-			config = configparser.ConfigParser()
-			config.read(filename)
-			app_secret = config.get(LATEST_SECTION, LONG_LIVED_USER_ACCESS_TOKEN_OPTION)
+			config = self._read_token_config()
+			long_lived_user_access_token = config.get(LATEST_SECTION, LONG_LIVED_USER_ACCESS_TOKEN_OPTION)
 		except (configparser.NoSectionError, configparser.NoOptionError) as e:
-			print()
-			print("[TokenManager] [ERROR] Cannot read the latest long-lived user access token from file:", filename)
-			print()
+			logger.error("Cannot read the latest long-lived user access token from file: %s", filename)
 			raise
-		os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR)
-		if self.verbose:
-			print("[TokenManager] Read the latest long-lived user access token from file: {}".format(filename))
-		return app_secret
+		return long_lived_user_access_token
+
+	# Long-lived user access tokens in the latest section and in all token pool sections, keyed by token label
+	def _read_all_user_tokens(self):
+		config = self._read_token_config()
+		user_tokens = {}
+		if config.has_option(LATEST_SECTION, LONG_LIVED_USER_ACCESS_TOKEN_OPTION):
+			user_tokens[LATEST_SECTION] = config.get(LATEST_SECTION, LONG_LIVED_USER_ACCESS_TOKEN_OPTION)
+		pool_section_prefix = "{:s}_".format(POOL_SECTION_PREFIX)
+		for section in config.sections():
+			if section.startswith(pool_section_prefix) and config.has_option(section, LONG_LIVED_USER_ACCESS_TOKEN_OPTION):
+				user_tokens[section[len(pool_section_prefix):]] = config.get(section, LONG_LIVED_USER_ACCESS_TOKEN_OPTION)
+		return user_tokens
 
 	def _generate_long_lived_token(self, short_lived_user_access_token):
 		app_id = self._read_app_id()
@@ -165,19 +215,67 @@ class TokenManager:
 			r = requests.get(url)
 			results = r.json()
 			if "error" in results:
-				print()
-				print("[TokenManager] [ERROR] Received an error message from server: ", URL_BASE)
-				print(json.dumps(results, indent = 2, sort_keys = True))
-				print()
+				logger.error("Received an error message from server: %s", URL_BASE, extra = {"fields": {"error": json.dumps(results["error"], sort_keys = True)}})
 				raise
 			long_lived_user_access_token = results["access_token"]
+			expires_in = results["expires_in"] if "expires_in" in results else None
 		except requests.exceptions.ConnectionError:
-			print()
-			print("[TokenManager] [ERROR] Cannot connect to server:", URL_BASE)
-			print()
+			logger.error("Cannot connect to server: %s", URL_BASE)
 			raise
 
-		return long_lived_user_access_token
+		expiration_timestamp = (datetime.now() + timedelta(seconds = int(expires_in))).strftime("%Y-%m-%d %H:%M:%S") if expires_in is not None else None
+		return (long_lived_user_access_token, expiration_timestamp)
+
+	# Ask the debug endpoint when a token expires; returns None if the token never expires or cannot be inspected
+	def _debug_token_expiration(self, user_access_token):
+		config = configparser.ConfigParser()
+		config.read(APP_CONFIG_FILENAME)
+		if not config.has_option(APP_SECTION, APP_ID_OPTION) or not config.has_option(APP_SECTION, APP_SECRET_OPTION):
+			return None
+		app_id = config.get(APP_SECTION, APP_ID_OPTION)
+		app_secret = config.get(APP_SECTION, APP_SECRET_OPTION)
+		data = {
+			"input_token": user_access_token,
+			"access_token": "{}|{}".format(app_id, app_secret),
+		}
+		url = "{}?{}".format(DEBUG_TOKEN_URL_BASE, urllib.parse.urlencode(data))
+		try:
+			r = requests.get(url)
+			results = r.json()
+		except (requests.exceptions.ConnectionError, ValueError):
+			logger.warning("Cannot inspect token at server: %s", DEBUG_TOKEN_URL_BASE)
+			return None
+		expires_at = results["data"]["expires_at"] if "data" in results and "expires_at" in results["data"] else 0
+		if expires_at == 0:
+			return None
+		return datetime.fromtimestamp(expires_at).strftime("%Y-%m-%d %H:%M:%S")
+
+	# Expiration of a token: as recorded when the token was generated, or else as reported by the debug
+	# endpoint (and then recorded), or else estimated from the time the token was generated
+	def _get_token_expiration(self, token_label):
+		config = self._read_token_config()
+		token_section = self._get_token_section(token_label)
+		if not config.has_section(token_section):
+			return None
+		if config.has_option(token_section, EXPIRATION_TIMESTAMP_OPTION):
+			return datetime.strptime(config.get(token_section, EXPIRATION_TIMESTAMP_OPTION), "%Y-%m-%d %H:%M:%S")
+		expiration_timestamp = self._debug_token_expiration(config.get(token_section, LONG_LIVED_USER_ACCESS_TOKEN_OPTION))
+		if expiration_timestamp is not None:
+			self._write_token_expiration(token_label, expiration_timestamp)
+			return datetime.strptime(expiration_timestamp, "%Y-%m-%d %H:%M:%S")
+		if config.has_option(token_section, TIMESTAMP_OPTION):
+			return datetime.strptime(config.get(token_section, TIMESTAMP_OPTION), "%Y-%m-%d %H:%M:%S") + LONG_LIVED_TOKEN_DURATION
+		return None
+
+	def _write_token_expiration(self, token_label, expiration_timestamp):
+		filename = TOKEN_CONFIG_FILENAME
+		config = configparser.ConfigParser()
+		config.read(filename)
+		config.set(self._get_token_section(token_label), EXPIRATION_TIMESTAMP_OPTION, expiration_timestamp)
+		with open(filename, "w") as f:
+			config.write(f)
+		os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR)
+		self.invalidate()
 
 	def set_app_id(self, app_id):
 		assert isinstance(app_id, str)
@@ -187,12 +285,55 @@ class TokenManager:
 		assert isinstance(app_secret, str)
 		self._write_app_secret(app_secret)
 
-	def generate_user_access_token(self, short_lived_user_access_token):
+	def generate_user_access_token(self, short_lived_user_access_token, token_label = None):
 		assert isinstance(short_lived_user_access_token, str)
-		long_lived_user_access_token = self._generate_long_lived_token(short_lived_user_access_token)
-		self._write_user_tokens(short_lived_user_access_token, long_lived_user_access_token)
+		assert token_label is None or isinstance(token_label, str)
+		(long_lived_user_access_token, expiration_timestamp) = self._generate_long_lived_token(short_lived_user_access_token)
+		self._write_user_tokens(short_lived_user_access_token, long_lived_user_access_token, token_label = token_label, expiration_timestamp = expiration_timestamp)
+
+	# Exchange a long-lived token for a new one before it expires.
+	# Running workers pick up the new token when they see that the token config file has changed.
+	def refresh_user_access_token(self, token_label = None):
+		user_access_tokens = self._read_all_user_tokens()
+		user_access_token = user_access_tokens[LATEST_SECTION if token_label is None else token_label]
+		(long_lived_user_access_token, expiration_timestamp) = self._generate_long_lived_token(user_access_token)
+		self._write_user_tokens(None, long_lived_user_access_token, token_label = token_label, expiration_timestamp = expiration_timestamp, refreshed_user_access_token = user_access_token)
+		if self.verbose:
+			logger.info("Refreshed user access token '{}' (expires {})".format(LATEST_SECTION if token_label is None else token_label, expiration_timestamp))
+
+	# Warn about tokens that expire soon, and refresh them if auto_refresh is set.
+	# Returns the labels of tokens that have already expired.
+	def check_expiration(self, auto_refresh = False, warning_duration = EXPIRATION_WARNING_DURATION, refresh_duration = EXPIRATION_REFRESH_DURATION):
+		assert isinstance(warning_duration, timedelta)
+		assert isinstance(refresh_duration, timedelta)
+		now = datetime.now()
+		expired_token_labels = []
+		for token_label in sorted(self._read_all_user_tokens().keys()):
+			expiration = self._get_token_expiration(token_label)
+			if expiration is None:
+				continue
+			if auto_refresh and expiration - now < refresh_duration:
+				try:
+					self.refresh_user_access_token(token_label)
+					continue
+				except Exception as e:
+					logger.warning("Cannot refresh user access token '{}': {}".format(token_label, e))
+			if expiration <= now:
+				expired_token_labels.append(token_label)
+				logger.warning("User access token '{}' expired at {}".format(token_label, expiration.strftime("%Y-%m-%d %H:%M:%S")))
+			elif expiration - now < warning_duration:
+				logger.warning("User access token '{}' expires at {}".format(token_label, expiration.strftime("%Y-%m-%d %H:%M:%S")))
+		return expired_token_labels
 
 	def get_user_access_token(self):
 		long_lived_user_access_token = self._read_latest_user_token()
 		return long_lived_user_access_token
 
+	def get_user_access_tokens(self):
+		user_access_tokens = self._read_all_user_tokens()
+		return user_access_tokens
+
+	# Force the token config file to be re-read (e.g., after a token is rejected with error 190)
+	def invalidate(self):
+		self._token_config = None
+		self._token_config_mtime = None
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+from common import Log
 import facebook_utils
 import argparse
 
@@ -22,18 +23,37 @@ parser = argparse.ArgumentParser(
 )
 parser.add_argument("country", choices = COUNTRIES, type = str, default = DEFAULT_COUNTRY)
 parser.add_argument("last_n_days", choices = DURATIONS, type = str, default = DEFAULT_DURATION)
+parser.add_argument("--deadline", help = "Number of hours until the task should be completed (used by the 'fair' scheduler)", type = float, default = None)
+parser.add_argument("--balance", help = "Balance splits by the number of ads downloaded in past runs of the same experiment", action = "store_true")
+parser.add_argument("--log-level", help = "Minimum level of log messages to show (DEBUG also shows each step of each task)", choices = Log.LOG_LEVELS, type = str, default = Log.DEFAULT_LOG_LEVEL)
+parser.add_argument("--log-file", help = "Also write log messages to this file", type = str, default = None)
 
 # Parse command line arguments.
 args = parser.parse_args()
+Log.configure(level = args.log_level, filename = args.log_file)
+verbose = args.log_level == "DEBUG"
 experiment_type = args.country
 last_n_days = -1 if args.last_n_days == "all" else int(args.last_n_days)
 
-task_manager = facebook_utils.TaskManager(verbose = True)
-queue_manager = facebook_utils.QueueManager(verbose = True)
+task_manager = facebook_utils.TaskManager(verbose = verbose)
+queue_manager = facebook_utils.QueueManager(verbose = verbose)
 
 # Create task(s).
-experiment_spec = task_manager.create_experiment(experiment_type, last_n_days)
-split_specs = task_manager.create_splits(experiment_spec)
+experiment_spec = task_manager.create_experiment(experiment_type, last_n_days, opt_deadline_hours = args.deadline)
+ad_counts = None
+if args.balance:
+	if experiment_spec["search_by_advertisers"]:
+		exports_db = facebook_utils.ExportsDBv1(experiment_spec["experiment_key"], verbose = verbose)
+		if exports_db.exists():
+			exports_db.open()
+			ad_counts = exports_db.get_ad_counts_by_advertiser()
+			exports_db.close(post_process = False)
+	if ad_counts is None or len(ad_counts) == 0:
+		downloads_db = facebook_utils.DownloadsDB(verbose = verbose)
+		downloads_db.open()
+		ad_counts = downloads_db.get_ad_counts(experiment_spec["experiment_key"], "advertisers" if experiment_spec["search_by_advertisers"] else "countries")
+		downloads_db.close()
+split_specs = task_manager.iter_splits(experiment_spec, ad_counts = ad_counts)
 page_spec = task_manager.init_page()
 attempt_spec = task_manager.init_attempt()
 continuation = task_manager.init_continuation()
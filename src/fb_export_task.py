@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+from common import Log
 import facebook_utils
 import argparse
 
@@ -13,11 +14,15 @@ COUNTRIES = [
 
 parser = argparse.ArgumentParser()
 parser.add_argument("country", choices = COUNTRIES, type = str, default = DEFAULT_COUNTRY)
+parser.add_argument("--log-level", help = "Minimum level of log messages to show (DEBUG also shows each step of each task)", choices = Log.LOG_LEVELS, type = str, default = Log.DEFAULT_LOG_LEVEL)
+parser.add_argument("--log-file", help = "Also write log messages to this file", type = str, default = None)
 
 # Parse command line arguments.
 args = parser.parse_args()
+Log.configure(level = args.log_level, filename = args.log_file)
+verbose = args.log_level == "DEBUG"
 experiment_type = args.country
 
-exports_db = facebook_utils.ExportsDBv1(experiment_type)
+exports_db = facebook_utils.ExportsDBv1(experiment_type, verbose = verbose)
 
 exports_db.export_all_ads()
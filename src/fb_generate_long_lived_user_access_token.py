@@ -8,7 +8,8 @@ parser = argparse.ArgumentParser(
 	description = "This script calls the Facebook OAuth endpoint, and generates a long-lived user access token. A long-lived token can be used to access the Facebook Graph API for up to three months. You will need your Facebook app id, app secret, and a short-lived user access token in order to generate a long-lived token. You can set your Facebook app id an app secret using the scripts 'fb_set_app_id.py' and 'fb_set_app_secret.py'. You can generate a short-lived token using the Facebook Graph API Explorer at https://developers.facebook.com/tools/explorer"
 )
 parser.add_argument("short_lived_token", help = "short-lived user access token", type = str)
+parser.add_argument("--pool", help = "Add the token to the token pool under this label, instead of replacing the latest token", type = str, default = None)
 args = parser.parse_args()
 
 token_manager = facebook_utils.TokenManager()
-token_manager.generate_user_access_token(args.short_lived_token)
+token_manager.generate_user_access_token(args.short_lived_token, token_label = args.pool)
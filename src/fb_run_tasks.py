@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
+from common import Log
 import facebook_utils
 import argparse
+from datetime import timedelta
+import sys
 
 MAX_ITERS = 99999
 
@@ -9,50 +12,33 @@ parser = argparse.ArgumentParser(
 	usage = "Execute all tasks in the download queue.",
 	description = "This script executes all tasks in the download queue. Call 'fb_add_task.py' to add download tasks."
 )
-
-api_helper = facebook_utils.APIHelper(verbose = True)
-token_manager = facebook_utils.TokenManager(verbose = True)
-task_manager = facebook_utils.TaskManager(verbose = True)
-queue_manager = facebook_utils.QueueManager(verbose = True)
-rate_limit_manager = facebook_utils.RateLimitManager(verbose = True)
-downloads_db = facebook_utils.DownloadsDB(verbose = True)
-
-for iter in range(0, MAX_ITERS):
-
-	# Get the next active task
-	task = queue_manager.get_next_active_task()
-	
-	if task is None:
-		break
-	else:
-		task_key = task["task_key"]
-
-		# Read the latest user access token.
-		access_token = token_manager.get_user_access_token()
-
-		# Construct the URL for the Graph API end point.
-		url = api_helper.get_url(task, access_token)
-	
-		# Query the Graph API end point, obeying any rate limit.
-		rate_limit_manager.before_search()
-		queue_manager.start_task(task_key)
-		response = api_helper.search(url)
-		queue_manager.finish_task(task_key)
-		(finish_code, finish_log) = api_helper.parse_response(task, access_token, response)
-		queue_manager.amend_task(task_key, finish_code, finish_log)
-		rate_limit_manager.after_search()
-		
-		# Save downloaded data.
-		downloads_db.open()
-		downloads_db.insert(queue_manager.get_task_as_dict(task_key), url, response)
-		downloads_db.close()
-		
-		# Schedule a new task, if the download task is not completed.
-		next_task = task_manager.continue_task(task, finish_code, finish_log)
-		if next_task is not None:
-			experiment_spec = next_task["experiment_spec"]
-			split_spec = next_task["split_spec"]
-			page_spec = next_task["page_spec"]
-			attempt_spec = next_task["attempt_spec"]
-			continuation = next_task["continuation"]
-			queue_manager.create_task(experiment_spec, split_spec, page_spec, attempt_spec, continuation)
+parser.add_argument("--scheduler", help = "Policy for picking the next task", choices = sorted(facebook_utils.SCHEDULERS.keys()), type = str, default = facebook_utils.PriorityScheduler.name)
+parser.add_argument("--refresh-tokens", help = "Exchange user access tokens for new ones a few days before they expire", action = "store_true")
+parser.add_argument("--serial", help = "Record and save each page before sending the next request, instead of in background threads", action = "store_true")
+parser.add_argument("--prefetch", help = "Request the next page of a split as soon as its paging cursor is known, while the current page is saved in the background", action = "store_true")
+parser.add_argument("--stale-task-minutes", help = "When several runners share the queue, only restart interrupted tasks that were started more than this many minutes ago (default: restart all interrupted tasks at startup)", type = int, default = None)
+parser.add_argument("--metrics-file", help = "Write metrics to this file in the Prometheus text format", type = str, default = None)
+parser.add_argument("--statsd", help = "Send metrics to a StatsD server (host:port)", type = str, default = None)
+parser.add_argument("--trace-file", help = "Append the duration of each stage of each task to this file (JSON lines)", type = str, default = None)
+parser.add_argument("--log-level", help = "Minimum level of log messages to show (DEBUG also shows each step of each task)", choices = Log.LOG_LEVELS, type = str, default = Log.DEFAULT_LOG_LEVEL)
+parser.add_argument("--log-file", help = "Also write log messages to this file", type = str, default = None)
+args = parser.parse_args()
+Log.configure(level = args.log_level, filename = args.log_file)
+verbose = args.log_level == "DEBUG"
+scheduler = facebook_utils.SCHEDULERS[args.scheduler]()
+stale_task_duration = None if args.stale_task_minutes is None else timedelta(minutes = args.stale_task_minutes)
+
+statsd_address = None
+if args.statsd is not None:
+	(statsd_host, statsd_port) = args.statsd.rsplit(":", 1)
+	statsd_address = (statsd_host, int(statsd_port))
+facebook_utils.METRICS.configure(prometheus_filename = args.metrics_file, statsd_address = statsd_address, trace_filename = args.trace_file)
+
+token_manager = facebook_utils.TokenManager(verbose = verbose)
+token_pool = facebook_utils.TokenPool(token_manager, verbose = verbose)
+
+# Fetch pages, record results and schedule next pages, and save downloaded data, in a pipeline.
+pipeline = facebook_utils.DownloadPipeline(token_pool, scheduler = scheduler, verbose = verbose, serial = args.serial, prefetch = args.prefetch, refresh_tokens = args.refresh_tokens, stale_task_duration = stale_task_duration)
+pipeline.run(max_iters = MAX_ITERS)
+if pipeline.is_out_of_tokens:
+	sys.exit("Stopped before the download queue was empty: no healthy access tokens are left. Replace the expired or invalid tokens with 'fb_generate_long_lived_user_access_token.py' and run again.")
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
 import google_utils
+from google_utils.google_ad_creatives_download_helper import PAGE_LOAD_STRATEGIES, DEFAULT_PAGE_LOAD_STRATEGY
+from google_utils.google_ad_creatives_writer import DEFAULT_WRITE_BATCH_SIZE, DEFAULT_WRITE_FLUSH_INTERVAL_SECS
+from google_utils.google_ad_screenshot_store import SCREENSHOT_FORMATS, DEFAULT_SCREENSHOT_FORMAT, DEFAULT_ENCODER_THREADS
 import argparse
 
 parser = argparse.ArgumentParser(
@@ -15,6 +18,15 @@ parser.add_argument("--text", help = "Download the fulltext of text ads", action
 parser.add_argument("--images", help = "Download the images of image ads", action = "store_true", default = False)
 parser.add_argument("--videos", help = "Download the videos of video ads", action = "store_true", default = False)
 parser.add_argument("--screenshot", help = "Take a screenshot of the ads", action = "store_true", default = False)
+parser.add_argument("--screenshot-format", help = "Store screenshots as lossless WebP or optimized PNG files (requires Pillow)", choices = SCREENSHOT_FORMATS, type = str, default = DEFAULT_SCREENSHOT_FORMAT)
+parser.add_argument("--screenshot-threads", help = "Number of threads encoding and writing screenshots, per browser", type = int, default = DEFAULT_ENCODER_THREADS)
+parser.add_argument("--http-first", help = "Try to extract text and image ads from the served HTML before opening them in a browser", action = "store_true", default = False)
+parser.add_argument("--block-resources", help = "Block trackers, prefetching, and background services (and media and web fonts, unless taking screenshots)", action = "store_true", default = False)
+parser.add_argument("--page-load-strategy", help = "Wait for the full page load ('normal') or only for the DOM ('eager')", choices = PAGE_LOAD_STRATEGIES, type = str, default = DEFAULT_PAGE_LOAD_STRATEGY)
+parser.add_argument("--profile-folder", help = "Keep Firefox profiles in this folder, and reuse them when the browser is restarted", type = str, default = None)
+parser.add_argument("--workers", help = "Number of browsers to run in parallel, each in its own process", type = int, default = 1)
+parser.add_argument("--write-batch-size", help = "Write downloaded ads to the database in batches of up to this many ads", type = int, default = DEFAULT_WRITE_BATCH_SIZE)
+parser.add_argument("--write-flush-interval", help = "Write a partial batch after this many seconds", type = float, default = DEFAULT_WRITE_FLUSH_INTERVAL_SECS)
 
 # Parse command line arguments.
 args = parser.parse_args()
@@ -27,8 +39,19 @@ download_text_ads = args.text
 download_image_ads = args.images
 download_video_ads = args.videos
 screenshot = args.screenshot
+screenshot_format = args.screenshot_format
+screenshot_threads = args.screenshot_threads
+workers = args.workers
+http_first = args.http_first
+block_resources = args.block_resources
+page_load_strategy = args.page_load_strategy
+profile_folder = args.profile_folder
+write_batch_size = args.write_batch_size
+write_flush_interval = args.write_flush_interval
 
-helper = google_utils.GoogleAdCreativesDownloadHelper(timestamp, headless = headless, shuffle = shuffle, echo = echo)
+helper = google_utils.GoogleAdCreativesDownloadHelper(timestamp, headless = headless, shuffle = shuffle, echo = echo, workers = workers, http_first = http_first,
+	block_resources = block_resources, page_load_strategy = page_load_strategy, profile_folder = profile_folder,
+	write_batch_size = write_batch_size, write_flush_interval = write_flush_interval, screenshot_format = screenshot_format, screenshot_threads = screenshot_threads)
 if download_text_ads:
 	helper.download_text_ads(limit, screenshot)
 if download_image_ads:
@@ -2,6 +2,8 @@
 
 from .google_ad_library_db import GoogleAdLibraryDB
 from .google_ad_creatives_db import GoogleAdCreativesDB
+from .google_ad_creatives_writer import GoogleAdCreativesWriter
+from .google_ad_screenshot_store import GoogleAdScreenshotStore
 from .google_big_query_download_helper import GoogleBigQueryDownloadHelper
 from .google_ad_report_download_helper import GoogleAdReportDownloadHelper
 from .google_ad_creatives_download_helper import GoogleAdCreativesDownloadHelper
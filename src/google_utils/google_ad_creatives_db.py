@@ -1,7 +1,22 @@
 #!/usr/bin/env python3
 
 from datetime import datetime
-from sqlalchemy import Table, Column, Integer, String, Text, DateTime, Boolean, MetaData
+from sqlalchemy import Table, Column, Index, Integer, String, Text, DateTime, Boolean, MetaData, UniqueConstraint
+
+# States of an ad in the crawl queue
+CRAWL_PENDING = "pending"
+CRAWL_IN_PROGRESS = "in_progress"
+CRAWL_DONE = "done"
+
+# Kinds of screenshots of an ad
+SCREENSHOT_AD = "ad"
+SCREENSHOT_ERROR = "error"
+
+# What identifies a creative asset
+ASSET_HTML = "html"
+ASSET_IMAGE_URL = "image_url"
+ASSET_YOUTUBE_ID = "youtube_id"
+ASSET_VIDEO_URL = "video_url"
 
 class GoogleAdCreativesDB:
 	def __init__(self, engine):
@@ -63,3 +78,62 @@ class GoogleAdCreativesDB:
 			Column("is_unknown_error", Boolean, default = False, nullable = False),
 			Column("timestamp", DateTime, default = datetime.now, nullable = False),
 		)
+
+		# Ads to download, shared by all crawler processes. An ad is claimed by setting its state to in-progress
+		# with a lease; ads whose lease has expired (e.g. when a crawler was killed) can be claimed again.
+		self.crawl_queue = Table("crawl_queue", metadata,
+			Column("key", Integer, primary_key = True),
+			Column("ad_id", String, unique = True, nullable = False),
+			Column("ad_type", String, nullable = False),
+			Column("state", String, default = CRAWL_PENDING, nullable = False),
+			Column("lease_owner", String, default = None),
+			Column("lease_expiry", DateTime, default = None),
+			Column("attempt_count", Integer, default = 0, nullable = False),
+			Column("timestamp", DateTime, default = datetime.now, onupdate = datetime.now, nullable = False),
+			Index("crawl_queue_claim_index", "ad_type", "state", "lease_expiry"),
+			Index("crawl_queue_lease_index", "lease_owner"),
+		)
+
+		# Google Ad Library downloads (and ad types) whose ads have been added to the crawl queue
+		self.crawl_seeds = Table("crawl_seeds", metadata,
+			Column("key", Integer, primary_key = True),
+			Column("library_timestamp", String, nullable = False),
+			Column("ad_type", String, nullable = False),
+			Column("ad_count", Integer, default = None),
+			Column("timestamp", DateTime, default = datetime.now, nullable = False),
+			UniqueConstraint("library_timestamp", "ad_type"),
+		)
+
+		# Screenshots of ads, stored by content hash (see GoogleAdScreenshotStore)
+		self.ad_screenshots = Table("ad_screenshots", metadata,
+			Column("key", Integer, primary_key = True),
+			Column("ad_id", String, nullable = False),
+			Column("kind", String, nullable = False),
+			Column("content_hash", String, nullable = False),
+			Column("file_format", String, nullable = False),
+			Column("timestamp", DateTime, default = datetime.now, nullable = False),
+			UniqueConstraint("ad_id", "kind"),
+			Index("ad_screenshots_content_hash_index", "content_hash"),
+		)
+
+		# Creatives shared by ads (e.g., when a campaign re-runs the same image), keyed on a hash of their media url
+		# or YouTube id, or else of their normalized HTML. Ads keep their own HTML in the table of their ad type; an asset
+		# identified by its HTML also stores the HTML of the first ad seen with it.
+		self.creative_assets = Table("creative_assets", metadata,
+			Column("key", Integer, primary_key = True),
+			Column("asset_hash", String, unique = True, nullable = False),
+			Column("ad_type", String, nullable = False),
+			Column("asset_kind", String, nullable = False),
+			Column("media_url", String, default = None),
+			Column("ad_html", Text, default = None),
+			Column("screenshot_hash", String, default = None),
+			Column("screenshot_format", String, default = None),
+			Column("timestamp", DateTime, default = datetime.now, nullable = False),
+		)
+		self.creative_asset_refs = Table("creative_asset_refs", metadata,
+			Column("key", Integer, primary_key = True),
+			Column("ad_id", String, unique = True, nullable = False),
+			Column("asset_hash", String, nullable = False),
+			Column("timestamp", DateTime, default = datetime.now, nullable = False),
+			Index("creative_asset_refs_asset_hash_index", "asset_hash"),
+		)
@@ -1,29 +1,111 @@
 #!/usr/bin/env python3
 
 from common import Constants
-from google_utils import GoogleAdLibraryDB, GoogleAdCreativesDB
+from google_utils import GoogleAdLibraryDB, GoogleAdCreativesDB, GoogleAdCreativesWriter, GoogleAdScreenshotStore
+from google_utils.google_ad_creatives_db import CRAWL_PENDING, CRAWL_IN_PROGRESS, CRAWL_DONE, SCREENSHOT_AD, SCREENSHOT_ERROR
+from google_utils.google_ad_creatives_db import ASSET_HTML, ASSET_IMAGE_URL, ASSET_YOUTUBE_ID, ASSET_VIDEO_URL
+from google_utils.google_ad_creatives_writer import DEFAULT_WRITE_BATCH_SIZE, DEFAULT_WRITE_FLUSH_INTERVAL_SECS, resolve_screenshots
+from google_utils.google_ad_screenshot_store import DEFAULT_SCREENSHOT_FORMAT, DEFAULT_ENCODER_THREADS
 
-from collections import namedtuple
-from datetime import datetime
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+import hashlib
+import html
+from html.parser import HTMLParser
+import multiprocessing
 import os
+import queue
 import random
 import re
+import requests
+from requests.adapters import HTTPAdapter
+import socket
+import threading
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
 import sqlalchemy
-from sqlalchemy.sql import select
-import time
+from sqlalchemy.sql import select, and_, or_, func
+import uuid
+from urllib.parse import urlsplit, urlunsplit
+
+try:
+	import psutil
+except ImportError:
+	psutil = None
 
 TEXT_AD_TYPE = "Text"
 IMAGE_AD_TYPE = "Image"
 VIDEO_AD_TYPE = "Video"
 
+# Browsers are recycled when they use too much memory or keep failing, or after DRIVER_RESTART_PAGES pages
+# if psutil is not installed (MAX_DRIVER_PAGES otherwise)
 DRIVER_RESTART_PAGES = 500
+MAX_DRIVER_PAGES = 5000
+MAX_BROWSER_RSS_BYTES = 1536 * 1024 * 1024
+RSS_CHECK_PAGES = 20
+ERROR_WINDOW_SIZE = 20
+MAX_ERROR_RATE = 0.25
+MAX_CONSECUTIVE_ERRORS = 2
 PAGE_TIMEOUT_SECS = 30.0
 ELEMENT_TIMEOUT_SECS = 4.0
-IMAGE_AD_SCREENSHOT_DELAY_SECS = 0.5
-VIDEO_AD_SCREENSHOT_DELAY_SECS = 1.0
-RESTART_DRIVER_DELAY_SECS = 5.0
+ELEMENT_POLL_SECS = 0.1
+
+# Browser profile. Each worker alternates between two profiles, so that a replacement browser can start while the
+# current one still holds the lock on its profile.
+PROFILE_SLOTS = ["a", "b"]
+PAGE_LOAD_STRATEGIES = ["normal", "eager"]
+DEFAULT_PAGE_LOAD_STRATEGY = "normal"
+
+# Firefox preferences for crawling: no trackers, prefetching, background services, or WebGL
+CRAWL_FIREFOX_PREFS = {
+	"privacy.trackingprotection.enabled": True,
+	"network.prefetch-next": False,
+	"network.dns.disablePrefetch": True,
+	"network.http.speculative-parallel-limit": 0,
+	"browser.safebrowsing.malware.enabled": False,
+	"browser.safebrowsing.phishing.enabled": False,
+	"datareporting.healthreport.uploadEnabled": False,
+	"toolkit.telemetry.enabled": False,
+	"app.update.auto": False,
+	"extensions.update.enabled": False,
+	"geo.enabled": False,
+	"dom.webnotifications.enabled": False,
+	"webgl.disabled": True,
+}
+
+# Additional preferences when no screenshots are taken: no autoplay, media preloading, or web fonts.
+# Images are not blocked, since the dimensions of IMG ads depend on them.
+NO_SCREENSHOT_FIREFOX_PREFS = {
+	"media.autoplay.default": 5,
+	"media.autoplay.blocking_policy": 2,
+	"media.preload.default": 0,
+	"media.preload.auto": 0,
+	"gfx.downloadable_fonts.enabled": False,
+	"browser.display.use_document_fonts": 0,
+}
+
+# Screenshots are taken once the creative has rendered (see RENDER_COMPLETE_SCRIPT), or after RENDER_TIMEOUT_SECS
+RENDER_TIMEOUT_SECS = 2.0
+
+# Crawl queue
+SEED_BATCH_SIZE = 10000
+CLAIM_BATCH_SIZE = 50
+CRAWL_LEASE_DURATION = timedelta(hours = 1)
+MAX_CRAWL_ATTEMPTS = 3
+
+# HTTP fast path
+HTTP_TIMEOUT_SECS = 15.0
+HTTP_POOL_SIZE = 4
+HTTP_MAX_RETRIES = 2
+HTTP_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0"
+HTML_VOID_TAG_NAMES = frozenset(["area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"])
+
+# Parallel downloads
+WORKER_QUEUE_SIZE = 2
+WORKER_POLL_SECS = 5.0
+WORKER_STOP = None
+MAX_WORKER_RESTARTS = 3
 
 CREATIVE_WRAPPER_CLASS_NAME = "creative-wrapper"
 REMOVED_AD_CONTAINER_TAG_NAME = "unrenderable-ad"
@@ -34,38 +116,184 @@ IMAGE_AD_ALT_IMG_TAG_NAME = "img"
 VIDEO_AD_IFRAME_TAG_NAME = "iframe"
 VIDEO_AD_ALT_VIDEO_TAG_NAME = "video"
 
+# Describes the first element of each tag name (arguments[1]) in the creative wrapper (arguments[0]);
+# returns null if there is no creative wrapper
+CREATIVE_SNAPSHOT_SCRIPT = """
+var wrapper = document.getElementsByClassName(arguments[0])[0];
+if (!wrapper) {
+	return null;
+}
+var snapshot = {};
+for (var i = 0; i < arguments[1].length; i++) {
+	var elem = wrapper.getElementsByTagName(arguments[1][i])[0];
+	if (elem) {
+		snapshot[arguments[1][i]] = {
+			"outer_html": elem.outerHTML,
+			"width": elem.offsetWidth,
+			"height": elem.offsetHeight,
+			"src": elem.src === undefined ? elem.getAttribute("src") : elem.src,
+			"text": elem.innerText,
+		};
+	}
+}
+return snapshot;
+"""
+
+# Returns true once the document has loaded and the images and videos in the element (or the element itself) have
+# frames to show
+RENDER_COMPLETE_SCRIPT = """
+var elem = arguments[0];
+if (document.readyState !== "complete") {
+	return false;
+}
+var images = elem.tagName === "IMG" ? [elem] : elem.getElementsByTagName("img");
+for (var i = 0; i < images.length; i++) {
+	if (!images[i].complete || images[i].naturalWidth === 0) {
+		return false;
+	}
+}
+var videos = elem.tagName === "VIDEO" ? [elem] : elem.getElementsByTagName("video");
+for (var i = 0; i < videos.length; i++) {
+	if (videos[i].readyState < 2) {
+		return false;
+	}
+}
+return true;
+"""
+
+HTML_WHITESPACE_REGEX = re.compile(r"\s+")
+HTML_SPACE_BETWEEN_TAGS_REGEX = re.compile(r">\s+<")
 YOUTUBE_ID_REGEX = re.compile(r"^https://www\.youtube\.com/embed/([^/?]+)(\?.+)$")
 
 AdInfo = namedtuple("AdInfo", ["id", "url", "type"])
 
+# An element captured by CreativeHTMLParser
+class CreativeHTMLElement:
+	def __init__(self, tag, attrs, start_tag_html, depth):
+		self.tag = tag
+		self.attrs = attrs
+		self.depth = depth
+		self.html_parts = [start_tag_html]
+		self.text_parts = []
+
+	def get_outer_html(self):
+		return "".join(self.html_parts)
+
+	def get_text(self):
+		return " ".join("".join(self.text_parts).split())
+
+	def get_int_attribute(self, name):
+		value = self.attrs[name] if name in self.attrs else None
+		return int(value) if value is not None and value.isdigit() else None
+
+# Finds the first creative wrapper in an HTML document, and captures the first element of each tag name inside it
+class CreativeHTMLParser(HTMLParser):
+	def __init__(self):
+		super().__init__(convert_charrefs = False)
+		self.depth = 0
+		self.has_wrapper = False
+		self.wrapper_depth = None
+		self.elements = {}
+		self._open_elements = []
+
+	def _append_html(self, html_text, text = None):
+		for elem in self._open_elements:
+			elem.html_parts.append(html_text)
+			if text is not None:
+				elem.text_parts.append(text)
+
+	def handle_starttag(self, tag, attrs):
+		start_tag_html = self.get_starttag_text()
+		self._append_html(start_tag_html, " " if tag == "br" else None)
+		attrs = dict(attrs)
+		if self.wrapper_depth is not None and tag not in self.elements:
+			elem = CreativeHTMLElement(tag, attrs, start_tag_html, self.depth)
+			self.elements[tag] = elem
+			if tag not in HTML_VOID_TAG_NAMES:
+				self._open_elements.append(elem)
+		class_names = (attrs["class"] or "").split() if "class" in attrs else []
+		if not self.has_wrapper and CREATIVE_WRAPPER_CLASS_NAME in class_names:
+			self.has_wrapper = True
+			self.wrapper_depth = self.depth
+		if tag not in HTML_VOID_TAG_NAMES:
+			self.depth += 1
+
+	def handle_startendtag(self, tag, attrs):
+		self.handle_starttag(tag, attrs)
+		if tag not in HTML_VOID_TAG_NAMES:
+			self.handle_endtag(tag)
+
+	def handle_endtag(self, tag):
+		if tag in HTML_VOID_TAG_NAMES:
+			return
+		self.depth = max(self.depth - 1, 0)
+		self._append_html("</{}>".format(tag))
+		self._open_elements = [elem for elem in self._open_elements if elem.depth < self.depth]
+		if self.wrapper_depth is not None and self.depth <= self.wrapper_depth:
+			self.wrapper_depth = None
+
+	def handle_data(self, data):
+		self._append_html(data, data)
+
+	def handle_entityref(self, name):
+		entity = "&{};".format(name)
+		self._append_html(entity, html.unescape(entity))
+
+	def handle_charref(self, name):
+		entity = "&#{};".format(name)
+		self._append_html(entity, html.unescape(entity))
+
 class GoogleAdCreativesDownloadHelper:
-	def __init__(self, timestamp, headless = False, shuffle = False, echo = False, verbose = True):
+	def __init__(self, timestamp, headless = False, shuffle = False, echo = False, verbose = True, workers = 1, http_first = False,
+			block_resources = False, page_load_strategy = DEFAULT_PAGE_LOAD_STRATEGY, profile_folder = None, worker_index = 0, connect_db = True,
+			write_batch_size = DEFAULT_WRITE_BATCH_SIZE, write_flush_interval = DEFAULT_WRITE_FLUSH_INTERVAL_SECS,
+			screenshot_format = DEFAULT_SCREENSHOT_FORMAT, screenshot_threads = DEFAULT_ENCODER_THREADS):
+		assert workers >= 1
+		assert page_load_strategy in PAGE_LOAD_STRATEGIES
 		self.verbose = verbose
 		self.echo = echo
 		self.timestamp = timestamp
 		self.headless = headless
 		self.shuffle = shuffle
+		self.workers = workers
+		self.http_first = http_first
+		self.block_resources = block_resources
+		self.page_load_strategy = page_load_strategy
+		self.profile_folder = profile_folder
+		self.worker_index = worker_index
+		self.write_batch_size = write_batch_size
+		self.write_flush_interval = write_flush_interval
+		self.writer = None
+		self.screenshot_format = screenshot_format
+		self.screenshot_threads = screenshot_threads
+		self.screenshot_store = None
+		self.screenshot_rows = []
+		self.screenshot_futures = {}
+		self.asset_row = None
+		self.asset_screenshots = {}
+		self.asset_lookup = None
 		self.driver = None
+		self.driver_screenshot = None
+		self.replacement_driver = None
+		self.replacement_thread = None
+		self.profile_slot = 0
+		self._reset_webdriver_health()
+		self.http_session = None
 		self.download_folder = None
-		self.screenshot_text_ads_folder = None
-		self.screenshot_image_ads_folder = None
-		self.screenshot_video_ads_folder = None
-		self.screenshot_errors_folder = None
+		self.screenshot_folder = None
 		self._init_download_folder()
-		self._init_ad_library_db_session()
-		self._init_ad_creatives_db_session()
+		self.conn = None
+		self.db = None
+		if connect_db:
+			self._init_ad_library_db_session()
+			self._init_ad_creatives_db_session()
 
 	def _init_download_folder(self):
 		if self.download_folder is None:
 			self.download_folder = os.path.join(Constants.DOWNLOADS_PATH, Constants.GOOGLE_DOWNLOADS_FOLDER, self.timestamp)
-			self.screenshot_text_ads_folder = os.path.join(self.download_folder, Constants.GOOLGE_TEXT_AD_SCREENSHOTS)
-			self.screenshot_image_ads_folder = os.path.join(self.download_folder, Constants.GOOLGE_IMAGE_AD_SCREENSHOTS)
-			self.screenshot_video_ads_folder = os.path.join(self.download_folder, Constants.GOOLGE_VIDEO_AD_SCREENSHOTS)
-			self.screenshot_errors_folder = os.path.join(self.download_folder, Constants.GOOLGE_ERROR_SCREENSHOTS)
-		os.makedirs(self.screenshot_text_ads_folder, exist_ok = True)
-		os.makedirs(self.screenshot_image_ads_folder, exist_ok = True)
-		os.makedirs(self.screenshot_video_ads_folder, exist_ok = True)
-		os.makedirs(self.screenshot_errors_folder, exist_ok = True)
+			# Screenshots are shared by all downloads, like the creatives database
+			self.screenshot_folder = os.path.join(Constants.DOWNLOADS_PATH, Constants.GOOGLE_DOWNLOADS_FOLDER, Constants.GOOGLE_SCREENSHOTS_FOLDER)
+		os.makedirs(self.screenshot_folder, exist_ok = True)
 
 	def _init_ad_library_db_session(self):
 		path = os.path.join(Constants.DOWNLOADS_PATH, Constants.GOOGLE_DOWNLOADS_FOLDER, self.timestamp, Constants.GOOGLE_AD_LIBRARY_DB_FILENAME)
@@ -78,80 +306,332 @@ class GoogleAdCreativesDownloadHelper:
 		path = os.path.join(Constants.DOWNLOADS_PATH, Constants.GOOGLE_DOWNLOADS_FOLDER, Constants.GOOGLE_AD_CREATIVES_DB_FILENAME)
 		url = "sqlite:///{}".format(os.path.abspath(path))
 		engine = sqlalchemy.create_engine(url, echo = self.echo)
+		self.engine = engine
 		self.conn = engine.connect()
 		self.db = GoogleAdCreativesDB(engine)
 
-	def _start_webdriver(self):
+	def _get_firefox_options(self, screenshot, profile_slot):
+		opts = webdriver.FirefoxOptions()
+		opts.headless = self.headless
+		if self.block_resources:
+			for name, value in CRAWL_FIREFOX_PREFS.items():
+				opts.set_preference(name, value)
+			if not screenshot:
+				for name, value in NO_SCREENSHOT_FIREFOX_PREFS.items():
+					opts.set_preference(name, value)
+
+		# Reuse the same profiles (and their HTTP caches) across restarts; each worker needs its own, since Firefox locks them
+		if self.profile_folder is not None:
+			profile_path = os.path.abspath(os.path.join(self.profile_folder, "worker-{:d}-{:s}".format(self.worker_index, PROFILE_SLOTS[profile_slot])))
+			os.makedirs(profile_path, exist_ok = True)
+			opts.add_argument("-profile")
+			opts.add_argument(profile_path)
+		return opts
+
+	def _create_webdriver(self, screenshot, profile_slot):
+		opts = self._get_firefox_options(screenshot, profile_slot)
+		capabilities = webdriver.DesiredCapabilities.FIREFOX.copy()
+		capabilities["pageLoadStrategy"] = self.page_load_strategy
+		driver = webdriver.Firefox(options = opts, desired_capabilities = capabilities)
+		driver.set_window_size(Constants.GOOGLE_WINDOW_WIDTH, Constants.GOOGLE_WINDOW_HEIGHT)
+		# Elements are waited for explicitly, so that a missing element does not cost a full timeout per lookup
+		driver.implicitly_wait(0)
+		return driver
+
+	def _reset_webdriver_health(self):
+		self.driver_page_count = 0
+		self.driver_errors = deque(maxlen = ERROR_WINDOW_SIZE)
+		self.consecutive_error_count = 0
+		# No replacement browser is started before this page, after a replacement failed to start
+		self.replacement_page_count = 0
+
+	def _start_webdriver(self, screenshot = False):
+		# Media and fonts are only blocked when no screenshots are taken
+		if self.driver is not None and self.block_resources and self.driver_screenshot != screenshot:
+			self._stop_webdriver()
 		if self.driver is None:
 			print("[AdCreatives] {:s}".format(self._timestamp()))
 			print("[AdCreatives] Starting WebDriver...")
-			opts = webdriver.FirefoxOptions()
-			opts.headless = self.headless
-			self.driver = webdriver.Firefox(options = opts)
-			print("[AdCreatives] Started WebDriver")
-			self.driver.set_window_size(Constants.GOOGLE_WINDOW_WIDTH, Constants.GOOGLE_WINDOW_HEIGHT)
+			self.driver = self._create_webdriver(screenshot, self.profile_slot)
+			self.driver_screenshot = screenshot
+			self._reset_webdriver_health()
+			print("[AdCreatives] Started WebDriver (page load strategy = {:s}, block resources = {})".format(self.page_load_strategy, self.block_resources))
 			print("[AdCreatives] Set driver to {:d}px by {:d}px".format(Constants.GOOGLE_WINDOW_WIDTH, Constants.GOOGLE_WINDOW_HEIGHT))
-			self.driver.implicitly_wait(ELEMENT_TIMEOUT_SECS)
-			print("[AdCreatives] Set implicit wait to {:0.1f} seconds".format(ELEMENT_TIMEOUT_SECS))
 			print()
 
 	def _stop_webdriver(self):
+		self._discard_replacement_webdriver()
 		if self.driver is not None:
 			print("[AdCreatives] {:s}".format(self._timestamp()))
 			print("[AdCreatives] Stopping WebDriver...")
-			self.driver.close()
+			_quit_webdriver(self.driver)
 			self.driver = None
-			time.sleep(RESTART_DRIVER_DELAY_SECS)
 			print("[AdCreatives] Stopped WebDriver")
 			print()
 
+	# Resident memory of geckodriver, Firefox, and its content processes, or None if unknown
+	def _get_browser_rss(self):
+		if psutil is None:
+			return None
+		try:
+			process = psutil.Process(self.driver.service.process.pid)
+			return sum(p.memory_info().rss for p in [process] + process.children(recursive = True))
+		except (psutil.Error, AttributeError):
+			return None
+
+	# Start a replacement browser in a background thread, while the current one keeps crawling
+	def _start_replacement_webdriver(self, reason):
+		if self.replacement_thread is not None:
+			return
+		print("[AdCreatives] Warming up a replacement WebDriver ({:s})...".format(reason))
+		screenshot = self.driver_screenshot
+		profile_slot = 1 - self.profile_slot
+		def warm_up():
+			try:
+				self.replacement_driver = self._create_webdriver(screenshot, profile_slot)
+			except Exception as e:
+				print("[AdCreatives] [ERROR] Failed to start a replacement WebDriver: {}".format(e))
+		self.replacement_thread = threading.Thread(target = warm_up, name = "webdriver-warm-up", daemon = True)
+		self.replacement_thread.start()
+
+	# Switch to the replacement browser, if it is ready (or wait for it); the old browser is shut down in the background.
+	# If the replacement failed to start, keep the current browser for another _get_driver_page_limit() pages.
+	def _swap_webdriver(self, wait = False):
+		if self.replacement_thread is None or (self.replacement_thread.is_alive() and not wait):
+			return False
+		self.replacement_thread.join()
+		self.replacement_thread = None
+		if self.replacement_driver is None:
+			self.replacement_page_count = self.driver_page_count + self._get_driver_page_limit()
+			return False
+		old_driver = self.driver
+		self.driver = self.replacement_driver
+		self.replacement_driver = None
+		self.profile_slot = 1 - self.profile_slot
+		self._reset_webdriver_health()
+		if old_driver is not None:
+			threading.Thread(target = _quit_webdriver, args = (old_driver, ), name = "webdriver-quit", daemon = True).start()
+		print("[AdCreatives] Switched to the replacement WebDriver")
+		return True
+
+	def _discard_replacement_webdriver(self):
+		if self.replacement_thread is not None:
+			self.replacement_thread.join()
+			self.replacement_thread = None
+		if self.replacement_driver is not None:
+			_quit_webdriver(self.replacement_driver)
+			self.replacement_driver = None
+
+	def _get_driver_page_limit(self):
+		return MAX_DRIVER_PAGES if psutil is not None else DRIVER_RESTART_PAGES
+
+	# Recycle the browser when it keeps failing (right away), or when it has grown too large (once a replacement is ready)
+	def _update_webdriver_health(self, is_unknown_error):
+		self.driver_page_count += 1
+		self.driver_errors.append(is_unknown_error)
+		self.consecutive_error_count = self.consecutive_error_count + 1 if is_unknown_error else 0
+		error_rate = sum(self.driver_errors) / len(self.driver_errors)
+		if self.consecutive_error_count >= MAX_CONSECUTIVE_ERRORS or (len(self.driver_errors) == ERROR_WINDOW_SIZE and error_rate >= MAX_ERROR_RATE):
+			print("[AdCreatives] Recycling WebDriver ({:d} consecutive errors, error rate = {:0.0%})".format(self.consecutive_error_count, error_rate))
+			if not self._swap_webdriver(wait = True):
+				self._stop_webdriver()
+		elif self.driver_page_count < self.replacement_page_count:
+			return
+		elif self.driver_page_count >= self._get_driver_page_limit():
+			self._start_replacement_webdriver("{:,d} pages".format(self.driver_page_count))
+		elif self.driver_page_count % RSS_CHECK_PAGES == 0:
+			rss = self._get_browser_rss()
+			if rss is not None and rss >= MAX_BROWSER_RSS_BYTES:
+				self._start_replacement_webdriver("memory usage = {:,d} MB".format(rss // (1024 * 1024)))
+
 	def _timestamp(self):
 		return datetime.now().strftime("%-I:%M:%S %p @ %A, %B %-d, %Y")
 
-	def _get_remaining_ad_ids(self, ad_type = None):
+	# Add the ads of this Google Ad Library download to the crawl queue. This is done once per download and ad type,
+	# so restarts do not have to diff the ad library against the downloaded ads again.
+	def _seed_crawl_queue(self, ad_type):
+		crawl_seeds = self.db.crawl_seeds
+		s = select([crawl_seeds.c.key]).where(and_(crawl_seeds.c.library_timestamp == self.timestamp, crawl_seeds.c.ad_type == ad_type))
+		if self.conn.execute(s).fetchone() is not None:
+			return
+
 		if self.verbose:
 			print("[AdCreatives] {:s}".format(self._timestamp()))
-			print("[AdCreatives] Counting ads...")
+			print("[AdCreatives] Adding ads to the crawl queue (type = {:s})...".format(ad_type))
 
-		if ad_type is None:
-			s = select([self.library_db.creative_stats_table.c.ad_id]).distinct()
-		else:
-			s = select([self.library_db.creative_stats_table.c.ad_id]).where(self.library_db.creative_stats_table.c.ad_type == ad_type).distinct()
-		all_ad_ids = [row[0] for row in self.library_conn.execute(s)]
-		all_set = frozenset(all_ad_ids)
-
-		if ad_type is TEXT_AD_TYPE:
-			downloaded_ad_ids = [row[0] for row in self.conn.execute(select([self.db.text_ads.c.ad_id]).distinct())]
-		elif ad_type is IMAGE_AD_TYPE:
-			downloaded_ad_ids = [row[0] for row in self.conn.execute(select([self.db.image_ads.c.ad_id]).distinct())]
-		elif ad_type is VIDEO_AD_TYPE:
-			downloaded_ad_ids = [row[0] for row in self.conn.execute(select([self.db.video_ads.c.ad_id]).distinct())]
-		else:
-			downloaded_ad_ids = []
-		downloaded_set = frozenset(downloaded_ad_ids)
+		creative_stats = self.library_db.creative_stats_table
+		crawl_queue = self.db.crawl_queue
+		ad_table = self._get_ad_table(ad_type)
+		ad_count = 0
+		with self.conn.begin():
+			result = self.library_conn.execute(select([creative_stats.c.ad_id]).where(creative_stats.c.ad_type == ad_type).distinct())
+			while True:
+				rows = result.fetchmany(SEED_BATCH_SIZE)
+				if len(rows) == 0:
+					break
+				self.conn.execute(crawl_queue.insert().prefix_with("OR IGNORE"), [{"ad_id": row[0], "ad_type": ad_type} for row in rows])
+				ad_count += len(rows)
 
-		remaining_set = all_set.difference(downloaded_set)
-		remaining_ad_ids = [ad_id for ad_id in all_ad_ids if ad_id in remaining_set]
-#		remaining_ad_ids = ["CR369759575668162560"]
+			# Ads that were downloaded before they were added to the crawl queue
+			self.conn.execute(crawl_queue.update().where(and_(crawl_queue.c.state != CRAWL_DONE, crawl_queue.c.ad_id.in_(select([ad_table.c.ad_id])))).values(
+				state = CRAWL_DONE,
+				lease_owner = None,
+				lease_expiry = None,
+			))
+			self.conn.execute(crawl_seeds.insert(), {
+				"library_timestamp": self.timestamp,
+				"ad_type": ad_type,
+				"ad_count": ad_count,
+			})
 
 		if self.verbose:
-			print("[AdCreatives]      Total ads = {:9,d}".format(len(all_ad_ids)))
-			print("[AdCreatives] Downloaded ads = {:9,d}".format(len(downloaded_ad_ids)))
-			print("[AdCreatives]  Remaining ads = {:9,d}".format(len(remaining_ad_ids)))
+			print("[AdCreatives] Added {:,d} ads to the crawl queue".format(ad_count))
 			print()
 
-		return remaining_ad_ids
+	def _count_crawl_queue(self, ad_type):
+		crawl_queue = self.db.crawl_queue
+		s = select([crawl_queue.c.state, func.count()]).where(crawl_queue.c.ad_type == ad_type).group_by(crawl_queue.c.state)
+		state_counts = {state: count for (state, count) in self.conn.execute(s)}
+		for state in [CRAWL_PENDING, CRAWL_IN_PROGRESS, CRAWL_DONE]:
+			if state not in state_counts:
+				state_counts[state] = 0
 
-	def _get_ad_info(self, ad_id):
-		s = select([self.library_db.creative_stats_table]).where(self.library_db.creative_stats_table.c.ad_id == ad_id)
-		row = self.library_conn.execute(s).fetchone()
-		ad_info = AdInfo(
-			id = ad_id,
-			url = row[self.library_db.creative_stats_table.c.ad_url],
-			type = row[self.library_db.creative_stats_table.c.ad_type],
-		)
-		return ad_info
+		if self.verbose:
+			print("[AdCreatives] {:s}".format(self._timestamp()))
+			print("[AdCreatives]      Total ads = {:9,d}".format(sum(state_counts.values())))
+			print("[AdCreatives] Downloaded ads = {:9,d}".format(state_counts[CRAWL_DONE]))
+			print("[AdCreatives]    Claimed ads = {:9,d}".format(state_counts[CRAWL_IN_PROGRESS]))
+			print("[AdCreatives]  Remaining ads = {:9,d}".format(state_counts[CRAWL_PENDING]))
+			print()
+
+		return state_counts
+
+	# Claim up to count ads in one UPDATE statement, which SQLite runs atomically,
+	# so that other crawler processes sharing the creatives database never claim the same ads
+	def _claim_ad_ids(self, ad_type, count):
+		crawl_queue = self.db.crawl_queue
+		now = datetime.now()
+		lease_owner = "{:s}:{:d}:{:s}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+		claimable = select([crawl_queue.c.key]).where(and_(
+			crawl_queue.c.ad_type == ad_type,
+			crawl_queue.c.attempt_count < MAX_CRAWL_ATTEMPTS,
+			or_(
+				crawl_queue.c.state == CRAWL_PENDING,
+				and_(crawl_queue.c.state == CRAWL_IN_PROGRESS, crawl_queue.c.lease_expiry < now),
+			),
+		)).order_by(func.random() if self.shuffle else crawl_queue.c.key).limit(count)
+		self.conn.execute(crawl_queue.update().where(crawl_queue.c.key.in_(claimable)).values(
+			state = CRAWL_IN_PROGRESS,
+			lease_owner = lease_owner,
+			lease_expiry = now + CRAWL_LEASE_DURATION,
+			attempt_count = crawl_queue.c.attempt_count + 1,
+		))
+		s = select([crawl_queue.c.ad_id]).where(crawl_queue.c.lease_owner == lease_owner).order_by(crawl_queue.c.key)
+		ad_ids = [row[0] for row in self.conn.execute(s)]
+		if self.shuffle:
+			random.shuffle(ad_ids)
+		return ad_ids
+
+	# Look up the URL and type of a batch of ads in one query
+	def _get_ad_infos(self, ad_ids):
+		creative_stats = self.library_db.creative_stats_table
+		s = select([creative_stats.c.ad_id, creative_stats.c.ad_url, creative_stats.c.ad_type]).where(creative_stats.c.ad_id.in_(ad_ids))
+		ad_infos = {}
+		for row in self.library_conn.execute(s):
+			if row[0] not in ad_infos:
+				ad_infos[row[0]] = AdInfo(id = row[0], url = row[1], type = row[2])
+		return [ad_infos[ad_id] for ad_id in ad_ids if ad_id in ad_infos]
+
+	# Claim ads from the crawl queue one batch at a time, as they are consumed
+	def _iter_claimed_ad_infos(self, ad_type, limit):
+		claimed_count = 0
+		while claimed_count < limit:
+			ad_ids = self._claim_ad_ids(ad_type, min(CLAIM_BATCH_SIZE, limit - claimed_count))
+			if len(ad_ids) == 0:
+				break
+			claimed_count += len(ad_ids)
+			yield from self._get_ad_infos(ad_ids)
+
+	# One pooled HTTP session per process (sessions are not shared with forked worker processes)
+	def _get_http_session(self):
+		if self.http_session is None:
+			self.http_session = requests.Session()
+			self.http_session.headers["User-Agent"] = HTTP_USER_AGENT
+			adapter = HTTPAdapter(pool_connections = HTTP_POOL_SIZE, pool_maxsize = HTTP_POOL_SIZE, max_retries = HTTP_MAX_RETRIES)
+			self.http_session.mount("http://", adapter)
+			self.http_session.mount("https://", adapter)
+		return self.http_session
+
+	# Fast path: extract text ads, static image ads, and removed ads from the HTML served for the ad's page.
+	# Returns None if the creative is not in the served HTML (e.g. it is rendered by scripts, or it is in an iframe),
+	# in which case the ad is downloaded with the browser instead. Dimensions are only known when the HTML
+	# declares them, since the page is not laid out.
+	def _download_ad_via_http(self, ad_info):
+		if ad_info.type not in [TEXT_AD_TYPE, IMAGE_AD_TYPE]:
+			return None
+		try:
+			response = self._get_http_session().get(ad_info.url, timeout = HTTP_TIMEOUT_SECS)
+		except requests.exceptions.RequestException:
+			print("H X     Cannot fetch webpage over HTTP.")
+			return None
+		if response.status_code != 200:
+			print("H X     Cannot fetch webpage over HTTP (status = {:d}).".format(response.status_code))
+			return None
+
+		parser = CreativeHTMLParser()
+		try:
+			parser.feed(response.text)
+			parser.close()
+		except Exception:
+			print("H E     Unknown error when parsing the webpage.")
+			return None
+		if not parser.has_wrapper:
+			print("H X     Cannot locate creative wrapper in the served HTML.")
+			return None
 
+		row = {
+			"ad_id": ad_info.id,
+			"ad_url": ad_info.url,
+			"ad_html": None,
+			"ad_width": None,
+			"ad_height": None,
+			"is_url_accessed": True,
+			"is_ad_found": False,
+			"is_ad_removed": False,
+			"is_known_error": False,
+			"is_unknown_error": False,
+		}
+		if ad_info.type == TEXT_AD_TYPE:
+			row["ad_text"] = None
+		else:
+			row["image_url"] = None
+			row["in_iframe"] = False
+			row["in_img"] = False
+
+		if REMOVED_AD_CONTAINER_TAG_NAME in parser.elements:
+			print("H>      Located ad removal container element over HTTP.")
+			row["is_ad_removed"] = True
+		elif ad_info.type == TEXT_AD_TYPE and TEXT_AD_CONTAINER_TAG_NAME in parser.elements:
+			elem = parser.elements[TEXT_AD_CONTAINER_TAG_NAME]
+			print("H>      Located text ad container element over HTTP.")
+			row["is_ad_found"] = True
+			row["ad_html"] = elem.get_outer_html()
+			row["ad_width"] = elem.get_int_attribute("width")
+			row["ad_height"] = elem.get_int_attribute("height")
+			row["ad_text"] = elem.get_text()
+		elif ad_info.type == IMAGE_AD_TYPE and IMAGE_AD_IFRAME_TAG_NAME not in parser.elements and IMAGE_AD_ALT_IMG_TAG_NAME in parser.elements:
+			elem = parser.elements[IMAGE_AD_ALT_IMG_TAG_NAME]
+			print("H>      Located an IMG element over HTTP.")
+			row["is_ad_found"] = True
+			row["in_img"] = True
+			row["ad_html"] = elem.get_outer_html()
+			row["ad_width"] = elem.get_int_attribute("width")
+			row["ad_height"] = elem.get_int_attribute("height")
+			row["image_url"] = elem.attrs["src"] if "src" in elem.attrs else None
+		else:
+			print("H X     Cannot locate the creative in the served HTML.")
+			return None
+		return row
 
 	def _get_youtube_id_from_youtube_url(self, url):
 		m = YOUTUBE_ID_REGEX.match(url)
@@ -160,104 +640,239 @@ class GoogleAdCreativesDownloadHelper:
 		else:
 			return None
 
-	def _download_text_ad(self, ad_info, screenshot_success = False, screenshot_error = True):
-		ad_html = None
-		ad_width = None
-		ad_height = None
-		ad_text = None
-		is_url_accessed = False
-		is_ad_found = False
-		is_ad_removed = False
-		is_known_error = False
-		is_unknown_error = False
-		has_ad_screenshot = False
-		has_error_screenshot = False
+	# Wait once, until the creative wrapper contains one of the given elements, then describe all of them with a single
+	# script call. Returns a dict keyed by tag name, which is empty if the wrapper contains none of the elements,
+	# or None if the page has no creative wrapper.
+	def _get_creative_snapshot(self, tag_names):
+		def is_creative_rendered(driver):
+			snapshot = driver.execute_script(CREATIVE_SNAPSHOT_SCRIPT, CREATIVE_WRAPPER_CLASS_NAME, tag_names)
+			return snapshot if snapshot else False
+		try:
+			return WebDriverWait(self.driver, ELEMENT_TIMEOUT_SECS, poll_frequency = ELEMENT_POLL_SECS).until(is_creative_rendered)
+		except TimeoutException:
+			return self.driver.execute_script(CREATIVE_SNAPSHOT_SCRIPT, CREATIVE_WRAPPER_CLASS_NAME, tag_names)
+
+	# Only called for elements found in the snapshot, so no waiting is involved
+	def _find_creative_element(self, tag_name):
+		return self.driver.find_element_by_class_name(CREATIVE_WRAPPER_CLASS_NAME).find_element_by_tag_name(tag_name)
+
+	# Wait until the images and videos in the element have rendered, so that the screenshot is not blank
+	def _wait_for_render(self, elem):
+		try:
+			WebDriverWait(self.driver, RENDER_TIMEOUT_SECS, poll_frequency = ELEMENT_POLL_SECS).until(lambda driver: driver.execute_script(RENDER_COMPLETE_SCRIPT, elem))
+		except TimeoutException:
+			print(" .      Creative did not finish rendering within {:1.1f} seconds.".format(RENDER_TIMEOUT_SECS))
+			return False
+		return True
+
+	# The content of an iframe can only be inspected after switching to it
+	def _wait_for_iframe_render(self):
+		self.driver.switch_to.frame(0)
+		self._wait_for_render(self.driver.find_element_by_tag_name("body"))
+		self.driver.switch_to.default_content()
+
+	def _get_screenshot_store(self):
+		if self.screenshot_store is None:
+			self.screenshot_store = GoogleAdScreenshotStore(self.screenshot_folder, screenshot_format = self.screenshot_format, threads = self.screenshot_threads, verbose = self.verbose)
+			self.screenshot_store.start()
+		return self.screenshot_store
+
+	def _close_screenshot_store(self):
+		if self.screenshot_store is not None:
+			self.screenshot_store.close()
+			self.screenshot_store = None
+
+	# Screenshots are captured in memory and handed to the screenshot store, which encodes and writes them in the background.
+	# The ad_screenshots rows are written together with the row of the ad, once their files are stored; the writer (or the
+	# sender thread of a worker process) waits for screenshot_futures, so that the crawl loop does not.
+	def _save_screenshot(self, ad_info, kind, png):
+		(content_hash, file_format, future) = self._get_screenshot_store().save(png)
+		self._add_screenshot_row(ad_info, kind, content_hash, file_format)
+		self.screenshot_futures[content_hash] = future
+		return True
+
+	def _add_screenshot_row(self, ad_info, kind, content_hash, file_format):
+		screenshot_row = {
+			"ad_id": ad_info.id,
+			"kind": kind,
+			"content_hash": content_hash,
+			"file_format": file_format,
+		}
+		self.screenshot_rows.append(screenshot_row)
+		return screenshot_row
 
-		ad_screenshot_path = os.path.abspath(os.path.join(self.screenshot_text_ads_folder, "{:s}.png".format(ad_info.id)))
-		error_screenshot_path = os.path.abspath(os.path.join(self.screenshot_errors_folder, "{:s}.png".format(ad_info.id)))
+	def _normalize_html(self, ad_html):
+		return HTML_WHITESPACE_REGEX.sub(" ", HTML_SPACE_BETWEEN_TAGS_REGEX.sub("><", ad_html)).strip()
 
+	def _normalize_url(self, url):
+		parts = urlsplit(url.strip())
+		return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+
+	# A creative is identified by its YouTube id or media url if it has one, or else by its normalized HTML
+	def _get_creative_asset(self, ad_type, ad_html = None, image_url = None, youtube_id = None, video_url = None):
+		if youtube_id:
+			(asset_kind, media_url) = (ASSET_YOUTUBE_ID, youtube_id)
+		elif video_url:
+			(asset_kind, media_url) = (ASSET_VIDEO_URL, self._normalize_url(video_url))
+		elif image_url:
+			(asset_kind, media_url) = (ASSET_IMAGE_URL, self._normalize_url(image_url))
+		elif ad_html:
+			(asset_kind, media_url) = (ASSET_HTML, None)
+		else:
+			return None
+		value = media_url if media_url is not None else self._normalize_html(ad_html)
+		return {
+			"asset_hash": hashlib.sha256("{:s}:{:s}:{:s}".format(ad_type, asset_kind, value).encode("utf-8")).hexdigest(),
+			"ad_type": ad_type,
+			"asset_kind": asset_kind,
+			"media_url": media_url,
+			"ad_html": None,
+			"screenshot_hash": None,
+			"screenshot_format": None,
+		}
+
+	# Worker processes have no database session, and only read assets (the parent process writes them)
+	def _get_asset_lookup(self):
+		if self.asset_lookup is None:
+			if self.conn is not None:
+				self.asset_lookup = (self.conn, self.db)
+			else:
+				path = os.path.join(Constants.DOWNLOADS_PATH, Constants.GOOGLE_DOWNLOADS_FOLDER, Constants.GOOGLE_AD_CREATIVES_DB_FILENAME)
+				url = "sqlite:///file:{}?mode=ro&uri=true".format(os.path.abspath(path))
+				engine = sqlalchemy.create_engine(url, echo = self.echo)
+				self.asset_lookup = (engine.connect(), GoogleAdCreativesDB(engine))
+		return self.asset_lookup
+
+	# Returns (content_hash, file_format, future) of the screenshot of a creative asset that has been seen before, or None.
+	# The future is None once the screenshot is known to be stored; a screenshot that failed to be stored is forgotten.
+	def _get_asset_screenshot(self, asset):
+		if asset is None:
+			return None
+		asset_hash = asset["asset_hash"]
+		if asset_hash in self.asset_screenshots:
+			future = self.asset_screenshots[asset_hash][2]
+			if future is not None and future.done() and future.exception() is not None:
+				del self.asset_screenshots[asset_hash]
+		if asset_hash not in self.asset_screenshots:
+			(conn, db) = self._get_asset_lookup()
+			creative_assets = db.creative_assets
+			result = conn.execute(select([creative_assets.c.screenshot_hash, creative_assets.c.screenshot_format]).where(and_(
+				creative_assets.c.asset_hash == asset_hash,
+				creative_assets.c.screenshot_hash != None,
+			))).first()
+			if result is None:
+				return None
+			self.asset_screenshots[asset_hash] = (result[0], result[1], None)
+		return self.asset_screenshots[asset_hash]
+
+	# Skip the screenshot of a creative that has been seen before, and refer to its earlier screenshot instead
+	def _reuse_asset_screenshot(self, ad_info, asset):
+		asset_screenshot = self._get_asset_screenshot(asset)
+		if asset_screenshot is None:
+			return False
+		(content_hash, file_format, future) = asset_screenshot
+		self._add_screenshot_row(ad_info, SCREENSHOT_AD, content_hash, file_format)
+		if future is not None:
+			self.screenshot_futures[content_hash] = future
+		print(" .      Reused the screenshot of a known creative.")
+		return True
+
+	# Record the creative asset of a downloaded ad, along with its screenshot. The ad keeps its own HTML in the table of
+	# its ad type; an asset identified by its HTML also stores the HTML of the first ad seen with it.
+	def _get_asset_row(self, ad_info, row):
+		if row is None or not row["is_ad_found"]:
+			return None
+		asset_row = self._get_creative_asset(ad_info.type,
+			ad_html = row["ad_html"],
+			image_url = row["image_url"] if "image_url" in row else None,
+			youtube_id = row["youtube_id"] if "youtube_id" in row else None,
+			video_url = row["video_url"] if "video_url" in row else None,
+		)
+		if asset_row is None:
+			return None
+		if asset_row["asset_kind"] == ASSET_HTML:
+			asset_row["ad_html"] = row["ad_html"]
+		for screenshot_row in self.screenshot_rows:
+			if screenshot_row["kind"] == SCREENSHOT_AD:
+				asset_row["screenshot_hash"] = screenshot_row["content_hash"]
+				asset_row["screenshot_format"] = screenshot_row["file_format"]
+				future = self.screenshot_futures[screenshot_row["content_hash"]] if screenshot_row["content_hash"] in self.screenshot_futures else None
+				self.asset_screenshots[asset_row["asset_hash"]] = (screenshot_row["content_hash"], screenshot_row["file_format"], future)
+		return asset_row
+
+	def _take_ad_screenshot(self, ad_info, elem):
+		return self._save_screenshot(ad_info, SCREENSHOT_AD, elem.screenshot_as_png)
+
+	def _take_error_screenshot(self, ad_info):
+		self._save_screenshot(ad_info, SCREENSHOT_ERROR, self.driver.get_screenshot_as_png())
+		print("        Took a screenshot of the webpage.")
+		return True
+
+	def _open_webpage(self, ad_info):
 		self.driver.set_page_load_timeout(PAGE_TIMEOUT_SECS)
 		try:
 			self.driver.get(ad_info.url)
 		except TimeoutException:
 			print("X       Cannot open webpage, after waiting up to {:1.1f} seconds.".format(PAGE_TIMEOUT_SECS))
-			is_known_error = True
+			return (False, True, False)
 		except:
 			print("E       Unknown error when opening webpage.")
-			is_unknown_error = True
+			return (False, False, True)
 		else:
 			print(">       Opened webpage.")
-			is_url_accessed = True
+			return (True, False, False)
 
+	def _download_text_ad(self, ad_info, screenshot_success = False, screenshot_error = True):
+		ad_html = None
+		ad_width = None
+		ad_height = None
+		ad_text = None
+		is_ad_found = False
+		is_ad_removed = False
+		has_ad_screenshot = False
+		has_error_screenshot = False
+
+		(is_url_accessed, is_known_error, is_unknown_error) = self._open_webpage(ad_info)
+		if is_url_accessed:
 			try:
-				wrapper_elem = self.driver.find_element_by_class_name(CREATIVE_WRAPPER_CLASS_NAME)
-			except NoSuchElementException:
-				print("-X      Cannot locate creative wrapper.")
-				is_known_error = True
-				if screenshot_error:
-					self.driver.get_screenshot_as_file(error_screenshot_path)
-					print(" .      Took a screenshot of the webpage.")
-					has_error_screenshot = True
+				snapshot = self._get_creative_snapshot([TEXT_AD_CONTAINER_TAG_NAME, REMOVED_AD_CONTAINER_TAG_NAME])
 			except:
-				print("-E      Unknown error when locating creative wrapper.")
+				print("-E      Unknown error when reading the creative wrapper.")
 				is_unknown_error = True
 				if screenshot_error:
-					self.driver.get_screenshot_as_file(error_screenshot_path)
-					print(" .      Took a screenshot of the webpage.")
-					has_error_screenshot = True
+					has_error_screenshot = self._take_error_screenshot(ad_info)
 			else:
-				print("->      Located creative wrapper.")
-
-				try:
-					ad_elem = wrapper_elem.find_element_by_tag_name(TEXT_AD_CONTAINER_TAG_NAME)
-				except NoSuchElementException:
-					print("--X     Cannot locate text ad container element.")
-
-					try:
-						removed_elem = wrapper_elem.find_element_by_tag_name(REMOVED_AD_CONTAINER_TAG_NAME)
-					except NoSuchElementException:
-						print("---X     Cannot locate ad removal container element.")
-						is_known_error = True
-						if screenshot_error:
-							self.driver.get_screenshot_as_file(error_screenshot_path)
-							print("   .    Took a screenshot of the error.")
-							has_error_screenshot = True
-					except:
-						print("---E     Unknown error when locating ad removal container element.")
-						is_unknown_error = True
-						if screenshot_error:
-							self.driver.get_screenshot_as_file(error_screenshot_path)
-							print("   .    Took a screenshot of the error.")
-							has_error_screenshot = True
-					else:
-						print("--->    Located ad removal container element.")
-						is_ad_removed = True
-						if screenshot_error:
-							self.driver.get_screenshot_as_file(error_screenshot_path)
-							print("   .    Took a screenshot of the error.")
-							has_error_screenshot = True
-
-				except:
-					print("--E     Unknown error when locating text ad container element.")
-					is_unknown_error = True
+				if snapshot is None:
+					print("-X      Cannot locate creative wrapper.")
+					is_known_error = True
 					if screenshot_error:
-						self.driver.get_screenshot_as_file(error_screenshot_path)
-						print("  .     Took a screenshot of the error.")
-						has_error_screenshot = True
-				else:
-					print("-->     Located text ad container element.")
+						has_error_screenshot = self._take_error_screenshot(ad_info)
+				elif TEXT_AD_CONTAINER_TAG_NAME in snapshot:
+					print("->      Located text ad container element.")
+					elem = snapshot[TEXT_AD_CONTAINER_TAG_NAME]
 					is_ad_found = True
-					ad_html = ad_elem.get_attribute("outerHTML")
-					ad_width = ad_elem.get_attribute("offsetWidth")
-					ad_height = ad_elem.get_attribute("offsetHeight")
-					ad_text = ad_elem.text
-					print("  .     Extracted outer html, dimensions, and text of the text ad.")
+					ad_html = elem["outer_html"]
+					ad_width = elem["width"]
+					ad_height = elem["height"]
+					ad_text = elem["text"]
+					print(" .      Extracted outer html, dimensions, and text of the text ad.")
 					if screenshot_success:
-						has_ad_screenshot = True
-						ad_elem.screenshot(ad_screenshot_path)
-						print("  .     Took a screenshot of the text ad.")
+						has_ad_screenshot = self._reuse_asset_screenshot(ad_info, self._get_creative_asset(ad_info.type, ad_html = ad_html))
+						if not has_ad_screenshot:
+							has_ad_screenshot = self._take_ad_screenshot(ad_info, self._find_creative_element(TEXT_AD_CONTAINER_TAG_NAME))
+							print(" .      Took a screenshot of the text ad.")
+				elif REMOVED_AD_CONTAINER_TAG_NAME in snapshot:
+					print("->      Located ad removal container element.")
+					is_ad_removed = True
+					if screenshot_error:
+						has_error_screenshot = self._take_error_screenshot(ad_info)
+				else:
+					print("-X      Cannot locate text ad container or ad removal container element.")
+					is_known_error = True
+					if screenshot_error:
+						has_error_screenshot = self._take_error_screenshot(ad_info)
 
-		self.conn.execute(self.db.text_ads.insert(), {
+		row = {
 			"ad_id": ad_info.id,
 			"ad_url": ad_info.url,
 			"ad_html": ad_html,
@@ -269,9 +884,9 @@ class GoogleAdCreativesDownloadHelper:
 			"is_ad_removed": is_ad_removed,
 			"is_known_error": is_known_error,
 			"is_unknown_error": is_unknown_error,
-		})
+		}
 		print()
-		return is_unknown_error
+		return (row, is_unknown_error)
 
 	def _download_image_ad(self, ad_info, screenshot_success = False, screenshot_error = True):
 		ad_html = None
@@ -280,132 +895,77 @@ class GoogleAdCreativesDownloadHelper:
 		image_url = None
 		in_iframe = False
 		in_img = False
-		is_url_accessed = False
 		is_ad_found = False
 		is_ad_removed = False
-		is_known_error = False
-		is_unknown_error = False
 		has_ad_screenshot = False
 		has_error_screenshot = False
 
-		ad_screenshot_path = os.path.abspath(os.path.join(self.screenshot_image_ads_folder, "{:s}.png".format(ad_info.id)))
-		error_screenshot_path = os.path.abspath(os.path.join(self.screenshot_errors_folder, "{:s}.png".format(ad_info.id)))
-
-		self.driver.set_page_load_timeout(PAGE_TIMEOUT_SECS)
-		try:
-			self.driver.get(ad_info.url)
-		except TimeoutException:
-			print("X       Cannot open webpage, after waiting up to {:1.1f} seconds.".format(PAGE_TIMEOUT_SECS))
-			is_known_error = True
-		except:
-			print("E       Unknown error when opening webpage.")
-			is_unknown_error = True
-		else:
-			print(">       Opened webpage.")
-			is_url_accessed = True
-
+		(is_url_accessed, is_known_error, is_unknown_error) = self._open_webpage(ad_info)
+		if is_url_accessed:
 			try:
-				wrapper_elem = self.driver.find_element_by_class_name(CREATIVE_WRAPPER_CLASS_NAME)
-			except NoSuchElementException:
-				print("-X      Cannot locate creative wrapper.")
-				is_known_error = True
-				if screenshot_error:
-					self.driver.get_screenshot_as_file(error_screenshot_path)
-					print(" .      Took a screenshot of the webpage.")
-					has_error_screenshot = True
+				snapshot = self._get_creative_snapshot([IMAGE_AD_IFRAME_TAG_NAME, IMAGE_AD_ALT_IMG_TAG_NAME, REMOVED_AD_CONTAINER_TAG_NAME])
 			except:
-				print("-E      Unknown error when locating creative wrapper.")
+				print("-E      Unknown error when reading the creative wrapper.")
 				is_unknown_error = True
 				if screenshot_error:
-					self.driver.get_screenshot_as_file(error_screenshot_path)
-					print(" .      Took a screenshot of the webpage.")
-					has_error_screenshot = True
+					has_error_screenshot = self._take_error_screenshot(ad_info)
 			else:
-				print("->      Located creative wrapper.")
-
-				try:
-					iframe_elem = wrapper_elem.find_element_by_tag_name(IMAGE_AD_IFRAME_TAG_NAME)
-				except NoSuchElementException:
-					print("--X     Cannot locate iframe containing the image ad.")
-
-					try:
-						img_elem = wrapper_elem.find_element_by_tag_name(IMAGE_AD_ALT_IMG_TAG_NAME)
-					except NoSuchElementException:
-						print("---X    Cannot locate an alternative IMG element.")
-
-						try:
-							removed_elem = wrapper_elem.find_element_by_tag_name(REMOVED_AD_CONTAINER_TAG_NAME)
-						except NoSuchElementException:
-							print("----X   Cannot locate ad removal container element.")
-							is_known_error = True
-							if screenshot_error:
-								self.driver.get_screenshot_as_file(error_screenshot_path)
-								print("    .   Took a screenshot of the error.")
-								has_error_screenshot = True
-						except:
-							print("----E   Unknown error when locating ad removal container element.")
-							is_unknown_error = True
-							if screenshot_error:
-								self.driver.get_screenshot_as_file(error_screenshot_path)
-								print("    .   Took a screenshot of the error.")
-								has_error_screenshot = True
-						else:
-							print("---->   Located ad removal container element.")
-							is_ad_removed = True
-							if screenshot_error:
-								self.driver.get_screenshot_as_file(error_screenshot_path)
-								print("    .   Took a screenshot of the error.")
-								has_error_screenshot = True
-
-					except:
-						print("---E    Unknown error when locating an alternative IMG element.")
-						is_unknown_error = True
-						if screenshot_error:
-							self.driver.get_screenshot_as_file(error_screenshot_path)
-							print("   .    Took a screenshot of the error.")
-							has_error_screenshot = True
-					else:
-						print("--->    Located an alternative IMG element.")
-						is_ad_found = True
-						in_img = True
-						ad_html = img_elem.get_attribute("outerHTML")
-						ad_width = img_elem.get_attribute("offsetWidth")
-						ad_height = img_elem.get_attribute("offsetHeight")
-						image_url = img_elem.get_attribute("src")
-						print("   .    Extracted outer html, dimensions, and image url from the image ad.")
-						if screenshot_success:
-							time.sleep(IMAGE_AD_SCREENSHOT_DELAY_SECS)
-							img_elem.screenshot(ad_screenshot_path)
-							print("   .    Took a screenshot of the image ad.")
-							has_ad_screenshot = True
-
-				except:
-					print("--E     Unknown error when locating iframe containing the image ad.")
-					is_unknown_error = True
+				if snapshot is None:
+					print("-X      Cannot locate creative wrapper.")
+					is_known_error = True
 					if screenshot_error:
-						self.driver.get_screenshot_as_file(error_screenshot_path)
-						print("  .     Took a screenshot of the error.")
-						has_error_screenshot = True
-				else:
-					print("-->     Located iframe containing the image ad.")
+						has_error_screenshot = self._take_error_screenshot(ad_info)
+				elif IMAGE_AD_IFRAME_TAG_NAME in snapshot:
+					print("->      Located iframe containing the image ad.")
+					elem = snapshot[IMAGE_AD_IFRAME_TAG_NAME]
 					is_ad_found = True
 					in_iframe = True
-					ad_width = iframe_elem.get_attribute("offsetWidth")
-					ad_height = iframe_elem.get_attribute("offsetHeight")
-					print("  .     Extracted dimensions from the image ad.")
-					if screenshot_success:
-						time.sleep(IMAGE_AD_SCREENSHOT_DELAY_SECS)
-						iframe_elem.screenshot(ad_screenshot_path)
-						print("  .     Took a screenshot of the image ad.")
-						has_ad_screenshot = True
+					ad_width = elem["width"]
+					ad_height = elem["height"]
+					print(" .      Extracted dimensions from the image ad.")
 
+					# The iframe is usually served from another origin, so its content is read through WebDriver
 					self.driver.switch_to.frame(0)
-					print("--->    Switched to iframe containing the image ad.")
+					print("-->     Switched to iframe containing the image ad.")
 					body_elem = self.driver.find_element_by_tag_name("body")
 					ad_html = body_elem.get_attribute("outerHTML")
-					print("   .    Extracted outer html from the image ad.")
+					print("  .     Extracted outer html from the image ad.")
+					if screenshot_success:
+						has_ad_screenshot = self._reuse_asset_screenshot(ad_info, self._get_creative_asset(ad_info.type, ad_html = ad_html))
+						if not has_ad_screenshot:
+							self._wait_for_render(body_elem)
+							self.driver.switch_to.default_content()
+							has_ad_screenshot = self._take_ad_screenshot(ad_info, self._find_creative_element(IMAGE_AD_IFRAME_TAG_NAME))
+							print(" .      Took a screenshot of the image ad.")
+				elif IMAGE_AD_ALT_IMG_TAG_NAME in snapshot:
+					print("->      Located an alternative IMG element.")
+					elem = snapshot[IMAGE_AD_ALT_IMG_TAG_NAME]
+					is_ad_found = True
+					in_img = True
+					ad_html = elem["outer_html"]
+					ad_width = elem["width"]
+					ad_height = elem["height"]
+					image_url = elem["src"]
+					print(" .      Extracted outer html, dimensions, and image url from the image ad.")
+					if screenshot_success:
+						has_ad_screenshot = self._reuse_asset_screenshot(ad_info, self._get_creative_asset(ad_info.type, ad_html = ad_html, image_url = image_url))
+						if not has_ad_screenshot:
+							img_elem = self._find_creative_element(IMAGE_AD_ALT_IMG_TAG_NAME)
+							self._wait_for_render(img_elem)
+							has_ad_screenshot = self._take_ad_screenshot(ad_info, img_elem)
+							print(" .      Took a screenshot of the image ad.")
+				elif REMOVED_AD_CONTAINER_TAG_NAME in snapshot:
+					print("->      Located ad removal container element.")
+					is_ad_removed = True
+					if screenshot_error:
+						has_error_screenshot = self._take_error_screenshot(ad_info)
+				else:
+					print("-X      Cannot locate iframe, IMG, or ad removal container element.")
+					is_known_error = True
+					if screenshot_error:
+						has_error_screenshot = self._take_error_screenshot(ad_info)
 
-		self.conn.execute(self.db.image_ads.insert(), {
+		row = {
 			"ad_id": ad_info.id,
 			"ad_url": ad_info.url,
 			"ad_html": ad_html,
@@ -419,9 +979,9 @@ class GoogleAdCreativesDownloadHelper:
 			"is_ad_removed": is_ad_removed,
 			"is_known_error": is_known_error,
 			"is_unknown_error": is_unknown_error,
-		})
+		}
 		print()
-		return is_unknown_error
+		return (row, is_unknown_error)
 
 	def _download_vidoe_ad(self, ad_info, screenshot_success = False, screenshot_error = True):
 		ad_html = None
@@ -432,152 +992,92 @@ class GoogleAdCreativesDownloadHelper:
 		video_url = None
 		in_iframe = False
 		in_video = False
-		is_url_accessed = False
 		is_ad_found = False
 		is_ad_removed = False
-		is_known_error = False
-		is_unknown_error = False
 		has_ad_screenshot = False
 		has_error_screenshot = False
 
-		ad_screenshot_path = os.path.abspath(os.path.join(self.screenshot_video_ads_folder, "{:s}.png".format(ad_info.id)))
-		error_screenshot_path = os.path.abspath(os.path.join(self.screenshot_errors_folder, "{:s}.png".format(ad_info.id)))
-
-		self.driver.set_page_load_timeout(PAGE_TIMEOUT_SECS)
-		try:
-			self.driver.get(ad_info.url)
-		except TimeoutException:
-			print("X       Cannot open webpage, after waiting up to {:1.1f} seconds.".format(PAGE_TIMEOUT_SECS))
-			is_known_error = True
-		except:
-			print("E       Unknown error when opening webpage.")
-			is_unknown_error = True
-		else:
-			print(">       Opened webpage.")
-			is_url_accessed = True
-
+		(is_url_accessed, is_known_error, is_unknown_error) = self._open_webpage(ad_info)
+		if is_url_accessed:
 			try:
-				wrapper_elem = self.driver.find_element_by_class_name(CREATIVE_WRAPPER_CLASS_NAME)
-			except NoSuchElementException:
-				print("-X      Cannot locate creative wrapper.")
-				is_known_error = True
-				if screenshot_error:
-					self.driver.get_screenshot_as_file(error_screenshot_path)
-					print(" .      Took a screenshot of the webpage.")
-					has_error_screenshot = True
+				snapshot = self._get_creative_snapshot([VIDEO_AD_IFRAME_TAG_NAME, VIDEO_AD_ALT_VIDEO_TAG_NAME, REMOVED_AD_CONTAINER_TAG_NAME])
 			except:
-				print("-E      Unknown error when locating creative wrapper.")
+				print("-E      Unknown error when reading the creative wrapper.")
 				is_unknown_error = True
 				if screenshot_error:
-					self.driver.get_screenshot_as_file(error_screenshot_path)
-					print(" .      Took a screenshot of the webpage.")
-					has_error_screenshot = True
+					has_error_screenshot = self._take_error_screenshot(ad_info)
 			else:
-				print("->      Located creative wrapper.")
-
-				try:
-					iframe_elem = wrapper_elem.find_element_by_tag_name(VIDEO_AD_IFRAME_TAG_NAME)
-				except NoSuchElementException:
-					print("--X     Cannot locate iframe containing the video ad.")
-
-					try:
-						video_elem = wrapper_elem.find_element_by_tag_name(VIDEO_AD_ALT_VIDEO_TAG_NAME)
-					except NoSuchElementException:
-						print("---X    Cannot locate an alternative VIDEO element.")
+				if snapshot is None:
+					print("-X      Cannot locate creative wrapper.")
+					is_known_error = True
+					if screenshot_error:
+						has_error_screenshot = self._take_error_screenshot(ad_info)
+				elif VIDEO_AD_IFRAME_TAG_NAME in snapshot:
+					print("->      Located iframe containing the video ad.")
+					elem = snapshot[VIDEO_AD_IFRAME_TAG_NAME]
+					is_ad_found = True
+					in_iframe = True
+					ad_width = elem["width"]
+					ad_height = elem["height"]
+					print(" .      Extracted dimensions from the video ad.")
+					youtube_url = elem["src"]
+					youtube_id = self._get_youtube_id_from_youtube_url(youtube_url) if youtube_url is not None else None
+					print(" .      Extracted YouTube url and YouTube id from the video ad.")
+					if screenshot_success:
+						has_ad_screenshot = self._reuse_asset_screenshot(ad_info, self._get_creative_asset(ad_info.type, youtube_id = youtube_id))
+						if not has_ad_screenshot:
+							self._wait_for_iframe_render()
+							has_ad_screenshot = self._take_ad_screenshot(ad_info, self._find_creative_element(VIDEO_AD_IFRAME_TAG_NAME))
+							print(" .      Took a screenshot of the video ad.")
 
+					if not youtube_url or not youtube_id:
+						self.driver.switch_to.frame(0)
+						print("-->     Switched to iframe containing the non-YouTube video ad.")
+						body_elem = self.driver.find_element_by_tag_name("body")
+						ad_html = body_elem.get_attribute("outerHTML")
+						print("  .     Extracted outer html from the non-YouTube video ad.")
+				elif VIDEO_AD_ALT_VIDEO_TAG_NAME in snapshot:
+					print("->      Located an alternative VIDEO element.")
+					elem = snapshot[VIDEO_AD_ALT_VIDEO_TAG_NAME]
+					is_ad_found = True
+					in_video = True
+					ad_html = elem["outer_html"]
+					ad_width = elem["width"]
+					ad_height = elem["height"]
+					video_url = elem["src"]
+					print(" .      Extracted outer html, dimensions, and video url from the video ad.")
+					if screenshot_success and self._reuse_asset_screenshot(ad_info, self._get_creative_asset(ad_info.type, ad_html = ad_html, video_url = video_url)):
+						has_ad_screenshot = True
+					elif screenshot_success:
 						try:
-							removed_elem = wrapper_elem.find_element_by_tag_name(REMOVED_AD_CONTAINER_TAG_NAME)
-						except NoSuchElementException:
-							print("----X   Cannot locate ad removal container element.")
+							video_elem = self._find_creative_element(VIDEO_AD_ALT_VIDEO_TAG_NAME)
+							self._wait_for_render(video_elem)
+							self._take_ad_screenshot(ad_info, video_elem)
+						except WebDriverException:
+							print(" X      Failed to take a screenshot of the video ad.")
 							is_known_error = True
 							if screenshot_error:
-								self.driver.get_screenshot_as_file(error_screenshot_path)
-								print("    .   Took a screenshot of the error.")
-								has_error_screenshot = True
+								has_error_screenshot = self._take_error_screenshot(ad_info)
 						except:
-							print("----E   Unknown error when locating ad removal container element.")
+							print(" E      Unknown error when taking a screenshot of the video ad.")
 							is_unknown_error = True
 							if screenshot_error:
-								self.driver.get_screenshot_as_file(error_screenshot_path)
-								print("    .   Took a screenshot of the error.")
-								has_error_screenshot = True
+								has_error_screenshot = self._take_error_screenshot(ad_info)
 						else:
-							print("---->   Located ad removal container element.")
-							is_ad_removed = True
-							if screenshot_error:
-								self.driver.get_screenshot_as_file(error_screenshot_path)
-								print("    .   Took a screenshot of the error.")
-								has_error_screenshot = True
-
-					except:
-						print("---E    Unknown error when locating an alternative VIDEO element.")
-						is_unknown_error = True
-						if screenshot_error:
-							self.driver.get_screenshot_as_file(error_screenshot_path)
-							print("   .    Took a screenshot of the error.")
-							has_error_screenshot = True
-					else:
-						print("--->    Located an alternative VIDEO element.")
-						is_ad_found = True
-						in_video = True
-						ad_html = video_elem.get_attribute("outerHTML")
-						ad_width = video_elem.get_attribute("offsetWidth")
-						ad_height = video_elem.get_attribute("offsetHeight")
-						video_url = video_elem.get_attribute("src")
-						print("   .    Extracted outer html, dimensions, and video url from the video ad.")
-						if screenshot_success:
-							time.sleep(VIDEO_AD_SCREENSHOT_DELAY_SECS)
-							try:
-								video_elem.screenshot(ad_screenshot_path)
-							except WebDriverException:
-								print("   X    Failed to take a screenshot of the video ad.")
-								is_known_error = True
-								if screenshot_error:
-									self.driver.get_screenshot_as_file(error_screenshot_path)
-									print("   .    Took a screenshot of the error.")
-									has_error_screenshot = True
-							except:
-								print("   E    Unknown error when taking a screenshot of the video ad.")
-								is_unknown_error = True
-								if screenshot_error:
-									self.driver.get_screenshot_as_file(error_screenshot_path)
-									print("   .    Took a screenshot of the error.")
-									has_error_screenshot = True
-							else:
-								print("   .    Took a screenshot of the video ad.")
-								has_ad_screenshot = True
-
-				except:
-					print("--E     Unknown error when locating iframe containing the video ad.")
-					is_unknown_error = True
+							print(" .      Took a screenshot of the video ad.")
+							has_ad_screenshot = True
+				elif REMOVED_AD_CONTAINER_TAG_NAME in snapshot:
+					print("->      Located ad removal container element.")
+					is_ad_removed = True
 					if screenshot_error:
-						self.driver.get_screenshot_as_file(error_screenshot_path)
-						print("  .     Took a screenshot of the error.")
-						has_error_screenshot = True
+						has_error_screenshot = self._take_error_screenshot(ad_info)
 				else:
-					print("-->     Located iframe containing the video ad.")
-					is_ad_found = True
-					in_iframe = True
-					ad_width = iframe_elem.get_attribute("offsetWidth")
-					ad_height = iframe_elem.get_attribute("offsetHeight")
-					print("  .     Extracted dimensions from the video ad.")
-					if screenshot_success:
-						time.sleep(VIDEO_AD_SCREENSHOT_DELAY_SECS)
-						iframe_elem.screenshot(ad_screenshot_path)
-						print("  .     Took a screenshot of the video ad.")
-						has_ad_screenshot = True
-					youtube_url = iframe_elem.get_attribute("src")
-					youtube_id = self._get_youtube_id_from_youtube_url(youtube_url)
-					print("  .     Extracted YouTube url and YouTube id from the video ad.")
-
-					if len(youtube_url) == 0 or len(youtube_id) == 0:
-						self.driver.switch_to.frame(0)
-						print("---->   Switched to iframe containing the non-YouTube video ad.")
-						body_elem = self.driver.find_element_by_tag_name("body")
-						ad_html = body_elem.get_attribute("outerHTML")
-						print("    .   Extracted outer html from the non-YouTube video ad.")
+					print("-X      Cannot locate iframe, VIDEO, or ad removal container element.")
+					is_known_error = True
+					if screenshot_error:
+						has_error_screenshot = self._take_error_screenshot(ad_info)
 
-		self.conn.execute(self.db.video_ads.insert(), {
+		row = {
 			"ad_id": ad_info.id,
 			"ad_url": ad_info.url,
 			"ad_html": ad_html,
@@ -593,65 +1093,186 @@ class GoogleAdCreativesDownloadHelper:
 			"is_ad_removed": is_ad_removed,
 			"is_known_error": is_known_error,
 			"is_unknown_error": is_unknown_error,
-		})
+		}
 		print()
-		return is_unknown_error
+		return (row, is_unknown_error)
 
+	# There is no table for ads of other types, so unknown ads are skipped without a row
 	def _download_unknown_ad(self, ad_info, screenshot_success = False, screenshot_error = True):
 		print("Encountered unknown ad type: {:s}".format(ad_info.type))
-		self.conn.execute(self.db.ad_content.insert(), {
-			"ad_id": ad_info.id,
-			"ad_url": ad_info.url,
-			"ad_type": ad_info.type,
-			"is_skipped": True,
-			"is_url_accessed": False,
-			"is_ad_found": False,
-		})
 		print()
-		return False
-
-	def _download_ad_creative(self, index, total_count, ad_id, screenshot_success = False, screenshot_error = True):
-		ad_info = self._get_ad_info(ad_id)
+		return (None, False)
 
+	# Returns (row, is_unknown_error); the row is written to the creatives database by the caller
+	def _download_ad_creative(self, index, total_count, ad_info, screenshot_success = False, screenshot_error = True):
 		print("[AdCreatives] {:s}".format(self._timestamp()))
 		print("[AdCreatives] Downloading remaining ad #{:,d} of {:,d}: {:s}...".format(index, total_count, ad_info.url))
-		if ad_info.type == TEXT_AD_TYPE:
-			is_unknown_error = self._download_text_ad(ad_info, screenshot_success = screenshot_success, screenshot_error = screenshot_error)
-		elif ad_info.type == IMAGE_AD_TYPE:
-			is_unknown_error = self._download_image_ad(ad_info, screenshot_success = screenshot_success, screenshot_error = screenshot_error)
-		elif ad_info.type == VIDEO_AD_TYPE:
-			is_unknown_error = self._download_vidoe_ad(ad_info, screenshot_success = screenshot_success, screenshot_error = screenshot_error)
+		self.screenshot_rows = []
+		self.screenshot_futures = {}
+		self.asset_row = None
+
+		# Screenshots need a browser; otherwise, try to extract the creative without rendering the page first
+		if self.http_first and not screenshot_success:
+			row = self._download_ad_via_http(ad_info)
+			if row is not None:
+				print()
+				self.asset_row = self._get_asset_row(ad_info, row)
+				return (row, False)
+
+		if ad_info.type not in [TEXT_AD_TYPE, IMAGE_AD_TYPE, VIDEO_AD_TYPE]:
+			return self._download_unknown_ad(ad_info, screenshot_success = screenshot_success, screenshot_error = screenshot_error)
+
+		# The browser is started when the first ad needs it, and after each restart
+		self._swap_webdriver()
+		self._start_webdriver(screenshot = screenshot_success)
+		is_unknown_error = True
+		try:
+			if ad_info.type == TEXT_AD_TYPE:
+				(row, is_unknown_error) = self._download_text_ad(ad_info, screenshot_success = screenshot_success, screenshot_error = screenshot_error)
+			elif ad_info.type == IMAGE_AD_TYPE:
+				(row, is_unknown_error) = self._download_image_ad(ad_info, screenshot_success = screenshot_success, screenshot_error = screenshot_error)
+			else:
+				(row, is_unknown_error) = self._download_vidoe_ad(ad_info, screenshot_success = screenshot_success, screenshot_error = screenshot_error)
+		finally:
+			self._update_webdriver_health(is_unknown_error)
+		self.asset_row = self._get_asset_row(ad_info, row)
+		return (row, is_unknown_error)
+
+	def _get_ad_table(self, ad_type):
+		if ad_type == TEXT_AD_TYPE:
+			return self.db.text_ads
+		elif ad_type == IMAGE_AD_TYPE:
+			return self.db.image_ads
+		elif ad_type == VIDEO_AD_TYPE:
+			return self.db.video_ads
 		else:
-			is_unknown_error = self._download_unknown_ad(ad_info, screenshot_success = screenshot_success, screenshot_error = screenshot_error)
-		return is_unknown_error
+			return None
 
-	def download_ad_creatives(self, ad_type, limit, screenshot):
-		if self.verbose:
-			print("[AdCreatives] {:s}".format(self._timestamp()))
-			print("[AdCreatives] Downloading {:,d} ad creatives (type = {:s})...".format(limit, ad_type))
-			print()
+	# Queue the row for the background writer, which also marks the ad as done. If a worker failed before producing a row,
+	# the ad is returned to the crawl queue instead (until it reaches MAX_CRAWL_ATTEMPTS).
+	def _write_ad_creative(self, ad_info, row, screenshot_rows, asset_row, screenshot_futures = None):
+		self.writer.write(self._get_ad_table(ad_info.type), ad_info.id, row, screenshot_rows, asset_row, screenshot_futures)
 
-		self._start_webdriver()
-		remaining_ad_ids = self._get_remaining_ad_ids(ad_type = ad_type)
-		if self.shuffle:
-			random.shuffle(remaining_ad_ids)
-		for i, ad_id in enumerate(remaining_ad_ids):
+	def _download_ad_creatives_serially(self, ad_type, ad_infos, total_count, screenshot):
+		self.writer.start()
+		for i, ad_info in enumerate(ad_infos):
 			if self.verbose and i % 100 == 0:
 				print("[AdCreatives] {:s}".format(self._timestamp()))
-				print("Number of remaining ads (type = {:s}) = {:,d} / {:,d}".format(ad_type, i + 1, len(remaining_ad_ids)))
+				print("Number of remaining ads (type = {:s}) = {:,d} / {:,d}".format(ad_type, i + 1, total_count))
 				print()
-			is_unknown_error = self._download_ad_creative(i + 1, len(remaining_ad_ids), ad_id, screenshot_success = screenshot)
-			if (i + 1) >= limit:
-				print()
-				break
-			if (i % DRIVER_RESTART_PAGES) == (DRIVER_RESTART_PAGES - 1) or is_unknown_error:
-				self._stop_webdriver()
-				self._start_webdriver()
-#			time.sleep(0.25)
+			(row, is_unknown_error) = self._download_ad_creative(i + 1, total_count, ad_info, screenshot_success = screenshot)
+			self._write_ad_creative(ad_info, row, self.screenshot_rows, self.asset_row, self.screenshot_futures)
 		self._stop_webdriver()
+		self._close_screenshot_store()
+
+	def _start_worker(self, worker_index, screenshot, result_queue):
+		ad_info_queue = multiprocessing.Queue()
+		process = multiprocessing.Process(target = _run_webdriver_worker, args = (self.timestamp, self._get_worker_options(), worker_index, screenshot, ad_info_queue, result_queue), name = "webdriver-{:d}".format(worker_index))
+		process.start()
+		return (process, ad_info_queue)
+
+	# Browsers run in worker processes, while this process claims ads, and its writer thread is the only writer of downloaded ads.
+	# Each worker has its own queue of at most WORKER_QUEUE_SIZE ads in flight. If a worker dies, its ads are returned to the
+	# crawl queue, and it is replaced (up to MAX_WORKER_RESTARTS times in all).
+	def _download_ad_creatives_in_parallel(self, ad_type, ad_infos, total_count, screenshot):
+		result_queue = multiprocessing.Queue()
+		workers = [self._start_worker(i, screenshot, result_queue) for i in range(self.workers)]
+		# Start the writer thread only after forking, as a worker forked while the thread is inside SQLite may deadlock
+		# when it opens the creatives database
+		self.writer.start()
+
+		# Ads sent to each worker, by index, until their results arrive
+		in_flight = [{} for i in range(self.workers)]
+		restart_count = 0
+		ad_infos = iter(ad_infos)
+		next_index = 0
+		try:
+			while True:
+				for (worker_index, (process, ad_info_queue)) in enumerate(workers):
+					if process is None or process.is_alive():
+						continue
+					process.join()
+					print("[AdCreatives] [ERROR] WebDriver worker {:d} exited (exit code = {}); returning {:,d} ads to the crawl queue".format(worker_index, process.exitcode, len(in_flight[worker_index])))
+					for ad_info in in_flight[worker_index].values():
+						self._write_ad_creative(ad_info, None, [], None)
+					in_flight[worker_index] = {}
+					if restart_count < MAX_WORKER_RESTARTS:
+						restart_count += 1
+						# Forked while the writer thread is outside SQLite (see above)
+						with self.writer.lock:
+							workers[worker_index] = self._start_worker(worker_index, screenshot, result_queue)
+					else:
+						workers[worker_index] = (None, None)
+				while True:
+					worker_indexes = [i for i in range(self.workers) if workers[i][0] is not None and len(in_flight[i]) < WORKER_QUEUE_SIZE]
+					if len(worker_indexes) == 0:
+						break
+					ad_info = next(ad_infos, None)
+					if ad_info is None:
+						break
+					if self.verbose and next_index % 100 == 0:
+						print("[AdCreatives] {:s}".format(self._timestamp()))
+						print("Number of remaining ads (type = {:s}) = {:,d} / {:,d}".format(ad_type, next_index + 1, total_count))
+						print()
+					worker_index = min(worker_indexes, key = lambda i: len(in_flight[i]))
+					workers[worker_index][1].put((next_index + 1, total_count, ad_info))
+					in_flight[worker_index][next_index + 1] = ad_info
+					next_index += 1
+				if all(process is None for (process, ad_info_queue) in workers):
+					print("[AdCreatives] [ERROR] All WebDriver workers have exited")
+					break
+				if all(len(worker_in_flight) == 0 for worker_in_flight in in_flight):
+					break
+				try:
+					(worker_index, index, row, screenshot_rows, asset_row) = result_queue.get(timeout = WORKER_POLL_SECS)
+				except queue.Empty:
+					continue
+				# Ignore a late result of a worker that died, as its ads have been returned to the crawl queue
+				if index in in_flight[worker_index]:
+					ad_info = in_flight[worker_index].pop(index)
+					self._write_ad_creative(ad_info, row, screenshot_rows, asset_row)
+		finally:
+			for (process, ad_info_queue) in workers:
+				if process is not None:
+					ad_info_queue.put(WORKER_STOP)
+			for (process, ad_info_queue) in workers:
+				if process is not None:
+					process.join()
+
+	# Options of the helper in each worker process
+	def _get_worker_options(self):
+		return {
+			"headless": self.headless,
+			"http_first": self.http_first,
+			"block_resources": self.block_resources,
+			"page_load_strategy": self.page_load_strategy,
+			"profile_folder": self.profile_folder,
+			"screenshot_format": self.screenshot_format,
+			"screenshot_threads": self.screenshot_threads,
+		}
+
+	def download_ad_creatives(self, ad_type, limit, screenshot):
+		if self.verbose:
+			print("[AdCreatives] {:s}".format(self._timestamp()))
+			print("[AdCreatives] Downloading {:,d} ad creatives (type = {:s}, workers = {:d})...".format(limit, ad_type, self.workers))
+			print()
+
+		self._seed_crawl_queue(ad_type)
+		state_counts = self._count_crawl_queue(ad_type)
+		total_count = min(limit, state_counts[CRAWL_PENDING] + state_counts[CRAWL_IN_PROGRESS])
+		ad_infos = self._iter_claimed_ad_infos(ad_type, limit)
+		self.writer = GoogleAdCreativesWriter(self.engine, self.db, batch_size = self.write_batch_size, flush_interval = self.write_flush_interval, verbose = self.verbose)
+		try:
+			if self.workers > 1:
+				self._download_ad_creatives_in_parallel(ad_type, ad_infos, total_count, screenshot)
+			else:
+				self._download_ad_creatives_serially(ad_type, ad_infos, total_count, screenshot)
+		finally:
+			self.writer.close()
+			self.writer = None
 
 		if self.verbose:
-			print("[AdCreatives] Downloaded {:,d} ad creatives (type = {:s})".format(limit, ad_type))
+			print("[AdCreatives] Downloaded ad creatives (type = {:s})".format(ad_type))
 			print("[AdCreatives] {:s}".format(self._timestamp()))
 			print()
 
@@ -663,3 +1284,45 @@ class GoogleAdCreativesDownloadHelper:
 
 	def download_video_ads(self, limit, screenshot):
 		self.download_ad_creatives(VIDEO_AD_TYPE, limit, screenshot)
+
+# Entry point of a WebDriver worker process: downloads the ads in ad_info_queue with its own browser,
+# and sends a (worker_index, index, row, screenshot_rows, asset_row) tuple back to the parent process for each of them.
+# Futures cannot be sent to the parent process, so a sender thread waits for the screenshots of each ad to be stored
+# before sending its result, while the browser moves on to the next ad.
+def _run_webdriver_worker(timestamp, helper_options, worker_index, screenshot, ad_info_queue, result_queue):
+	helper = GoogleAdCreativesDownloadHelper(timestamp, worker_index = worker_index, connect_db = False, **helper_options)
+	send_queue = queue.Queue()
+	sender = threading.Thread(target = _run_worker_sender, args = (worker_index, send_queue, result_queue), name = "worker-sender", daemon = True)
+	sender.start()
+	try:
+		while True:
+			item = ad_info_queue.get()
+			if item is WORKER_STOP:
+				break
+			(index, total_count, ad_info) = item
+			try:
+				(row, is_unknown_error) = helper._download_ad_creative(index, total_count, ad_info, screenshot_success = screenshot)
+			except Exception as e:
+				print("[AdCreatives] [ERROR] Failed to download ad {:s}: {}".format(ad_info.id, e))
+				row = None
+			send_queue.put((index, row, helper.screenshot_rows, helper.asset_row, helper.screenshot_futures))
+	finally:
+		send_queue.put(WORKER_STOP)
+		sender.join()
+		helper._stop_webdriver()
+		helper._close_screenshot_store()
+
+def _run_worker_sender(worker_index, send_queue, result_queue):
+	while True:
+		item = send_queue.get()
+		if item is WORKER_STOP:
+			break
+		(index, row, screenshot_rows, asset_row, screenshot_futures) = item
+		(screenshot_rows, asset_row) = resolve_screenshots(screenshot_rows, asset_row, screenshot_futures)
+		result_queue.put((worker_index, index, row, screenshot_rows, asset_row))
+
+def _quit_webdriver(driver):
+	try:
+		driver.quit()
+	except Exception as e:
+		print("[AdCreatives] [WARNING] Failed to shut down a WebDriver: {}".format(e))
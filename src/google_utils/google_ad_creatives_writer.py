@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+from google_utils.google_ad_creatives_db import CRAWL_PENDING, CRAWL_DONE
+
+import queue
+from sqlalchemy.sql import and_, bindparam
+import threading
+import time
+
+DEFAULT_WRITE_BATCH_SIZE = 100
+DEFAULT_WRITE_FLUSH_INTERVAL_SECS = 5.0
+WRITER_QUEUE_SIZE = 1000
+WRITER_STOP = None
+
+# Wait for the screenshots of an ad to be stored, given the futures of their files by content hash. Returns the
+# ad_screenshots rows and the creative_assets row (or None) without the screenshots that failed to be stored.
+def resolve_screenshots(screenshot_rows, asset_row, screenshot_futures):
+	failed_hashes = set(content_hash for (content_hash, future) in screenshot_futures.items() if future.exception() is not None)
+	if len(failed_hashes) == 0:
+		return (screenshot_rows, asset_row)
+	screenshot_rows = [screenshot_row for screenshot_row in screenshot_rows if screenshot_row["content_hash"] not in failed_hashes]
+	if asset_row is not None and asset_row["screenshot_hash"] in failed_hashes:
+		asset_row = {**asset_row, "screenshot_hash": None, "screenshot_format": None}
+	return (screenshot_rows, asset_row)
+
+# Writes downloaded creatives to the creatives database from a background thread, so that the crawl loop never waits
+# for a commit. Rows are written in batches of up to batch_size rows, or every flush_interval seconds, in one
+# transaction each, together with the updates to the crawl queue and the screenshots and creative assets of the ads.
+# The screenshots of a batch are written once their files are stored, which the thread waits for rather than the crawl
+# loop. The thread opens its own connection.
+class GoogleAdCreativesWriter:
+	def __init__(self, engine, db, batch_size = DEFAULT_WRITE_BATCH_SIZE, flush_interval = DEFAULT_WRITE_FLUSH_INTERVAL_SECS, verbose = True):
+		self.verbose = verbose
+		self.engine = engine
+		self.crawl_queue = db.crawl_queue
+		self.ad_screenshots = db.ad_screenshots
+		self.creative_assets = db.creative_assets
+		self.creative_asset_refs = db.creative_asset_refs
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.queue = queue.Queue(maxsize = WRITER_QUEUE_SIZE)
+		self.thread = None
+		# Held while the thread is inside SQLite, so that the crawler can fork a worker process safely
+		self.lock = threading.Lock()
+		self.error = None
+		self.row_count = 0
+		self.batch_count = 0
+
+	def start(self):
+		assert self.thread is None
+		self.thread = threading.Thread(target = self._run, name = "creatives-writer", daemon = True)
+		self.thread.start()
+
+	# Queue a row for the given table (or None, if the ad has no row), rows for the ad_screenshots table, a row for
+	# the creative_assets table (or None), and the futures of the screenshot files that are still being stored (by
+	# content hash); blocks only if the writer is far behind
+	def write(self, table, ad_id, row, screenshot_rows = (), asset_row = None, screenshot_futures = None):
+		self._check_error()
+		self.queue.put((table, ad_id, row, screenshot_rows, asset_row, screenshot_futures))
+
+	# Write the remaining rows and stop the thread
+	def close(self):
+		if self.thread is not None:
+			self.queue.put(WRITER_STOP)
+			self.thread.join()
+			self.thread = None
+			if self.verbose:
+				print("[AdCreativesWriter] Wrote {:,d} rows in {:,d} transactions".format(self.row_count, self.batch_count))
+		self._check_error()
+
+	def _check_error(self):
+		if self.error is not None:
+			raise self.error
+
+	def _run(self):
+		with self.lock:
+			conn = self.engine.connect()
+		try:
+			batch = []
+			flush_timestamp = None
+			while True:
+				timeout = None if flush_timestamp is None else max(flush_timestamp - time.monotonic(), 0.0)
+				try:
+					item = self.queue.get(timeout = timeout)
+				except queue.Empty:
+					item = False
+				if item is not WRITER_STOP and item is not False:
+					batch.append(item)
+					if flush_timestamp is None:
+						flush_timestamp = time.monotonic() + self.flush_interval
+				if item is WRITER_STOP or len(batch) >= self.batch_size or (flush_timestamp is not None and time.monotonic() >= flush_timestamp):
+					# Outside the lock, so that worker processes can be forked in the meantime
+					batch = [self._resolve_screenshots(*item) for item in batch]
+					with self.lock:
+						self._write_batch(conn, batch)
+					batch = []
+					flush_timestamp = None
+				if item is WRITER_STOP:
+					break
+		finally:
+			with self.lock:
+				conn.close()
+
+	def _resolve_screenshots(self, table, ad_id, row, screenshot_rows, asset_row, screenshot_futures):
+		if screenshot_futures is not None:
+			(screenshot_rows, asset_row) = resolve_screenshots(screenshot_rows, asset_row, screenshot_futures)
+		return (table, ad_id, row, screenshot_rows, asset_row)
+
+	def _write_assets(self, conn, asset_rows, asset_ref_rows):
+		# Keep the first copy of each asset, but add a screenshot if the first ad with the asset had none
+		conn.execute(self.creative_assets.insert().prefix_with("OR IGNORE"), asset_rows)
+		screenshot_params = [
+			{"b_asset_hash": asset_row["asset_hash"], "b_screenshot_hash": asset_row["screenshot_hash"], "b_screenshot_format": asset_row["screenshot_format"]}
+			for asset_row in asset_rows if asset_row["screenshot_hash"] is not None
+		]
+		if len(screenshot_params) > 0:
+			creative_assets = self.creative_assets
+			conn.execute(creative_assets.update().where(and_(creative_assets.c.asset_hash == bindparam("b_asset_hash"), creative_assets.c.screenshot_hash == None)).values(
+				screenshot_hash = bindparam("b_screenshot_hash"),
+				screenshot_format = bindparam("b_screenshot_format"),
+			), screenshot_params)
+		conn.execute(self.creative_asset_refs.insert().prefix_with("OR REPLACE"), asset_ref_rows)
+
+	def _write_batch(self, conn, batch):
+		# After an error, keep draining the queue (so that the crawl loop is not blocked) until it is reported
+		if len(batch) == 0 or self.error is not None:
+			return
+		rows_by_table = {}
+		screenshot_rows = []
+		asset_rows = []
+		asset_ref_rows = []
+		done_ad_ids = []
+		pending_ad_ids = []
+		for (table, ad_id, row, ad_screenshot_rows, asset_row) in batch:
+			screenshot_rows.extend(ad_screenshot_rows)
+			if asset_row is not None:
+				asset_rows.append(asset_row)
+				asset_ref_rows.append({"ad_id": ad_id, "asset_hash": asset_row["asset_hash"]})
+			if table is not None and row is not None:
+				if table.name not in rows_by_table:
+					rows_by_table[table.name] = (table, [])
+				rows_by_table[table.name][1].append(row)
+			# An ad without a row (because its worker failed) is returned to the crawl queue for another attempt
+			if table is not None and row is None:
+				pending_ad_ids.append(ad_id)
+			else:
+				done_ad_ids.append(ad_id)
+
+		try:
+			with conn.begin():
+				for (table, rows) in rows_by_table.values():
+					# Ignore duplicates, in case an expired lease let another crawler download the same ad
+					conn.execute(table.insert().prefix_with("OR IGNORE"), rows)
+				# Keep the screenshots of the latest attempt to download an ad
+				if len(screenshot_rows) > 0:
+					conn.execute(self.ad_screenshots.insert().prefix_with("OR REPLACE"), screenshot_rows)
+				if len(asset_rows) > 0:
+					self._write_assets(conn, asset_rows, asset_ref_rows)
+				for (state, ad_ids) in [(CRAWL_DONE, done_ad_ids), (CRAWL_PENDING, pending_ad_ids)]:
+					if len(ad_ids) > 0:
+						conn.execute(self.crawl_queue.update().where(self.crawl_queue.c.ad_id.in_(ad_ids)).values(
+							state = state,
+							lease_owner = None,
+							lease_expiry = None,
+						))
+		except Exception as e:
+			print("[AdCreativesWriter] [ERROR] Failed to write {:,d} rows: {}".format(len(batch), e))
+			self.error = e
+			return
+		self.row_count += len(batch)
+		self.batch_count += 1
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import Future
+import hashlib
+import io
+import os
+import queue
+import threading
+
+# Pillow is optional: without it, screenshots are stored as captured
+try:
+	from PIL import Image, features
+except ImportError:
+	Image = None
+
+SCREENSHOT_FORMATS = ["webp", "png"]
+DEFAULT_SCREENSHOT_FORMAT = "webp"
+DEFAULT_ENCODER_THREADS = 2
+ENCODER_QUEUE_SIZE = 16
+ENCODER_STOP = None
+
+# Stores screenshots (PNG bytes, as captured by WebDriver) by the SHA-256 hash of their content, so that identical
+# creatives are stored once. Screenshots are re-encoded (as lossless WebP, or as optimized PNG) and written to disk by
+# a pool of threads, so that the crawl loop only pays for hashing. Files are named <hash[:2]>/<hash>.<format>.
+# Each save returns a future, which is done once the file is on disk (or has failed to be written).
+class GoogleAdScreenshotStore:
+	def __init__(self, folder, screenshot_format = DEFAULT_SCREENSHOT_FORMAT, threads = DEFAULT_ENCODER_THREADS, verbose = True):
+		assert screenshot_format in SCREENSHOT_FORMATS
+		assert threads >= 1
+		self.verbose = verbose
+		self.folder = folder
+		self.threads = threads
+		self.file_format = self._get_file_format(screenshot_format)
+		self.queue = queue.Queue(maxsize = ENCODER_QUEUE_SIZE)
+		self.encoder_threads = []
+		self.futures = {}
+		self._lock = threading.Lock()
+		self.saved_count = 0
+		self.duplicate_count = 0
+		self.error_count = 0
+		self.captured_bytes = 0
+		self.stored_bytes = 0
+
+	def _get_file_format(self, screenshot_format):
+		if Image is None:
+			print("[ScreenshotStore] [WARNING] Pillow is not installed; storing screenshots as captured PNG files")
+			return "png"
+		if screenshot_format == "webp" and not features.check("webp"):
+			print("[ScreenshotStore] [WARNING] Pillow was built without WebP support; storing screenshots as optimized PNG files")
+			return "png"
+		return screenshot_format
+
+	def get_path(self, content_hash):
+		return os.path.join(self.folder, content_hash[:2], "{:s}.{:s}".format(content_hash, self.file_format))
+
+	def start(self):
+		assert len(self.encoder_threads) == 0
+		for i in range(self.threads):
+			thread = threading.Thread(target = self._run, name = "screenshot-encoder-{:d}".format(i), daemon = True)
+			thread.start()
+			self.encoder_threads.append(thread)
+
+	# Returns (content_hash, file_format, future) of the screenshot; blocks only if the encoders are far behind.
+	# A duplicate shares the future of the first copy, or gets a done future if the file was stored by an earlier run.
+	def save(self, png):
+		content_hash = hashlib.sha256(png).hexdigest()
+		path = self.get_path(content_hash)
+		with self._lock:
+			is_duplicate = content_hash in self.futures or os.path.exists(path)
+			if is_duplicate:
+				self.duplicate_count += 1
+				if content_hash not in self.futures:
+					self.futures[content_hash] = Future()
+					self.futures[content_hash].set_result(None)
+			else:
+				self.futures[content_hash] = Future()
+			future = self.futures[content_hash]
+		if not is_duplicate:
+			self.queue.put((png, path, content_hash, future))
+		return (content_hash, self.file_format, future)
+
+	# Write the remaining screenshots and stop the threads
+	def close(self):
+		for thread in self.encoder_threads:
+			self.queue.put(ENCODER_STOP)
+		for thread in self.encoder_threads:
+			thread.join()
+		self.encoder_threads = []
+		if self.verbose and self.saved_count + self.duplicate_count > 0:
+			print("[ScreenshotStore] Stored {:,d} screenshots ({:,d} KB, captured as {:,d} KB); skipped {:,d} duplicates; {:,d} errors".format(
+				self.saved_count, self.stored_bytes // 1024, self.captured_bytes // 1024, self.duplicate_count, self.error_count))
+
+	def _encode(self, png):
+		if Image is None:
+			return png
+		image = Image.open(io.BytesIO(png))
+		output = io.BytesIO()
+		if self.file_format == "webp":
+			image.save(output, format = "WEBP", lossless = True, method = 4)
+		else:
+			image.save(output, format = "PNG", optimize = True)
+		return output.getvalue()
+
+	def _run(self):
+		while True:
+			item = self.queue.get()
+			if item is ENCODER_STOP:
+				break
+			(png, path, content_hash, future) = item
+			try:
+				data = self._encode(png)
+				os.makedirs(os.path.dirname(path), exist_ok = True)
+				# Write to a temporary file first, as other crawlers may store the same screenshot at the same time
+				temp_path = "{:s}.{:d}.{:d}.tmp".format(path, os.getpid(), threading.get_ident())
+				with open(temp_path, "wb") as f:
+					f.write(data)
+				os.replace(temp_path, path)
+			except Exception as e:
+				print("[ScreenshotStore] [ERROR] Failed to store screenshot {:s}: {}".format(os.path.basename(path), e))
+				# A later save of the same screenshot tries again
+				with self._lock:
+					self.error_count += 1
+					del self.futures[content_hash]
+				future.set_exception(e)
+			else:
+				with self._lock:
+					self.saved_count += 1
+					self.captured_bytes += len(png)
+					self.stored_bytes += len(data)
+				future.set_result(None)
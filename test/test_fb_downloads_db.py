@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import facebook_utils
+from facebook_utils import downloads_db
+
+from datetime import datetime
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+
+def get_task_as_dict(task_key, countries, ad_active_status, ads_per_page):
+	now = datetime.now()
+	return {
+		"task_key": task_key,
+		"task_priority": 0,
+		"creation_timestamp": now,
+		"start_timestamp": now,
+		"finish_timestamp": now,
+		"experiment_key": "us",
+		"split_index": 0,
+		"page_index": task_key,
+		"page_attempt": 0,
+		"attempt_index": 0,
+		"experiment_spec": json.dumps({"experiment_key": "us", "search_by_advertisers": False, "ad_active_status": "ALL", "ads_per_page": 100}),
+		"split_spec": json.dumps({"countries": countries, "ad_active_status": ad_active_status}),
+		"page_spec": json.dumps({}),
+		"attempt_spec": json.dumps({"ads_per_page": ads_per_page}),
+		"continuation": json.dumps({}),
+		"finish_code": 0,
+		"finish_log": json.dumps({}),
+		"access_token": "token",
+		"ad_count": ads_per_page,
+		"paging_cursor": None,
+		"error_code": None,
+		"experiment_folder": "test",
+	}
+
+def get_response():
+	now = datetime.now()
+	return {
+		"request_timestamp": now,
+		"response_timestamp": now,
+		"duration": 1.0,
+		"response_header": {},
+		"response_body": {"data": []},
+		"response_body_length": 1000,
+		"response_html": None,
+		"response_error": None,
+	}
+
+def get_ads_per_page(db, countries, ad_active_status):
+	db.open()
+	page_stats = db.get_page_stats("us", "countries", countries, ad_active_status)
+	db.close()
+	return [page["ads_per_page"] for page in page_stats]
+
+db_folder = tempfile.mkdtemp()
+try:
+	# Recent pages are looked up by their countries and ad active status, most recent first
+	db = facebook_utils.DownloadsDB(db_folder = db_folder, verbose = False)
+	db.open()
+	db.insert(get_task_as_dict(1, ["US"], "ALL", 10), "url", get_response())
+	db.insert(get_task_as_dict(2, ["US", "CA"], "ALL", 20), "url", get_response())
+	db.insert(get_task_as_dict(3, ["US"], "ACTIVE", 30), "url", get_response())
+	db.insert(get_task_as_dict(4, ["US"], "ALL", 40), "url", get_response())
+	db.close()
+	assert get_ads_per_page(db, ["US"], "ALL") == [40, 10]
+	assert get_ads_per_page(db, ["US", "CA"], "ALL") == [20]
+	assert get_ads_per_page(db, ["US"], "ACTIVE") == [30]
+	assert get_ads_per_page(db, ["CA"], "ALL") == []
+	print("Looked up recent pages")
+
+	# A database created before split_items_key was added gets the column, filled in for existing pages
+	old_db_folder = os.path.join(db_folder, "old")
+	os.makedirs(old_db_folder)
+	column_names = [column_name for column_name in downloads_db.INSERT_TASK_SQL.split("(")[1].split(")")[0].replace("\"", "").replace(",", " ").split() if column_name != "split_items_key"]
+	connection = sqlite3.connect(os.path.join(old_db_folder, downloads_db.DB_FILENAME))
+	connection.execute(downloads_db.CREATE_TABLE_SQL.replace(",\n\t\"split_items_key\" TEXT", ""))
+	connection.execute("""CREATE INDEX "split_index_index" ON "all_tasks_table" ("experiment_key", "split_index");""")
+	connection.execute("ATTACH DATABASE ? AS new_db", (os.path.join(db_folder, downloads_db.DB_FILENAME), ))
+	connection.execute("INSERT INTO all_tasks_table ({columns}) SELECT {columns} FROM new_db.all_tasks_table".format(columns = ", ".join(column_names)))
+	connection.commit()
+	connection.close()
+	old_db = facebook_utils.DownloadsDB(db_folder = old_db_folder, verbose = False)
+	assert get_ads_per_page(old_db, ["US"], "ALL") == [40, 10]
+	assert get_ads_per_page(old_db, ["US"], "ACTIVE") == [30]
+	connection = sqlite3.connect(os.path.join(old_db_folder, downloads_db.DB_FILENAME))
+	assert [row[0] for row in connection.execute("""SELECT "name" FROM "sqlite_master" WHERE "type" = "index" AND "name" NOT LIKE 'sqlite_%'""")] == ["split_items_index"]
+	connection.close()
+	print("Added split_items_key to an existing database")
+finally:
+	shutil.rmtree(db_folder)
+print("OK")
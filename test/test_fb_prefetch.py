@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import facebook_utils
+import facebook_utils.downloads_db
+import facebook_utils.queue_db
+import facebook_utils.tasks
+
+from datetime import datetime
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import urllib.parse
+
+PAGE_COUNT = 4
+STORE_SECONDS = 0.2
+
+# A single token without rate limits
+class TestTokenPool:
+	def get_next_token(self):
+		return ("test", 0.0)
+	def get_access_token(self, token_label):
+		return "token"
+	def before_search(self, token_label, delay = None):
+		pass
+	def after_search(self, token_label):
+		pass
+	def back_off(self, token_label, delay):
+		pass
+	def report_result(self, token_label, finish_code):
+		pass
+	def check_expiration(self, auto_refresh = False):
+		pass
+
+events = []
+
+# Pages of 3 ads, followed by a paging cursor except on the last page
+def search(self, url):
+	query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+	after_token = query["after"][0] if "after" in query else None
+	events.append(("fetch", after_token))
+	page_index = 0 if after_token is None else int(after_token[1:])
+	response_body = {"data": [{"id": "{}-{}".format(page_index, i)} for i in range(0, 3)]}
+	if page_index < PAGE_COUNT - 1:
+		response_body["paging"] = {"cursors": {"after": "c{}".format(page_index + 1)}}
+	now = datetime.now()
+	return {
+		"request_timestamp": now,
+		"response_timestamp": now,
+		"duration": 0.0,
+		"response_header": {},
+		"response_body": response_body,
+		"response_body_length": None,
+		"response_html": None,
+		"response_error": None,
+	}
+
+# Storing a page is slow
+real_insert = facebook_utils.DownloadsDB.insert
+def insert(self, task_as_dict, url, response):
+	time.sleep(STORE_SECONDS)
+	real_insert(self, task_as_dict, url, response)
+	continuation = json.loads(task_as_dict["continuation"])
+	events.append(("store", continuation["after_token"] if "after_token" in continuation else None))
+
+facebook_utils.APIHelper.search = search
+facebook_utils.DownloadsDB.insert = insert
+
+def run_pipeline(folder, prefetch):
+	del events[:]
+	facebook_utils.queue_db.DB_FOLDER = os.path.join(folder, "db")
+	facebook_utils.downloads_db.DB_FOLDER = os.path.join(folder, "downloads")
+	os.makedirs(facebook_utils.queue_db.DB_FOLDER)
+	task_manager = facebook_utils.TaskManager()
+	experiment_spec = task_manager.create_experiment("us", opt_last_n_days = 7)
+	experiment_spec["experiment_folder"] = "prefetch"
+	experiment_spec["countries"] = ["US"]
+	queue_manager = facebook_utils.QueueManager(verbose = False)
+	queue_manager.create_tasks(experiment_spec, task_manager.iter_splits(experiment_spec), task_manager.init_page(), task_manager.init_attempt(), task_manager.init_continuation())
+	pipeline = facebook_utils.DownloadPipeline(TestTokenPool(), verbose = False, prefetch = prefetch)
+	pipeline.run()
+
+	# Every page is stored once, and the split is finished with no task left behind
+	queue_db = sqlite3.connect(os.path.join(facebook_utils.queue_db.DB_FOLDER, facebook_utils.queue_db.DB_FILENAME))
+	assert queue_db.execute("SELECT COUNT(*), SUM(is_task_finished) FROM all_tasks_table").fetchone() == (PAGE_COUNT, PAGE_COUNT)
+	assert queue_db.execute("SELECT is_split_finished FROM split_checkpoints_table").fetchall() == [(1, )]
+	queue_db.close()
+	after_tokens = [None] + ["c{}".format(i) for i in range(1, PAGE_COUNT)]
+	assert [event for event in events if event[0] == "store"] == [("store", after_token) for after_token in after_tokens]
+	assert [event for event in events if event[0] == "fetch"] == [("fetch", after_token) for after_token in after_tokens]
+	return list(events)
+
+folder = tempfile.mkdtemp()
+try:
+	facebook_utils.tasks.TASK_CONFIG_FILENAME = os.path.join(folder, "facebook_tasks.ini")
+
+	# By default, the next page of a split is requested once the current page is stored
+	threaded_events = run_pipeline(os.path.join(folder, "threaded"), False)
+	print("Threaded: {}".format(threaded_events))
+	assert threaded_events.index(("fetch", "c1")) > threaded_events.index(("store", None))
+
+	# In prefetch mode, the next page is requested while the current page is being stored
+	prefetch_events = run_pipeline(os.path.join(folder, "prefetch"), True)
+	print("Prefetch: {}".format(prefetch_events))
+	assert prefetch_events.index(("fetch", "c1")) < prefetch_events.index(("store", None))
+	assert prefetch_events.index(("fetch", "c2")) < prefetch_events.index(("store", "c1"))
+finally:
+	shutil.rmtree(folder)
+print("OK")
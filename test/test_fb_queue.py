@@ -24,9 +24,10 @@ def print_json(label, data):
 parser = argparse.ArgumentParser()
 parser.add_argument("command", choices = [START, FINISH, CANCEL, RESTART, NEXT, GET, CREATE], type = str)
 parser.add_argument("value", help = "task_key or number of records", type = int, nargs = "?")
+parser.add_argument("--scheduler", choices = sorted(facebook_utils.SCHEDULERS.keys()), type = str, default = facebook_utils.PriorityScheduler.name)
 args = parser.parse_args()
 
-queue = facebook_utils.QueueManager(db_folder = "../db/test", verbose = True)
+queue = facebook_utils.QueueManager(db_folder = "../db/test", verbose = True, scheduler = facebook_utils.SCHEDULERS[args.scheduler]())
 
 command = args.command
 
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import facebook_utils
+
+from facebook_utils.queue import STALE_TASK_DURATION
+
+from datetime import timedelta
+import shutil
+import tempfile
+
+SPLIT_COUNT = 4
+
+def create_splits(queue_manager):
+	experiment_spec = {
+		"experiment_key": "resume",
+		"experiment_folder": "resume",
+		"task_priority": 0,
+	}
+	split_specs = [{"split_index": split_index} for split_index in range(0, SPLIT_COUNT)]
+	page_spec = {"page_index": 0, "page_attempt": 0}
+	attempt_spec = {"attempt_index": 0}
+	return queue_manager.create_tasks(experiment_spec, split_specs, page_spec, attempt_spec, {})
+
+def get_next_page(task, after_token):
+	next_task = {key: dict(task[key]) for key in ["experiment_spec", "split_spec", "page_spec", "attempt_spec", "continuation"]}
+	next_task["page_spec"]["page_index"] += 1
+	next_task["continuation"]["after_token"] = after_token
+	return next_task
+
+def get_active_task_keys(db_folder):
+	db = facebook_utils.QueueDB(db_folder = db_folder, verbose = False)
+	db.open()
+	db.cursor.execute("SELECT task_key FROM all_tasks_table WHERE is_task_cancelled = 0 AND is_task_started = 0 AND is_task_finished = 0 ORDER BY task_key")
+	task_keys = [row["task_key"] for row in db.cursor.fetchall()]
+	db.close()
+	return task_keys
+
+db_folder = tempfile.mkdtemp()
+try:
+	queue_manager = facebook_utils.QueueManager(db_folder = db_folder, verbose = False)
+	(interrupted_key, failed_key, checkpointed_key, finished_key) = create_splits(queue_manager)
+
+	# Split 0: the runner died during the request
+	queue_manager.start_task(interrupted_key)
+
+	# Split 1: the runner died while the page was saved; the result and the checkpoint are rolled back with it
+	failed_task = queue_manager.get_task(failed_key)
+	queue_manager.start_task(failed_key)
+	saved_task_keys = []
+	def fail_to_save(task_as_dict):
+		saved_task_keys.append(task_as_dict["task_key"])
+		assert task_as_dict["finish_code"] == 0
+		assert task_as_dict["ad_count"] == 3
+		raise IOError("disk full")
+	try:
+		queue_manager.complete_task(failed_task, 0, {"access_token": "token", "ad_count": 3}, get_next_page(failed_task, "c1"), persist = fail_to_save)
+	except IOError:
+		pass
+	else:
+		assert False, "complete_task did not raise"
+	assert saved_task_keys == [failed_key]
+	failed_task_as_dict = queue_manager.get_task_as_dict(failed_key)
+	assert failed_task_as_dict["is_task_started"] == 1
+	assert failed_task_as_dict["is_task_finished"] == 0
+	assert failed_task_as_dict["finish_code"] is None
+
+	# Split 2: the page was saved and the split checkpointed with the task for the next page
+	checkpointed_task = queue_manager.get_task(checkpointed_key)
+	queue_manager.start_task(checkpointed_key)
+	next_task_key = queue_manager.complete_task(checkpointed_task, 0, {"access_token": "token", "ad_count": 3}, get_next_page(checkpointed_task, "c1"))
+
+	# Split 3: the terminal page was saved and the split finished
+	finished_task = queue_manager.get_task(finished_key)
+	queue_manager.start_task(finished_key)
+	assert queue_manager.complete_task(finished_task, -1, {"access_token": "token", "ad_count": 3}, None) is None
+
+	assert get_active_task_keys(db_folder) == [next_task_key]
+	assert queue_manager.get_task(next_task_key)["continuation"]["after_token"] == "c1"
+
+	# Another runner sharing the queue leaves recently started tasks alone
+	resumed_count = queue_manager.resume_splits(stale_task_duration = STALE_TASK_DURATION)
+	print("Resumed {} splits (shared queue)".format(resumed_count))
+	assert resumed_count == 0
+	assert get_active_task_keys(db_folder) == [next_task_key]
+
+	# At startup, a single runner re-queues every interrupted task, however recent
+	resumed_count = queue_manager.resume_splits()
+	print("Resumed {} splits (startup)".format(resumed_count))
+	assert resumed_count == 2
+	assert get_active_task_keys(db_folder) == sorted([interrupted_key, failed_key, next_task_key])
+
+	# Resuming again is a no-op
+	assert queue_manager.resume_splits() == 0
+	assert queue_manager.resume_splits(stale_task_duration = timedelta(0)) == 0
+finally:
+	shutil.rmtree(db_folder)
+print("OK")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import facebook_utils
+from facebook_utils.retry_policy import RETRY_POLICY, RetryRule, THROTTLED, TRANSIENT, REDUCE_DATA, PERMANENT, INVALID_TOKEN, SHRINK, BACKOFF, FAIL
+
+import shutil
+import tempfile
+
+retry_policy = facebook_utils.RetryPolicy()
+
+# Error codes returned by the Graph API
+assert retry_policy.get_rule(1) == REDUCE_DATA
+assert retry_policy.get_rule(2) == TRANSIENT
+for error_code in [4, 17, 32, 613]:
+	assert retry_policy.get_rule(error_code) == THROTTLED
+for error_code in [10, 100, 200]:
+	assert retry_policy.get_rule(error_code) == PERMANENT
+assert retry_policy.get_rule(190) == INVALID_TOKEN
+
+# Connection errors, non-JSON responses, and empty responses (see APIHelper)
+for error_code in [-10001, -10002, -10003]:
+	assert retry_policy.get_rule(error_code) == TRANSIENT
+
+# A subcode without its own rule falls back to the rule for the error code
+assert retry_policy.get_rule(4, 1504022) == THROTTLED
+assert retry_policy.get_rule(100, 33) == PERMANENT
+
+# Unknown error codes from the API are retried with fewer ads; unknown local errors after a delay
+assert retry_policy.get_rule(12345).action == SHRINK
+assert retry_policy.get_rule(-12345).action == BACKOFF
+print("Looked up {} rules".format(len(RETRY_POLICY)))
+
+# A rule for a specific subcode takes precedence over the rule for the error code
+policy = dict(RETRY_POLICY)
+policy[(100, 33)] = TRANSIENT
+custom_retry_policy = facebook_utils.RetryPolicy(policy)
+assert custom_retry_policy.get_rule(100, 33) == TRANSIENT
+assert custom_retry_policy.get_rule(100, 34) == PERMANENT
+assert custom_retry_policy.get_rule(100) == PERMANENT
+
+# Exponential backoff with jitter, capped at max_delay; no delay for other actions
+rule = RetryRule(BACKOFF, 10, 4.0, 60.0)
+for page_attempt in range(1, 10):
+	delay = retry_policy.get_delay(rule, page_attempt)
+	expected_delay = min(60.0, 4.0 * 2.0 ** (page_attempt - 1))
+	assert expected_delay * 0.5 <= delay <= expected_delay, (page_attempt, delay)
+assert retry_policy.get_delay(REDUCE_DATA, 3) == 0.0
+assert retry_policy.get_delay(PERMANENT, 1) == 0.0
+assert PERMANENT.action == FAIL
+print("Checked backoff delays")
+
+# A failed task is recorded but never scheduled or resumed again
+db_folder = tempfile.mkdtemp()
+try:
+	queue_manager = facebook_utils.QueueManager(db_folder = db_folder, verbose = False)
+	experiment_spec = {"experiment_key": "retry", "experiment_folder": "retry", "task_priority": 0}
+	split_spec = {"split_index": 0}
+	page_spec = {"page_index": 0, "page_attempt": 0}
+	attempt_spec = {"attempt_index": 0}
+	task_key = queue_manager.create_task(experiment_spec, split_spec, page_spec, attempt_spec, {})
+	task = queue_manager.get_next_active_task()
+	assert task["task_key"] == task_key
+	queue_manager.start_task(task_key)
+	failed_task = {
+		"experiment_spec": experiment_spec,
+		"split_spec": split_spec,
+		"page_spec": page_spec,
+		"attempt_spec": {"attempt_index": 1, "page_attempt": 1},
+		"continuation": {"error_codes": [100], "is_task_failed": True},
+	}
+	failed_task_key = queue_manager.complete_task(task, 100, {"access_token": "token", "error_code": 100}, failed_task)
+	failed_task_as_dict = queue_manager.get_task_as_dict(failed_task_key)
+	assert failed_task_as_dict["is_task_failed"] == 1
+	assert failed_task_as_dict["is_task_cancelled"] == 1
+	assert queue_manager.get_next_active_task() is None
+	assert queue_manager.resume_splits() == 0
+	assert queue_manager.get_next_active_task() is None
+
+	# Failed tasks can still be retried by hand
+	queue_manager.restart_task(failed_task_key)
+	assert queue_manager.get_next_active_task()["task_key"] == failed_task_key
+finally:
+	shutil.rmtree(db_folder)
+print("OK")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import facebook_utils
+
+import argparse
+import shutil
+import tempfile
+
+def create_experiment_task(db, experiment_folder, task_weight = 1.0, task_priority = 0):
+	experiment_spec = {
+		"experiment_key": experiment_folder,
+		"experiment_folder": experiment_folder,
+		"task_priority": task_priority,
+		"task_weight": task_weight,
+	}
+	split_spec = {"split_index": 0}
+	page_spec = {"page_index": 0, "page_attempt": 0}
+	attempt_spec = {"attempt_index": 0}
+	return db.create_task(experiment_spec, split_spec, page_spec, attempt_spec, {})
+
+# Start the next scheduled task, then queue a follow-up page of the same experiment
+def serve_next_task(db):
+	task = db.get_next_active_task()
+	task_key = task["task_key"]
+	db.start_task(task_key)
+	db.finish_task(task_key)
+	db.create_task(task["experiment_spec"], task["split_spec"], task["page_spec"], task["attempt_spec"], task["continuation"])
+	return task["experiment_spec"]["experiment_folder"]
+
+def serve_tasks(db, count):
+	served = {}
+	for i in range(0, count):
+		experiment_folder = serve_next_task(db)
+		served[experiment_folder] = (served[experiment_folder] if experiment_folder in served else 0) + 1
+	return served
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--backlog", help = "tasks served to an old experiment before a new one arrives", type = int, default = 100)
+parser.add_argument("--rounds", help = "tasks served after the new experiment arrives", type = int, default = 40)
+args = parser.parse_args()
+
+db_folder = tempfile.mkdtemp()
+try:
+	db = facebook_utils.QueueDB(db_folder = db_folder, verbose = False, scheduler = facebook_utils.FairScheduler())
+	db.open()
+
+	# A new experiment should share the runner with an old one, not starve it until it catches up
+	create_experiment_task(db, "old")
+	served = serve_tasks(db, args.backlog)
+	assert "old" in served or args.backlog == 0, served
+	create_experiment_task(db, "new")
+	served = serve_tasks(db, args.rounds)
+	print("Equal weights after a backlog of {}: {}".format(args.backlog, served))
+	assert abs(served["old"] - served["new"]) <= 2, served
+
+	# Service is shared in proportion to task_weight
+	create_experiment_task(db, "heavy", task_weight = 2.0)
+	served = serve_tasks(db, args.rounds * 2)
+	print("Weights 1:1:2 : {}".format(served))
+	assert abs(served["heavy"] - 2 * served["old"]) <= 3, served
+	assert abs(served["old"] - served["new"]) <= 2, served
+
+	# Higher task_priority is always served first
+	create_experiment_task(db, "urgent", task_priority = 1)
+	served = serve_tasks(db, args.rounds)
+	print("Higher priority: {}".format(served))
+	assert served == {"urgent": args.rounds}, served
+
+	db.close()
+finally:
+	shutil.rmtree(db_folder)
+print("OK")
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import facebook_utils
+from facebook_utils.token_pool import INVALID_TOKEN_ERROR_CODE
+
+import shutil
+import tempfile
+import threading
+import time
+
+# Tokens as they appear in the token config file
+class TestTokenManager:
+	def __init__(self, access_tokens):
+		self.access_tokens = access_tokens
+	def get_user_access_tokens(self):
+		return dict(self.access_tokens)
+	def invalidate(self):
+		pass
+
+db_folder = tempfile.mkdtemp()
+try:
+	# Once the only token is rejected, the pool waits for it to be replaced
+	token_manager = TestTokenManager({"a": "token-1"})
+	token_pool = facebook_utils.TokenPool(token_manager, db_folder = db_folder, verbose = False, wait_duration = 5.0, wait_interval = 0.1)
+	assert token_pool.get_next_token()[0] == "a"
+	token_pool.report_result("a", INVALID_TOKEN_ERROR_CODE)
+	def replace_token():
+		time.sleep(0.5)
+		token_manager.access_tokens = {"a": "token-2"}
+	threading.Thread(target = replace_token).start()
+	start_timestamp = time.time()
+	assert token_pool.get_next_token()[0] == "a"
+	assert 0.5 <= time.time() - start_timestamp < 5.0
+	assert token_pool.get_access_token("a") == "token-2"
+	print("Waited for a replaced token")
+
+	# If no token is replaced in time, the pool gives up
+	token_pool = facebook_utils.TokenPool(token_manager, db_folder = db_folder, verbose = False, wait_duration = 0.3, wait_interval = 0.1)
+	token_pool.report_result("a", INVALID_TOKEN_ERROR_CODE)
+	assert token_pool.get_next_token() == (None, None)
+	print("Gave up without a healthy token")
+finally:
+	shutil.rmtree(db_folder)
+print("OK")
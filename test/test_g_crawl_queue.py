@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+from common import Constants
+import google_utils
+from google_utils.google_ad_creatives_db import CRAWL_PENDING, CRAWL_IN_PROGRESS, CRAWL_DONE
+from google_utils.google_ad_creatives_download_helper import CRAWL_LEASE_DURATION, MAX_CRAWL_ATTEMPTS, IMAGE_AD_TYPE, TEXT_AD_TYPE
+
+from datetime import datetime, timedelta
+import os
+import shutil
+import sqlalchemy
+import tempfile
+
+TIMESTAMP = "test"
+IMAGE_AD_IDS = ["I{:d}".format(i) for i in range(1, 7)]
+TEXT_AD_IDS = ["T1"]
+
+def create_ad_library(ad_ids_by_type):
+	folder = os.path.join(Constants.DOWNLOADS_PATH, Constants.GOOGLE_DOWNLOADS_FOLDER, TIMESTAMP)
+	os.makedirs(folder)
+	engine = sqlalchemy.create_engine("sqlite:///{}".format(os.path.join(folder, Constants.GOOGLE_AD_LIBRARY_DB_FILENAME)))
+	library_db = google_utils.GoogleAdLibraryDB(engine)
+	rows = [
+		{"ad_id": ad_id, "ad_url": "https://transparencyreport.google.com/creative/{:s}".format(ad_id), "ad_type": ad_type, "advertiser_id": "AR1"}
+		for (ad_type, ad_ids) in ad_ids_by_type.items() for ad_id in ad_ids
+	]
+	with engine.connect() as conn:
+		conn.execute(library_db.creative_stats_table.insert(), rows)
+
+def get_crawl_queue(helper):
+	crawl_queue = helper.db.crawl_queue
+	s = sqlalchemy.select([crawl_queue.c.ad_id, crawl_queue.c.state, crawl_queue.c.lease_owner, crawl_queue.c.lease_expiry, crawl_queue.c.attempt_count])
+	return {row["ad_id"]: dict(row) for row in helper.conn.execute(s)}
+
+def set_crawl_queue(helper, ad_ids, **values):
+	crawl_queue = helper.db.crawl_queue
+	helper.conn.execute(crawl_queue.update().where(crawl_queue.c.ad_id.in_(ad_ids)).values(**values))
+
+downloads_path = tempfile.mkdtemp()
+Constants.DOWNLOADS_PATH = downloads_path
+try:
+	create_ad_library({IMAGE_AD_TYPE: IMAGE_AD_IDS, TEXT_AD_TYPE: TEXT_AD_IDS})
+	helper = google_utils.GoogleAdCreativesDownloadHelper(TIMESTAMP, verbose = False)
+	other_helper = google_utils.GoogleAdCreativesDownloadHelper(TIMESTAMP, verbose = False)
+
+	# Ads are added to the crawl queue once per download and ad type; ads downloaded before are already done
+	helper.conn.execute(helper.db.image_ads.insert(), {"ad_id": "I1", "ad_url": "https://transparencyreport.google.com/creative/I1"})
+	helper._seed_crawl_queue(IMAGE_AD_TYPE)
+	helper._seed_crawl_queue(IMAGE_AD_TYPE)
+	crawl_queue = get_crawl_queue(helper)
+	assert sorted(crawl_queue.keys()) == IMAGE_AD_IDS
+	assert crawl_queue["I1"]["state"] == CRAWL_DONE
+	assert helper._count_crawl_queue(IMAGE_AD_TYPE) == {CRAWL_PENDING: 5, CRAWL_IN_PROGRESS: 0, CRAWL_DONE: 1}
+	print("Seeded the crawl queue")
+
+	# Crawlers sharing the creatives database never claim the same ads
+	claimed_ad_ids = helper._claim_ad_ids(IMAGE_AD_TYPE, 2)
+	other_claimed_ad_ids = other_helper._claim_ad_ids(IMAGE_AD_TYPE, 2)
+	print("Claimed {} and {}".format(claimed_ad_ids, other_claimed_ad_ids))
+	assert claimed_ad_ids == ["I2", "I3"]
+	assert other_claimed_ad_ids == ["I4", "I5"]
+	crawl_queue = get_crawl_queue(helper)
+	for ad_id in claimed_ad_ids + other_claimed_ad_ids:
+		assert crawl_queue[ad_id]["state"] == CRAWL_IN_PROGRESS
+		assert crawl_queue[ad_id]["attempt_count"] == 1
+		assert crawl_queue[ad_id]["lease_expiry"] > datetime.now() + CRAWL_LEASE_DURATION - timedelta(minutes = 1)
+	assert crawl_queue["I2"]["lease_owner"] == crawl_queue["I3"]["lease_owner"]
+	assert crawl_queue["I2"]["lease_owner"] != crawl_queue["I4"]["lease_owner"]
+	assert other_helper._claim_ad_ids(IMAGE_AD_TYPE, 10) == ["I6"]
+	assert helper._claim_ad_ids(IMAGE_AD_TYPE, 10) == []
+	assert helper._claim_ad_ids(TEXT_AD_TYPE, 10) == []
+
+	# The ads of a crawler that was killed can be claimed again once their lease expires
+	set_crawl_queue(helper, ["I4"], lease_expiry = datetime.now() - timedelta(seconds = 1))
+	assert helper._claim_ad_ids(IMAGE_AD_TYPE, 10) == ["I4"]
+	assert get_crawl_queue(helper)["I4"]["attempt_count"] == 2
+	print("Reclaimed an expired lease")
+
+	# Ads are not claimed again after MAX_CRAWL_ATTEMPTS attempts, even when their lease expires
+	set_crawl_queue(helper, ["I2"], state = CRAWL_PENDING, lease_owner = None, lease_expiry = None, attempt_count = MAX_CRAWL_ATTEMPTS)
+	set_crawl_queue(helper, ["I3"], lease_expiry = datetime.now() - timedelta(seconds = 1), attempt_count = MAX_CRAWL_ATTEMPTS)
+	assert helper._claim_ad_ids(IMAGE_AD_TYPE, 10) == []
+	set_crawl_queue(helper, ["I2"], attempt_count = MAX_CRAWL_ATTEMPTS - 1)
+	assert helper._claim_ad_ids(IMAGE_AD_TYPE, 10) == ["I2"]
+
+	# Claimed ads are looked up in batches, in the order in which they were claimed
+	set_crawl_queue(helper, IMAGE_AD_IDS, state = CRAWL_PENDING, lease_owner = None, lease_expiry = None, attempt_count = 0)
+	ad_infos = list(helper._iter_claimed_ad_infos(IMAGE_AD_TYPE, 4))
+	assert [ad_info.id for ad_info in ad_infos] == IMAGE_AD_IDS[:4]
+	assert all(ad_info.type == IMAGE_AD_TYPE for ad_info in ad_infos)
+	print("OK")
+finally:
+	shutil.rmtree(downloads_path)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+from common import Constants
+import google_utils
+from google_utils.google_ad_creatives_db import ASSET_HTML, ASSET_IMAGE_URL
+from google_utils.google_ad_creatives_download_helper import AdInfo, IMAGE_AD_TYPE, TEXT_AD_TYPE
+
+import os
+import shutil
+import sqlalchemy
+import tempfile
+
+TIMESTAMP = "test"
+
+def get_ad_row(ad_id, ad_html, **values):
+	return {"ad_id": ad_id, "ad_url": "https://transparencyreport.google.com/creative/{:s}".format(ad_id), "ad_html": ad_html, "is_url_accessed": True, "is_ad_found": True, **values}
+
+# Write the row of an ad and its creative asset, as the crawl loop does
+def write_ad(helper, ad_type, table, row):
+	ad_info = AdInfo(id = row["ad_id"], url = row["ad_url"], type = ad_type)
+	helper.screenshot_rows = []
+	helper.screenshot_futures = {}
+	asset_row = helper._get_asset_row(ad_info, row)
+	helper.writer.write(table, ad_info.id, row, [], asset_row)
+	return asset_row
+
+downloads_path = tempfile.mkdtemp()
+Constants.DOWNLOADS_PATH = downloads_path
+try:
+	folder = os.path.join(Constants.DOWNLOADS_PATH, Constants.GOOGLE_DOWNLOADS_FOLDER, TIMESTAMP)
+	os.makedirs(folder)
+	google_utils.GoogleAdLibraryDB(sqlalchemy.create_engine("sqlite:///{}".format(os.path.join(folder, Constants.GOOGLE_AD_LIBRARY_DB_FILENAME))))
+	helper = google_utils.GoogleAdCreativesDownloadHelper(TIMESTAMP, verbose = False)
+	db = helper.db
+	helper.writer = google_utils.GoogleAdCreativesWriter(helper.engine, db, verbose = False)
+	helper.writer.start()
+
+	# Text ads with the same HTML (up to whitespace) share an asset; image ads with the same image url share an asset
+	text_asset_rows = [
+		write_ad(helper, TEXT_AD_TYPE, db.text_ads, get_ad_row("T1", "<div>\n  <p>Buy now</p>\n</div>")),
+		write_ad(helper, TEXT_AD_TYPE, db.text_ads, get_ad_row("T2", "<div><p>Buy now</p></div>")),
+	]
+	image_asset_rows = [
+		write_ad(helper, IMAGE_AD_TYPE, db.image_ads, get_ad_row("I1", "<img src=\"https://img/1.png\" alt=\"a\">", image_url = "https://img/1.png")),
+		write_ad(helper, IMAGE_AD_TYPE, db.image_ads, get_ad_row("I2", "<img src=\"https://IMG/1.png\" alt=\"b\">", image_url = "https://IMG/1.png")),
+	]
+	helper.writer.close()
+	assert [asset_row["asset_kind"] for asset_row in text_asset_rows + image_asset_rows] == [ASSET_HTML, ASSET_HTML, ASSET_IMAGE_URL, ASSET_IMAGE_URL]
+	assert text_asset_rows[0]["asset_hash"] == text_asset_rows[1]["asset_hash"]
+	assert image_asset_rows[0]["asset_hash"] == image_asset_rows[1]["asset_hash"]
+	assert helper.conn.execute(sqlalchemy.select([sqlalchemy.func.count()]).select_from(db.creative_assets)).scalar() == 2
+
+	# Each ad keeps its own HTML, and the HTML of an asset identified by its HTML is read back through its refs
+	for table in [db.text_ads, db.image_ads]:
+		s = sqlalchemy.select([table.c.ad_id, table.c.ad_html, db.creative_assets.c.asset_kind, db.creative_assets.c.ad_html.label("asset_html")]).select_from(
+			table.join(db.creative_asset_refs, db.creative_asset_refs.c.ad_id == table.c.ad_id).join(db.creative_assets, db.creative_assets.c.asset_hash == db.creative_asset_refs.c.asset_hash)
+		).order_by(table.c.ad_id)
+		for row in helper.conn.execute(s):
+			print("{} ({}): {!r} / {!r}".format(row["ad_id"], row["asset_kind"], row["ad_html"], row["asset_html"]))
+			assert row["ad_html"] is not None
+			if row["asset_kind"] == ASSET_HTML:
+				assert helper._normalize_html(row["asset_html"]) == helper._normalize_html(row["ad_html"])
+			else:
+				assert row["asset_html"] is None
+	assert helper.conn.execute(sqlalchemy.select([db.image_ads.c.ad_html]).where(db.image_ads.c.ad_id == "I2")).scalar() == "<img src=\"https://IMG/1.png\" alt=\"b\">"
+	helper.conn.close()
+finally:
+	shutil.rmtree(downloads_path)
+print("OK")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import google_utils
+from google_utils.google_ad_creatives_db import CRAWL_PENDING, CRAWL_IN_PROGRESS, CRAWL_DONE, SCREENSHOT_AD, SCREENSHOT_ERROR, ASSET_HTML
+
+from concurrent.futures import Future
+import os
+import shutil
+import sqlalchemy
+import tempfile
+import time
+
+AD_COUNT = 7
+
+def get_text_ad_row(ad_id):
+	return {"ad_id": ad_id, "ad_url": "https://transparencyreport.google.com/creative/{:s}".format(ad_id), "is_url_accessed": True, "is_ad_found": True}
+
+def claim_ads(conn, db, ad_ids):
+	conn.execute(db.crawl_queue.delete())
+	conn.execute(db.crawl_queue.insert(), [{"ad_id": ad_id, "ad_type": "Text", "state": CRAWL_IN_PROGRESS, "lease_owner": "test", "attempt_count": 1} for ad_id in ad_ids])
+
+def get_states(conn, db):
+	return {row["ad_id"]: row["state"] for row in conn.execute(sqlalchemy.select([db.crawl_queue.c.ad_id, db.crawl_queue.c.state]))}
+
+def count_text_ads(conn, db):
+	return conn.execute(sqlalchemy.select([sqlalchemy.func.count()]).select_from(db.text_ads)).scalar()
+
+db_folder = tempfile.mkdtemp()
+try:
+	engine = sqlalchemy.create_engine("sqlite:///{}".format(os.path.join(db_folder, "google_ad_creatives.sqlite")))
+	db = google_utils.GoogleAdCreativesDB(engine)
+	conn = engine.connect()
+
+	# Rows are written in batches of batch_size rows, and close writes the last partial batch
+	ad_ids = ["T{:d}".format(i) for i in range(0, AD_COUNT)]
+	claim_ads(conn, db, ad_ids)
+	writer = google_utils.GoogleAdCreativesWriter(engine, db, batch_size = 3, flush_interval = 60.0, verbose = False)
+	writer.start()
+	for ad_id in ad_ids:
+		writer.write(db.text_ads, ad_id, get_text_ad_row(ad_id))
+	writer.close()
+	print("Wrote {} rows in {} transactions".format(writer.row_count, writer.batch_count))
+	assert writer.row_count == AD_COUNT
+	assert writer.batch_count == 3
+	assert count_text_ads(conn, db) == AD_COUNT
+	assert get_states(conn, db) == {ad_id: CRAWL_DONE for ad_id in ad_ids}
+
+	# A partial batch is written after flush_interval seconds, without waiting for more rows
+	claim_ads(conn, db, ["T10", "T11"])
+	writer = google_utils.GoogleAdCreativesWriter(engine, db, batch_size = 100, flush_interval = 0.2, verbose = False)
+	writer.start()
+	writer.write(db.text_ads, "T10", get_text_ad_row("T10"))
+	time.sleep(1.0)
+	assert writer.batch_count == 1
+	assert count_text_ads(conn, db) == AD_COUNT + 1
+
+	# An ad without a row goes back to the crawl queue, with its lease released
+	writer.write(db.text_ads, "T11", None)
+	writer.close()
+	assert writer.batch_count == 2
+	assert get_states(conn, db) == {"T10": CRAWL_DONE, "T11": CRAWL_PENDING}
+	assert conn.execute(sqlalchemy.select([db.crawl_queue.c.lease_owner]).where(db.crawl_queue.c.ad_id == "T11")).scalar() is None
+	print("Flushed partial batches")
+
+	# Screenshots are written once their files are stored, and dropped (with the screenshot of the asset) if that failed
+	claim_ads(conn, db, ["T13"])
+	writer = google_utils.GoogleAdCreativesWriter(engine, db, batch_size = 1, verbose = False)
+	writer.start()
+	(stored_future, failed_future) = (Future(), Future())
+	screenshot_rows = [
+		{"ad_id": "T13", "kind": SCREENSHOT_ERROR, "content_hash": "stored", "file_format": "webp"},
+		{"ad_id": "T13", "kind": SCREENSHOT_AD, "content_hash": "failed", "file_format": "webp"},
+	]
+	asset_row = {"asset_hash": "A13", "ad_type": "Text", "asset_kind": ASSET_HTML, "media_url": None, "ad_html": "<div></div>", "screenshot_hash": "failed", "screenshot_format": "webp"}
+	writer.write(db.text_ads, "T13", get_text_ad_row("T13"), screenshot_rows, asset_row, {"stored": stored_future, "failed": failed_future})
+	time.sleep(0.2)
+	assert count_text_ads(conn, db) == AD_COUNT + 1
+	stored_future.set_result(None)
+	failed_future.set_exception(IOError("disk full"))
+	writer.close()
+	assert count_text_ads(conn, db) == AD_COUNT + 2
+	assert [row["content_hash"] for row in conn.execute(sqlalchemy.select([db.ad_screenshots.c.content_hash]))] == ["stored"]
+	assert conn.execute(sqlalchemy.select([db.creative_assets.c.screenshot_hash])).scalar() is None
+	print("Waited for screenshots to be stored")
+
+	# A failed batch is reported to the caller, on the next write or on close
+	writer = google_utils.GoogleAdCreativesWriter(engine, db, batch_size = 1, verbose = False)
+	writer.start()
+	missing_table = sqlalchemy.Table("missing_ads", sqlalchemy.MetaData(), sqlalchemy.Column("ad_id", sqlalchemy.String))
+	writer.write(missing_table, "T12", {"ad_id": "T12"})
+	try:
+		writer.close()
+	except sqlalchemy.exc.OperationalError:
+		print("Reported a failed batch")
+	else:
+		assert False, "close did not report the failed batch"
+	conn.close()
+finally:
+	shutil.rmtree(db_folder)
+print("OK")